@@ -16,6 +16,7 @@ setuptools.setup(
     long_description_content_type="text/plain",
     url="https://github.com/PaddlePaddle/x2paddle",
     packages=setuptools.find_packages(),
+    package_data={'x2paddle.decoder': ['caffe.desc']},
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: Apache Software License",
@@ -0,0 +1,511 @@
+#   Copyright (c) 2019  PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Benchmark the conversion of synthetic models, e.g.
+
+    python tools/benchmark_conversion.py --framework onnx caffe tensorflow \\
+        --model conv residual transformer multihead \\
+        --nodes 100 1000 10000 100000 --save_dir bench --result bench.json
+
+The models are generated offline (ONNX with onnx.helper, TensorFlow GraphDef
+with the TensorFlow python API, Caffe prototxt/caffemodel with the bundled
+caffe.proto), each conversion runs in its own process, and the time of each
+stage, the nodes/sec and the peak memory are saved in the result file. With
+--baseline, the result is compared with a previous result file.
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+
+CONV_CHANNELS = 4
+CONV_SIZE = 8
+DENSE_DIM = 16
+HEAD_NUM = 4
+
+
+class ModelSpec(object):
+    """
+    A framework independent description of a synthetic model, the layers
+    are (op, name, inputs), ops are conv/dense/relu/add/mul/softmax.
+    """
+
+    def __init__(self, layout):
+        # layout is 'image' ([1, C, H, W]) or 'vector' ([1, D])
+        self.layout = layout
+        self.layers = list()
+        self.outputs = list()
+
+    def add(self, op, inputs):
+        name = '{}_{}'.format(op, len(self.layers))
+        self.layers.append((op, name, inputs))
+        return name
+
+    def __len__(self):
+        return len(self.layers)
+
+
+def conv_stack(nodes):
+    spec = ModelSpec('image')
+    x = 'x'
+    while len(spec) < nodes:
+        x = spec.add('relu', [spec.add('conv', [x])])
+    spec.outputs.append(x)
+    return spec
+
+
+def residual(nodes):
+    spec = ModelSpec('image')
+    x = 'x'
+    while len(spec) < nodes:
+        y = spec.add('relu', [spec.add('conv', [x])])
+        y = spec.add('conv', [y])
+        x = spec.add('relu', [spec.add('add', [x, y])])
+    spec.outputs.append(x)
+    return spec
+
+
+def transformer(nodes):
+    # attention-shaped block: q/k/v projections, softmax gating, output
+    # projection, residual add and the feed-forward layers
+    spec = ModelSpec('vector')
+    x = 'x'
+    while len(spec) < nodes:
+        q = spec.add('dense', [x])
+        k = spec.add('dense', [x])
+        v = spec.add('dense', [x])
+        s = spec.add('softmax', [spec.add('mul', [q, k])])
+        a = spec.add('dense', [spec.add('mul', [s, v])])
+        x = spec.add('add', [x, a])
+        h = spec.add('relu', [spec.add('dense', [x])])
+        x = spec.add('add', [x, spec.add('dense', [h])])
+    spec.outputs.append(x)
+    return spec
+
+
+def multihead(nodes):
+    spec = ModelSpec('image')
+    x = 'x'
+    # a quarter of the nodes are in the heads
+    while len(spec) < nodes * 3 // 4:
+        x = spec.add('relu', [spec.add('conv', [x])])
+    head_nodes = max((nodes - len(spec)) // HEAD_NUM, 2)
+    for i in range(HEAD_NUM):
+        y = x
+        for j in range(head_nodes // 2):
+            y = spec.add('relu', [spec.add('conv', [y])])
+        spec.outputs.append(y)
+    return spec
+
+
+model_generators = {
+    'conv': conv_stack,
+    'residual': residual,
+    'transformer': transformer,
+    'multihead': multihead
+}
+
+
+def get_weights(op, rng):
+    if op == 'conv':
+        return [
+            rng.standard_normal([CONV_CHANNELS, CONV_CHANNELS, 3, 3]).astype(
+                'float32') * 0.1,
+            rng.standard_normal([CONV_CHANNELS]).astype('float32') * 0.1
+        ]
+    if op == 'dense':
+        return [
+            rng.standard_normal([DENSE_DIM, DENSE_DIM]).astype('float32') *
+            0.1, rng.standard_normal([DENSE_DIM]).astype('float32') * 0.1
+        ]
+    return []
+
+
+def get_input_shape(spec):
+    if spec.layout == 'image':
+        return [1, CONV_CHANNELS, CONV_SIZE, CONV_SIZE]
+    return [1, DENSE_DIM]
+
+
+def save_onnx_model(spec, save_dir):
+    from onnx import helper, numpy_helper, onnx_pb
+    rng = np.random.RandomState(0)
+    nodes = list()
+    initializers = list()
+    for op, name, inputs in spec.layers:
+        weight_names = list()
+        for i, weight in enumerate(get_weights(op, rng)):
+            weight_names.append('{}_w{}'.format(name, i))
+            initializers.append(
+                numpy_helper.from_array(weight, weight_names[-1]))
+        if op == 'conv':
+            nodes.append(
+                helper.make_node(
+                    'Conv',
+                    inputs + weight_names, [name],
+                    kernel_shape=[3, 3],
+                    pads=[1, 1, 1, 1]))
+        elif op == 'dense':
+            # weight of Gemm is [in, out] without transB
+            nodes.append(
+                helper.make_node('Gemm', inputs + weight_names, [name]))
+        elif op == 'softmax':
+            nodes.append(helper.make_node('Softmax', inputs, [name], axis=1))
+        else:
+            op_type = {'relu': 'Relu', 'add': 'Add', 'mul': 'Mul'}[op]
+            nodes.append(helper.make_node(op_type, inputs, [name]))
+    input_shape = get_input_shape(spec)
+    output_shape = list(input_shape)
+    graph = helper.make_graph(
+        nodes,
+        'x2paddle_benchmark',
+        [
+            helper.make_tensor_value_info('x', onnx_pb.TensorProto.FLOAT,
+                                          input_shape)
+        ],
+        [
+            helper.make_tensor_value_info(name, onnx_pb.TensorProto.FLOAT,
+                                          output_shape)
+            for name in spec.outputs
+        ],
+        initializer=initializers)
+    model = helper.make_model(
+        graph,
+        producer_name='x2paddle_benchmark',
+        opset_imports=[helper.make_opsetid('', 9)])
+    model.ir_version = 4
+    path = os.path.join(save_dir, 'model.onnx')
+    with open(path, 'wb') as f:
+        f.write(model.SerializeToString())
+    return {'model': path}
+
+
+def save_tf_model(spec, save_dir):
+    import tensorflow as tf
+    if hasattr(tf, 'compat') and hasattr(tf.compat, 'v1'):
+        tf = tf.compat.v1
+    rng = np.random.RandomState(0)
+    input_shape = get_input_shape(spec)
+    if spec.layout == 'image':
+        # tensorflow models are NHWC
+        input_shape = [input_shape[0], input_shape[2], input_shape[3],
+                       input_shape[1]]
+    graph = tf.Graph()
+    with graph.as_default():
+        tensors = {'x': tf.placeholder(tf.float32, input_shape, name='x')}
+        for op, name, inputs in spec.layers:
+            inputs = [tensors[input] for input in inputs]
+            weights = get_weights(op, rng)
+            if op == 'conv':
+                kernel = tf.constant(weights[0].transpose((2, 3, 1, 0)))
+                out = tf.nn.conv2d(
+                    inputs[0], kernel, strides=[1, 1, 1, 1], padding='SAME')
+                out = tf.nn.bias_add(out, tf.constant(weights[1]), name=name)
+            elif op == 'dense':
+                out = tf.matmul(inputs[0], tf.constant(weights[0]))
+                out = tf.nn.bias_add(out, tf.constant(weights[1]), name=name)
+            elif op == 'relu':
+                out = tf.nn.relu(inputs[0], name=name)
+            elif op == 'add':
+                out = tf.add(inputs[0], inputs[1], name=name)
+            elif op == 'mul':
+                out = tf.multiply(inputs[0], inputs[1], name=name)
+            elif op == 'softmax':
+                out = tf.nn.softmax(inputs[0], name=name)
+            tensors[name] = out
+        for i, name in enumerate(spec.outputs):
+            tf.identity(tensors[name], name='output_{}'.format(i))
+    path = os.path.join(save_dir, 'model.pb')
+    with open(path, 'wb') as f:
+        f.write(graph.as_graph_def().SerializeToString())
+    return {'model': path}
+
+
+def save_caffe_model(spec, save_dir):
+    from google.protobuf import text_format
+    from x2paddle.decoder.caffe_decoder import load_caffe_proto
+    caffepb = load_caffe_proto()
+    rng = np.random.RandomState(0)
+    net = caffepb.NetParameter()
+    net.name = 'x2paddle_benchmark'
+    layer = net.layer.add()
+    layer.name = 'x'
+    layer.type = 'Input'
+    layer.top.append('x')
+    layer.input_param.shape.add().dim.extend(get_input_shape(spec))
+    for op, name, inputs in spec.layers:
+        layer = net.layer.add()
+        layer.name = name
+        layer.bottom.extend(inputs)
+        layer.top.append(name)
+        if op == 'conv':
+            layer.type = 'Convolution'
+            layer.convolution_param.num_output = CONV_CHANNELS
+            layer.convolution_param.kernel_size.append(3)
+            layer.convolution_param.pad.append(1)
+        elif op == 'dense':
+            layer.type = 'InnerProduct'
+            layer.inner_product_param.num_output = DENSE_DIM
+        elif op == 'relu':
+            layer.type = 'ReLU'
+        elif op == 'softmax':
+            layer.type = 'Softmax'
+        else:
+            layer.type = 'Eltwise'
+            layer.eltwise_param.operation = caffepb.EltwiseParameter.SUM \
+                if op == 'add' else caffepb.EltwiseParameter.PROD
+        for weight in get_weights(op, rng):
+            if op == 'dense' and len(weight.shape) == 2:
+                # InnerProduct weight is [out, in]
+                weight = weight.T
+            blob = layer.blobs.add()
+            blob.shape.dim.extend(weight.shape)
+            blob.data.extend(weight.flatten().tolist())
+    weight_path = os.path.join(save_dir, 'model.caffemodel')
+    with open(weight_path, 'wb') as f:
+        f.write(net.SerializeToString())
+    for layer in net.layer:
+        del layer.blobs[:]
+    proto_path = os.path.join(save_dir, 'model.prototxt')
+    with open(proto_path, 'w') as f:
+        f.write(text_format.MessageToString(net))
+    return {'prototxt': proto_path, 'weight': weight_path}
+
+
+model_savers = {
+    'onnx': save_onnx_model,
+    'tensorflow': save_tf_model,
+    'caffe': save_caffe_model
+}
+
+
+def convert(framework, files, save_dir, profile_path, trace_memory):
+    """ run in the child process, convert the model with profiling """
+    from x2paddle import convert
+    from x2paddle.core.logger import logger
+    from x2paddle.core.profiler import profiler, get_peak_rss
+    logger.configure(quiet=True)
+    profiler.enable(trace_memory=trace_memory)
+    start = time.time()
+    converted = False
+    if framework == 'onnx':
+        converted = convert.onnx2paddle(files['model'], save_dir)
+    elif framework == 'tensorflow':
+        converted = convert.tf2paddle(files['model'], save_dir)
+    elif framework == 'caffe':
+        converted = convert.caffe2paddle(files['prototxt'], files['weight'],
+                                         save_dir, None)
+    total_time = time.time() - start
+    # the converters return False without raising on version errors, the
+    # inference_model of an earlier run may still be in save_dir
+    if not converted:
+        sys.exit("[ERROR] {} model was not converted".format(framework))
+    profiler.save(
+        profile_path, total_time=total_time, peak_rss=get_peak_rss())
+    profiler.disable()
+
+
+def run_case(args, framework, model, nodes):
+    case_dir = os.path.join(args.save_dir, '{}_{}_{}'.format(
+        framework, model, nodes))
+    if not os.path.isdir(case_dir):
+        os.makedirs(case_dir)
+    result = {
+        'framework': framework,
+        'model': model,
+        'target_nodes': nodes,
+    }
+    spec = model_generators[model](nodes)
+    result['nodes'] = len(spec)
+    start = time.time()
+    try:
+        files = model_savers[framework](spec, case_dir)
+    except ImportError as e:
+        result['status'] = 'skipped: {}'.format(e)
+        return result
+    result['generate_time'] = time.time() - start
+
+    profile_path = os.path.join(case_dir, 'profile.json')
+    if os.path.exists(profile_path):
+        os.remove(profile_path)
+    cmd = [
+        sys.executable,
+        os.path.abspath(__file__), '--convert', json.dumps({
+            'framework': framework,
+            'files': files,
+            'save_dir': os.path.join(case_dir, 'paddle_model'),
+            'profile_path': profile_path,
+            'trace_memory': args.trace_memory
+        })
+    ]
+    try:
+        subprocess.check_call(cmd, timeout=args.timeout)
+    except subprocess.TimeoutExpired:
+        result['status'] = 'timeout'
+        return result
+    except subprocess.CalledProcessError as e:
+        result['status'] = 'failed with exit code {}'.format(e.returncode)
+        return result
+    if not os.path.exists(profile_path):
+        result['status'] = 'failed'
+        return result
+    with open(profile_path) as f:
+        profile = json.load(f)
+    result['status'] = 'ok'
+    result['total_time'] = profile['total_time']
+    result['nodes_per_sec'] = result['nodes'] / profile['total_time']
+    result['peak_rss'] = profile['peak_rss']
+    result['stages'] = dict()
+    peak_traced = None
+    for record in profile['stages']:
+        result['stages'][record['stage']] = record['wall_time']
+        if 'peak_traced_memory' in record:
+            peak_traced = max(peak_traced or 0,
+                              record['peak_traced_memory'])
+    if peak_traced is not None:
+        result['peak_traced_memory'] = peak_traced
+    if 'op_mapping' in result['stages']:
+        result['op_mapping_nodes_per_sec'] = result['nodes'] / max(
+            result['stages']['op_mapping'], 1e-9)
+    return result
+
+
+def get_info():
+    import x2paddle
+    return {
+        'x2paddle': x2paddle.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    baseline_results = dict()
+    for result in baseline['results']:
+        key = (result['framework'], result['model'], result['target_nodes'])
+        baseline_results[key] = result
+    print("\n{:<12}{:<13}{:>8}{:>14}{:>14}{:>9}".format(
+        'framework', 'model', 'nodes', 'baseline(s)', 'current(s)',
+        'speedup'))
+    for result in results:
+        key = (result['framework'], result['model'], result['target_nodes'])
+        base = baseline_results.get(key, None)
+        if base is None or result['status'] != 'ok' \
+                or base.get('status') != 'ok':
+            continue
+        print("{:<12}{:<13}{:>8}{:>14.3f}{:>14.3f}{:>8.2f}x".format(
+            key[0], key[1], key[2], base['total_time'],
+            result['total_time'], base['total_time'] / result['total_time']))
+
+
+def print_results(results):
+    print("\n{:<12}{:<13}{:>8}{:>12}{:>12}{:>14}  {}".format(
+        'framework', 'model', 'nodes', 'time(s)', 'nodes/sec', 'peak_rss(MB)',
+        'status'))
+    for result in results:
+        if result['status'] == 'ok':
+            print("{:<12}{:<13}{:>8}{:>12.3f}{:>12.1f}{:>14.1f}  ok".format(
+                result['framework'], result['model'], result['nodes'],
+                result['total_time'], result['nodes_per_sec'],
+                (result['peak_rss'] or 0) / 1024.0 / 1024.0))
+        else:
+            print("{:<12}{:<13}{:>8}{:>12}{:>12}{:>14}  {}".format(
+                result['framework'], result['model'], result['nodes'], '-',
+                '-', '-', result['status']))
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--framework",
+        nargs='+',
+        default=['onnx', 'caffe', 'tensorflow'],
+        choices=sorted(model_savers.keys()),
+        help="source frameworks of the synthetic models")
+    parser.add_argument(
+        "--model",
+        nargs='+',
+        default=sorted(model_generators.keys()),
+        choices=sorted(model_generators.keys()),
+        help="structures of the synthetic models")
+    parser.add_argument(
+        "--nodes",
+        nargs='+',
+        type=int,
+        default=[100, 1000, 10000, 100000],
+        help="number of nodes of the synthetic models")
+    parser.add_argument(
+        "--save_dir",
+        default="benchmark_models",
+        help="directory of the generated and converted models")
+    parser.add_argument(
+        "--result",
+        default="benchmark_result.json",
+        help="path to save the result")
+    parser.add_argument(
+        "--baseline", default=None, help="result file to compare with")
+    parser.add_argument(
+        "--timeout",
+        type=int,
+        default=3600,
+        help="seconds allowed for each conversion")
+    parser.add_argument(
+        "--trace_memory",
+        action="store_true",
+        default=False,
+        help="also record the peak python memory of each stage, "
+        "which slows down the conversion")
+    parser.add_argument("--convert", default=None, help=argparse.SUPPRESS)
+    return parser
+
+
+def main():
+    args = arg_parser().parse_args()
+    if args.convert is not None:
+        case = json.loads(args.convert)
+        convert(case['framework'], case['files'], case['save_dir'],
+                case['profile_path'], case['trace_memory'])
+        return
+
+    results = list()
+    for framework in args.framework:
+        for model in args.model:
+            for nodes in sorted(args.nodes):
+                print("Benchmarking {} {} model with {} nodes ...".format(
+                    framework, model, nodes))
+                result = run_case(args, framework, model, nodes)
+                results.append(result)
+                # keep the finished cases if a large case is interrupted
+                with open(args.result, 'w') as f:
+                    json.dump(
+                        {
+                            'info': get_info(),
+                            'results': results
+                        }, f, indent=2)
+    print_results(results)
+    if args.baseline is not None:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
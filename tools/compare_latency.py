@@ -0,0 +1,354 @@
+#   Copyright (c) 2019  PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Compare the inference latency of a converted model with its source model, e.g.
+
+    python tools/compare_latency.py --paddle_model pd_model/inference_model \\
+        --framework onnx --model model.onnx --batch_size 1 4 16
+
+The Paddle model runs with the CPU executor, the source model runs with
+onnxruntime or a TensorFlow session. Both are fed with the same random inputs
+(or the arrays in --inputs .npz), and the p50/p99 latency, the throughput and
+the max absolute difference of the outputs are reported for each batch size.
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import time
+import numpy as np
+
+
+def normalize_name(name, framework):
+    """ the name of the input in the converted paddle model """
+    if framework == 'tensorflow':
+        return name.replace('/', '_').replace('-', '_').replace('^', '')
+    if framework == 'onnx':
+        for s in ' .*?\\/-:':
+            name = name.replace(s, '_')
+        return 'x2paddle_' + name
+    return name
+
+
+class PaddleRunner(object):
+    def __init__(self, model_dir):
+        import paddle.fluid as fluid
+        self.exe = fluid.Executor(fluid.CPUPlace())
+        self.scope = fluid.Scope()
+        with fluid.scope_guard(self.scope):
+            [self.program, self.feed_names,
+             self.fetch_targets] = fluid.io.load_inference_model(
+                 dirname=model_dir, executor=self.exe)
+        dtype_map = {
+            fluid.core.VarDesc.VarType.FP32: 'float32',
+            fluid.core.VarDesc.VarType.FP64: 'float64',
+            fluid.core.VarDesc.VarType.INT32: 'int32',
+            fluid.core.VarDesc.VarType.INT64: 'int64',
+            fluid.core.VarDesc.VarType.BOOL: 'bool'
+        }
+        self.inputs = list()
+        for name in self.feed_names:
+            var = self.program.global_block().var(name)
+            self.inputs.append((name, list(var.shape), dtype_map[var.dtype]))
+
+    def run(self, feed):
+        import paddle.fluid as fluid
+        with fluid.scope_guard(self.scope):
+            return self.exe.run(self.program,
+                                feed=feed,
+                                fetch_list=self.fetch_targets,
+                                return_numpy=True)
+
+
+class ONNXRunner(object):
+    def __init__(self, model_path):
+        import onnxruntime as rt
+        self.sess = rt.InferenceSession(model_path)
+        dtype_map = {
+            'tensor(float)': 'float32',
+            'tensor(double)': 'float64',
+            'tensor(int32)': 'int32',
+            'tensor(int64)': 'int64',
+            'tensor(bool)': 'bool'
+        }
+        self.inputs = list()
+        for ipt in self.sess.get_inputs():
+            shape = [dim if isinstance(dim, int) else -1 for dim in ipt.shape]
+            self.inputs.append((ipt.name, shape, dtype_map[ipt.type]))
+
+    def run(self, feed):
+        return self.sess.run(None, feed)
+
+
+class TFRunner(object):
+    def __init__(self, model_path, output_names=None):
+        import tensorflow as tf
+        if hasattr(tf, 'compat') and hasattr(tf.compat, 'v1'):
+            tf = tf.compat.v1
+        graph_def = tf.GraphDef()
+        with open(model_path, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+        self.sess = tf.Session(graph=self.graph)
+        self.inputs = list()
+        consumed = set()
+        for op in self.graph.get_operations():
+            for tensor in op.inputs:
+                consumed.add(tensor.op.name)
+            if op.type == 'Placeholder':
+                shape = op.outputs[0].shape
+                shape = [-1] * 4 if shape.dims is None else [
+                    -1 if dim is None else dim for dim in shape.as_list()
+                ]
+                self.inputs.append(
+                    (op.name, shape, op.outputs[0].dtype.as_numpy_dtype(
+                    ).dtype.name))
+        if output_names is None:
+            output_names = [
+                op.name for op in self.graph.get_operations()
+                if op.name not in consumed and len(op.outputs) > 0
+                and op.type not in ['Const', 'Placeholder', 'NoOp']
+            ]
+        self.outputs = [
+            self.graph.get_tensor_by_name(name + ':0')
+            for name in output_names
+        ]
+
+    def run(self, feed):
+        feed = {name + ':0': value for name, value in feed.items()}
+        return self.sess.run(self.outputs, feed_dict=feed)
+
+
+def make_input(shape, dtype, batch_size, value=None):
+    """
+    Build the input of batch_size, from value (repeated or sliced along the
+    first axis) if it's given, otherwise with random data.
+    """
+    if value is not None:
+        index = np.arange(batch_size) % value.shape[0]
+        return np.ascontiguousarray(value[index].astype(dtype))
+    shape = list(shape)
+    if len(shape) > 0:
+        shape[0] = batch_size
+    if any([dim < 0 for dim in shape[1:]]):
+        raise Exception(
+            "Unknown input shape {}, please give the inputs with --inputs".
+            format(shape))
+    if dtype.startswith('float'):
+        return np.random.random(shape).astype(dtype)
+    if dtype == 'bool':
+        return np.random.random(shape) > 0.5
+    return np.random.randint(0, 2, shape).astype(dtype)
+
+
+def to_source_layout(value, shape):
+    """ the paddle input of a NHWC tensorflow input is NCHW """
+    if len(shape) == 4 and value.ndim == 4 \
+            and list(value.shape[1:]) != list(shape[1:]) \
+            and list(value.shape[1:]) == [shape[3], shape[1], shape[2]]:
+        return value.transpose((0, 2, 3, 1))
+    return value
+
+
+def to_paddle_layout(value, shape):
+    if len(shape) == 4 and value.ndim == 4 \
+            and list(value.shape[1:]) != list(shape[1:]) \
+            and list(value.shape[1:]) == [shape[2], shape[3], shape[1]]:
+        return value.transpose((0, 3, 1, 2))
+    return value
+
+
+def match_inputs(paddle_inputs, source_inputs, framework):
+    """ pairs of (paddle input, source input) """
+    paddle_names = [ipt[0] for ipt in paddle_inputs]
+    pairs = list()
+    for source_input in source_inputs:
+        name = normalize_name(source_input[0], framework)
+        if name not in paddle_names:
+            break
+        pairs.append((paddle_inputs[paddle_names.index(name)],
+                      source_input))
+    if len(pairs) == len(source_inputs):
+        return pairs
+    assert len(paddle_inputs) == len(
+        source_inputs), "Inputs of the paddle model and the {} model are " \
+        "different".format(framework)
+    print("[WARNING] Inputs are matched by their order")
+    return list(zip(paddle_inputs, source_inputs))
+
+
+def max_diff(paddle_outputs, source_outputs):
+    diffs = list()
+    for paddle_output, source_output in zip(paddle_outputs, source_outputs):
+        paddle_output = np.asarray(paddle_output)
+        source_output = np.asarray(source_output)
+        if paddle_output.shape != source_output.shape and \
+                paddle_output.ndim == 4:
+            transposed = paddle_output.transpose((0, 2, 3, 1))
+            if transposed.shape == source_output.shape:
+                paddle_output = transposed
+        if paddle_output.shape != source_output.shape:
+            diffs.append(None)
+            continue
+        diffs.append(
+            float(
+                np.max(
+                    np.abs(
+                        paddle_output.astype('float64') -
+                        source_output.astype('float64')))))
+    return diffs
+
+
+def measure(runner, feed, warmup, repeat):
+    for i in range(warmup):
+        runner.run(feed)
+    latencies = list()
+    for i in range(repeat):
+        start = time.time()
+        runner.run(feed)
+        latencies.append(time.time() - start)
+    latencies = np.array(latencies) * 1000.0
+    return {
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'mean_ms': float(np.mean(latencies))
+    }
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--paddle_model",
+        required=True,
+        help="directory of the converted inference_model")
+    parser.add_argument(
+        "--framework",
+        default=None,
+        choices=['tensorflow', 'onnx'],
+        help="framework of the source model")
+    parser.add_argument("--model", default=None, help="the source model")
+    parser.add_argument(
+        "--outputs",
+        nargs='+',
+        default=None,
+        help="output nodes of the tensorflow model, in the order of the "
+        "paddle model outputs")
+    parser.add_argument(
+        "--inputs",
+        default=None,
+        help=".npz file of the inputs, keyed by the input names of the "
+        "source model (or the paddle model)")
+    parser.add_argument(
+        "--batch_size", nargs='+', type=int, default=[1, 4, 16])
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=100)
+    parser.add_argument(
+        "--result", default=None, help="path to save the result as json")
+    return parser
+
+
+def main():
+    args = arg_parser().parse_args()
+    paddle_runner = PaddleRunner(args.paddle_model)
+    source_runner = None
+    if args.framework == 'onnx':
+        source_runner = ONNXRunner(args.model)
+    elif args.framework == 'tensorflow':
+        source_runner = TFRunner(args.model, args.outputs)
+
+    if source_runner is not None:
+        pairs = match_inputs(paddle_runner.inputs, source_runner.inputs,
+                             args.framework)
+    else:
+        pairs = [(ipt, None) for ipt in paddle_runner.inputs]
+    data = dict()
+    if args.inputs is not None:
+        data = dict(np.load(args.inputs))
+
+    results = list()
+    for batch_size in args.batch_size:
+        paddle_feed = dict()
+        source_feed = dict()
+        skip = False
+        for paddle_input, source_input in pairs:
+            name, shape, dtype = paddle_input
+            for ipt in [paddle_input, source_input]:
+                if ipt is not None and len(ipt[1]) > 0 and \
+                        ipt[1][0] > 0 and ipt[1][0] != batch_size:
+                    print("[WARNING] Batch size of input {} is fixed to {}, "
+                          "skip batch size {}".format(ipt[0], ipt[1][0],
+                                                      batch_size))
+                    skip = True
+            if skip:
+                break
+            if source_input is not None and source_input[0] in data:
+                # the arrays keyed by the source names are in its layout
+                value = make_input(source_input[1], source_input[2],
+                                   batch_size, data[source_input[0]])
+                source_feed[source_input[0]] = value
+                paddle_feed[name] = np.ascontiguousarray(
+                    to_paddle_layout(value, shape).astype(dtype))
+                continue
+            value = make_input(shape, dtype, batch_size, data.get(name, None))
+            paddle_feed[name] = value
+            if source_input is not None:
+                source_feed[source_input[0]] = np.ascontiguousarray(
+                    to_source_layout(value, source_input[1]).astype(
+                        source_input[2]))
+        if skip:
+            continue
+
+        result = {'batch_size': batch_size}
+        result['paddle'] = measure(paddle_runner, paddle_feed, args.warmup,
+                                   args.repeat)
+        result['paddle']['throughput'] = batch_size * 1000.0 / result[
+            'paddle']['mean_ms']
+        if source_runner is not None:
+            result[args.framework] = measure(source_runner, source_feed,
+                                             args.warmup, args.repeat)
+            result[args.framework]['throughput'] = batch_size * 1000.0 / \
+                result[args.framework]['mean_ms']
+            result['max_abs_diff'] = max_diff(
+                paddle_runner.run(paddle_feed), source_runner.run(source_feed))
+        results.append(result)
+
+        print("batch_size: {}".format(batch_size))
+        for name in ['paddle', args.framework]:
+            if name not in result:
+                continue
+            print("  {:<12} p50: {:.3f} ms  p99: {:.3f} ms  throughput: "
+                  "{:.1f} samples/s".format(name, result[name]['p50_ms'],
+                                            result[name]['p99_ms'],
+                                            result[name]['throughput']))
+        if 'max_abs_diff' in result:
+            print("  max abs diff of outputs: {}".format(result[
+                'max_abs_diff']))
+
+    if args.result is not None:
+        with open(args.result, 'w') as f:
+            json.dump(
+                {
+                    'paddle_model': args.paddle_model,
+                    'framework': args.framework,
+                    'model': args.model,
+                    'results': results
+                },
+                f,
+                indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -12,11 +12,13 @@ fi
 
 WORK_ROOT=$1
 PY_NAME="$WORK_ROOT/caffe_pb2.py"
-$PROTOC --proto_path=$WORK_ROOT --python_out=$WORK_ROOT $WORK_ROOT/caffe.proto
+DESC_NAME="$WORK_ROOT/caffe.desc"
+$PROTOC --proto_path=$WORK_ROOT --python_out=$WORK_ROOT \
+    --descriptor_set_out=$DESC_NAME $WORK_ROOT/caffe.proto
 ret=$?
 
 if [ -e "$PY_NAME" ];then
-    echo "succeed to generate [$PY_NAME]"
+    echo "succeed to generate [$PY_NAME] and [$DESC_NAME]"
     exit 0
 else
     echo "failed to generate [$PY_NAME]"
@@ -0,0 +1,330 @@
+# Copyright (c) 2020  PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Convert the models listed in a json manifest with a pool of worker processes,
+e.g. x2paddle --batch manifest.json --workers 8 --job_timeout 600
+
+The manifest is a list of jobs, or a dict with the "jobs" list and the
+"defaults" shared by all jobs. The keys of a job are the same as the command
+line arguments, and "timeout" overrides --job_timeout for the job:
+
+    {
+        "defaults": {"framework": "onnx", "params_merge": true},
+        "jobs": [
+            {"model": "a.onnx", "save_dir": "a_pd"},
+            {"framework": "caffe", "prototxt": "b.prototxt",
+             "weight": "b.caffemodel", "save_dir": "b_pd", "timeout": 1200}
+        ]
+    }
+
+Relative paths are relative to the directory of the manifest. Each worker
+imports the frameworks once and is reused across jobs, a worker running out
+of time is killed and replaced.
+"""
+
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from collections import deque
+from multiprocessing.connection import wait
+from x2paddle.core.logger import logger
+
+path_keys = [
+    'model', 'prototxt', 'weight', 'caffe_proto', 'save_dir', 'input_spec',
+    'input_sample'
+]
+
+
+def load_manifest(manifest_path):
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if isinstance(manifest, list):
+        manifest = {'jobs': manifest}
+    defaults = manifest.get('defaults', dict())
+    root = os.path.dirname(os.path.abspath(manifest_path))
+    jobs = list()
+    for item in manifest['jobs']:
+        job = dict(defaults)
+        job.update(item)
+        for key in path_keys:
+            if job.get(key, None) is not None:
+                job[key] = os.path.join(root, job[key])
+        if job.get('framework', None) is None or \
+                job.get('save_dir', None) is None:
+            raise Exception(
+                "framework and save_dir should be defined for each job in {}".
+                format(manifest_path))
+        jobs.append(job)
+    return jobs
+
+
+def warm_up(frameworks):
+    """ import the frameworks and the converters once in the worker """
+    modules = ['paddle.fluid']
+    if 'tensorflow' in frameworks:
+        modules += [
+            'tensorflow', 'x2paddle.decoder.tf_decoder',
+            'x2paddle.op_mapper.tf_op_mapper',
+            'x2paddle.op_mapper.tf_op_mapper_nhwc',
+            'x2paddle.optimizer.tf_optimizer'
+        ]
+    if 'onnx' in frameworks:
+        modules += [
+            'onnx', 'x2paddle.decoder.onnx_decoder',
+            'x2paddle.op_mapper.onnx_op_mapper',
+            'x2paddle.optimizer.onnx_optimizer'
+        ]
+    if 'caffe' in frameworks:
+        modules += [
+            'x2paddle.decoder.caffe_decoder',
+            'x2paddle.op_mapper.caffe_op_mapper',
+            'x2paddle.optimizer.caffe_optimizer'
+        ]
+    if 'paddle2onnx' in frameworks:
+        modules += [
+            'onnx', 'x2paddle.decoder.paddle_decoder',
+            'x2paddle.op_mapper.paddle_op_mapper'
+        ]
+    for module in modules:
+        try:
+            __import__(module)
+        except Exception:
+            # the job will report the error
+            pass
+    if 'caffe' in frameworks:
+        try:
+            from x2paddle.decoder.caffe_decoder import load_caffe_proto
+            load_caffe_proto()
+        except Exception:
+            pass
+
+
+def reset_state(sys_path):
+    """
+    Drop what a conversion leaves in the process, so that the next job of
+    the worker starts from a clean state.
+    """
+    sys.path[:] = sys_path
+    try:
+        import paddle.fluid as fluid
+        fluid.framework.switch_main_program(fluid.Program())
+        fluid.framework.switch_startup_program(fluid.Program())
+        fluid.executor._switch_scope(fluid.core.Scope())
+        fluid.unique_name.switch()
+    except ImportError:
+        pass
+
+
+def get_output_path(job):
+    if job['framework'] == 'paddle2onnx':
+        return os.path.join(job['save_dir'], 'x2paddle_model.onnx')
+    return os.path.join(job['save_dir'], 'inference_model')
+
+
+def run_job(job):
+    from x2paddle.convert import arg_parser, convert_model
+    args = arg_parser().parse_args([])
+    result = {'save_dir': job['save_dir'], 'framework': job['framework']}
+    sys_path = list(sys.path)
+    start = time.time()
+    try:
+        for key, value in job.items():
+            if key == 'timeout':
+                continue
+            if not hasattr(args, key):
+                raise Exception("Unknown argument {} in the job".format(key))
+            setattr(args, key, value)
+        # the outputs of an earlier run of the manifest may be in save_dir,
+        # they don't tell whether this conversion succeeded
+        if not convert_model(args):
+            result['status'] = 'failed'
+            result['error'] = 'the converter reported an error'
+        elif os.path.exists(get_output_path(job)):
+            result['status'] = 'ok'
+        else:
+            result['status'] = 'failed'
+            result['error'] = 'no model was saved'
+    except (Exception, SystemExit) as e:
+        result['status'] = 'failed'
+        result['error'] = str(e) or type(e).__name__
+        result['traceback'] = traceback.format_exc()
+    finally:
+        reset_state(sys_path)
+    result['duration'] = time.time() - start
+    return result
+
+
+def worker_loop(conn, frameworks):
+    logger.configure(quiet=True)
+    warm_up(frameworks)
+    conn.send('ready')
+    while True:
+        job = conn.recv()
+        if job is None:
+            break
+        conn.send(run_job(job))
+    conn.close()
+
+
+class Worker(object):
+    def __init__(self, context, frameworks):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=worker_loop, args=(child_conn, frameworks))
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+        self.ready = False
+        self.job = None
+        self.start_time = None
+
+    def submit(self, index, job):
+        self.job = (index, job)
+        self.start_time = time.time()
+        self.conn.send(job)
+
+    def stop(self):
+        if self.process.is_alive():
+            try:
+                self.conn.send(None)
+            except (OSError, IOError):
+                pass
+            self.process.join(5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+
+    def kill(self):
+        self.process.terminate()
+        self.process.join()
+        self.conn.close()
+
+
+def print_summary(results):
+    logger.info("\n{:<6}{:<13}{:<8}{:>10}  {}".format(
+        'job', 'framework', 'status', 'time(s)', 'save_dir'))
+    for i, result in enumerate(results):
+        logger.info("{:<6}{:<13}{:<8}{:>10.1f}  {}".format(
+            i, result['framework'], result['status'], result['duration'],
+            result['save_dir']))
+        if 'error' in result:
+            logger.info("      {}".format(result['error'].strip().split(
+                '\n')[-1]))
+    ok_num = sum([result['status'] == 'ok' for result in results])
+    logger.info("{} of {} models converted.".format(ok_num, len(results)))
+
+
+def batch_convert(manifest_path, workers=None, job_timeout=None):
+    """
+    Convert all the jobs of the manifest, return True if all of them are
+    converted.
+    """
+    jobs = load_manifest(manifest_path)
+    if len(jobs) == 0:
+        return True
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = max(min(workers, len(jobs)), 1)
+    frameworks = set([job['framework'] for job in jobs])
+    # spawn, so that the workers don't inherit the state of the main process
+    context = multiprocessing.get_context('spawn')
+    pool = [Worker(context, frameworks) for i in range(workers)]
+    pending = deque(enumerate(jobs))
+    results = [None] * len(jobs)
+    finished = 0
+
+    def finish(index, result):
+        results[index] = result
+        logger.event('batch_job', index=index, **result)
+        logger.progress("Converting models", finished + 1, len(jobs))
+
+    try:
+        while finished < len(jobs):
+            for worker in pool:
+                if worker.ready and worker.job is None and len(pending) > 0:
+                    worker.submit(*pending.popleft())
+
+            now = time.time()
+            wait_time = None
+            for worker in pool:
+                if worker.job is None:
+                    continue
+                timeout = worker.job[1].get('timeout', job_timeout)
+                if timeout is None:
+                    continue
+                left = worker.start_time + timeout - now
+                wait_time = left if wait_time is None else min(wait_time,
+                                                                left)
+            ready_conns = wait(
+                [worker.conn for worker in pool] +
+                [worker.process.sentinel for worker in pool],
+                max(wait_time, 0) if wait_time is not None else None)
+
+            for i, worker in enumerate(pool):
+                message = None
+                if worker.conn in ready_conns:
+                    try:
+                        message = worker.conn.recv()
+                    except EOFError:
+                        message = None
+                if message == 'ready':
+                    worker.ready = True
+                elif message is not None:
+                    finish(worker.job[0], message)
+                    finished += 1
+                    worker.job = None
+                elif not worker.process.is_alive() or \
+                        worker.conn in ready_conns:
+                    # the worker crashed, e.g. killed by segfault or oom
+                    worker.process.join(1)
+                    worker.kill()
+                    if not worker.ready:
+                        raise Exception(
+                            "Worker exited with code {} while importing the "
+                            "frameworks".format(worker.process.exitcode))
+                    if worker.job is not None:
+                        finish(worker.job[0], {
+                            'save_dir': worker.job[1]['save_dir'],
+                            'framework': worker.job[1]['framework'],
+                            'status': 'crashed',
+                            'error': 'worker exited with code {}'.format(
+                                worker.process.exitcode),
+                            'duration': time.time() - worker.start_time
+                        })
+                        finished += 1
+                    pool[i] = Worker(context, frameworks)
+                elif worker.job is not None:
+                    timeout = worker.job[1].get('timeout', job_timeout)
+                    if timeout is not None and \
+                            time.time() - worker.start_time > timeout:
+                        finish(worker.job[0], {
+                            'save_dir': worker.job[1]['save_dir'],
+                            'framework': worker.job[1]['framework'],
+                            'status': 'timeout',
+                            'error': 'not finished in {} seconds'.format(
+                                timeout),
+                            'duration': time.time() - worker.start_time
+                        })
+                        finished += 1
+                        worker.kill()
+                        pool[i] = Worker(context, frameworks)
+    finally:
+        for worker in pool:
+            worker.stop()
+
+    print_summary(results)
+    return all([result['status'] == 'ok' for result in results])
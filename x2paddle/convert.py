@@ -15,6 +15,9 @@
 from six import text_type as _text_type
 import argparse
 import sys
+import os
+from x2paddle.core.logger import logger
+from x2paddle.core.profiler import profiler
 
 
 def arg_parser():
@@ -75,21 +78,211 @@ def arg_parser():
         action="store_true",
         default=False,
         help="define input shape for tf model")
+    parser.add_argument(
+        "--input_shape",
+        type=_text_type,
+        nargs='+',
+        default=None,
+        help="shapes of the inputs of tf/onnx model as name:dims, e.g. "
+        "--input_shape image:-1,224,224,3 mask:-1,224,224")
+    parser.add_argument(
+        "--input_spec",
+        type=_text_type,
+        default=None,
+        help="json/yaml file of the shapes (and dtypes) of the inputs, e.g. "
+        "{\"image\": {\"shape\": [-1, 224, 224, 3], \"dtype\": \"float32\"}}")
+    parser.add_argument(
+        "--input_sample",
+        type=_text_type,
+        default=None,
+        help=".npz file of sample inputs keyed by the input names, the shapes "
+        "(with unknown batch size) and dtypes of the inputs are taken from it")
+    parser.add_argument(
+        "--static_shape",
+        action="store_true",
+        default=False,
+        help="specialize tf/onnx model to its static input shapes, the shape "
+        "computation is folded into constants")
+    parser.add_argument(
+        "--shape_profiles",
+        type=_text_type,
+        nargs='+',
+        default=None,
+        help="batch sizes (e.g. 1 32 64) or a json/yaml file of the input "
+        "shapes of each profile, a program specialized to the static shapes "
+        "is saved for each profile, sharing the parameters")
+    parser.add_argument(
+        "--map_workers",
+        type=int,
+        default=1,
+        help="number of threads mapping the independent nodes of the graph "
+        "at the same time")
+    parser.add_argument(
+        "--stream_params",
+        action="store_true",
+        default=False,
+        help="export the parameters in a background thread while the nodes "
+        "are mapped")
     parser.add_argument(
         "--params_merge",
         "-pm",
         action="store_true",
         default=False,
         help="define whether merge the params")
+    parser.add_argument(
+        "--precompute_priorbox",
+        "-pp",
+        action="store_true",
+        default=False,
+        help="evaluate PriorBox of caffe model while converting")
+    parser.add_argument(
+        "--external_data",
+        "-ed",
+        action="store_true",
+        default=False,
+        help="save the weights of onnx model in an external file")
+    parser.add_argument(
+        "--quiet",
+        "-q",
+        action="store_true",
+        default=False,
+        help="only print warnings and errors")
+    parser.add_argument(
+        "--log_json",
+        type=_text_type,
+        default=None,
+        help="append the log and progress events as json lines to this file"
+        " ('-' for stderr)")
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        default=False,
+        help="save the time and memory of each conversion stage as json")
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        default=False,
+        help="save the time of each stage and each op as chrome trace json")
+    parser.add_argument(
+        "--batch",
+        type=_text_type,
+        default=None,
+        help="convert all the models listed in this json manifest")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="number of worker processes in batch mode (default: cpu count)")
+    parser.add_argument(
+        "--job_timeout",
+        type=int,
+        default=None,
+        help="seconds allowed for each model in batch mode")
+    parser.add_argument(
+        "--cache_dir",
+        type=_text_type,
+        default=None,
+        help="reuse the result of converting the same model with the same "
+        "arguments, which is cached in this directory")
+    parser.add_argument(
+        "--cache_size",
+        type=int,
+        default=None,
+        help="max size of the cache in MB, the least recently used results "
+        "are evicted")
+    parser.add_argument(
+        "--cache_verify",
+        action="store_true",
+        default=False,
+        help="rehash the cached result before using it, or all the cached "
+        "results if no model is given")
+    parser.add_argument(
+        "--cache_link",
+        action="store_true",
+        default=False,
+        help="hard link the cached result to save_dir instead of copying, "
+        "the linked files must not be modified")
+    parser.add_argument(
+        "--weights_only",
+        type=_text_type,
+        default=None,
+        help="save_dir of a previous conversion of a model with the same "
+        "structure, only the weights are exported and its program is reused")
+    parser.add_argument(
+        "--preflight",
+        action="store_true",
+        default=False,
+        help="only check whether all the ops of the model are supported, "
+        "without loading the weights")
 
     return parser
 
 
+def run_optimizer_passes(optimizer, passes):
+    for name in passes:
+        with profiler.stage('optimize/' + name):
+            getattr(optimizer, name)()
+
+
+def make_param_writer(save_dir, stream_params, hold_ops=None):
+    if not stream_params:
+        return None
+    from x2paddle.core.param_writer import ParamWriter
+    return ParamWriter(os.path.join(save_dir, "model_with_code"), hold_ops)
+
+
+def save_model(mapper,
+               save_dir,
+               params_merge,
+               reuse_dir=None,
+               profiles=None,
+               recipe=None):
+    if reuse_dir is None:
+        mapper.save_inference_model(save_dir, params_merge, profiles)
+    else:
+        if profiles is not None:
+            logger.warning("--shape_profiles is ignored with --weights_only")
+        mapper.save_weights(save_dir, reuse_dir)
+    if recipe is not None:
+        # the values of the weights may be read when the code is generated
+        recipe.finish(mapper.weights)
+
+
+def replay_weights(recipe, model, save_dir, reuse_dir, profiles=None):
+    """
+    Save the weights computed by the recipe of reuse_dir from the decoded
+    model, without mapping the nodes, return False if it's not loaded and
+    the weights of the conversion are traced instead.
+    """
+    if recipe is None:
+        return False
+    if reuse_dir is None or recipe.weights is None:
+        recipe.record(model)
+        return False
+    from x2paddle.core.op_mapper import OpMapper
+    if profiles is not None:
+        logger.warning("--shape_profiles is ignored with --weights_only")
+    with profiler.stage('replay_weights'):
+        mapper = OpMapper()
+        mapper.weights = recipe.replay(model)
+    mapper.save_reused_model(save_dir, reuse_dir)
+    logger.info("{} weights are computed again without mapping the nodes".
+                format(len(mapper.weights)))
+    return True
+
+
 def tf2paddle(model_path,
               save_dir,
               without_data_format_optimization=False,
               define_input_shape=False,
-              params_merge=False):
+              params_merge=False,
+              reuse_dir=None,
+              input_spec=None,
+              static_shape=False,
+              profiles=None,
+              map_workers=1,
+              stream_params=False,
+              recipe=None):
     # check tensorflow installation and version
     try:
         import os
@@ -97,49 +290,67 @@ def tf2paddle(model_path,
         import tensorflow as tf
         version = tf.__version__
         if version >= '2.0.0' or version < '1.0.0':
-            print(
-                "[ERROR] 1.0.0<=tensorflow<2.0.0 is required, and v1.14.0 is recommended"
+            logger.error(
+                "1.0.0<=tensorflow<2.0.0 is required, and v1.14.0 is recommended"
             )
-            return
+            return False
     except:
-        print(
-            "[ERROR] Tensorflow is not installed, use \"pip install tensorflow\"."
-        )
-        return
+        logger.error(
+            "Tensorflow is not installed, use \"pip install tensorflow\".")
+        return False
 
     from x2paddle.decoder.tf_decoder import TFDecoder
     from x2paddle.op_mapper.tf_op_mapper import TFOpMapper
     from x2paddle.op_mapper.tf_op_mapper_nhwc import TFOpMapperNHWC
     from x2paddle.optimizer.tf_optimizer import TFOptimizer
 
-    print("Now translating model from tensorflow to paddle.")
-    model = TFDecoder(model_path, define_input_shape=define_input_shape)
+    logger.info("Now translating model from tensorflow to paddle.")
+    with profiler.stage('decode'):
+        model = TFDecoder(
+            model_path,
+            define_input_shape=define_input_shape,
+            input_spec=input_spec,
+            static_shape=static_shape)
+    if replay_weights(recipe, model, save_dir, reuse_dir, profiles):
+        return True
     if not without_data_format_optimization:
-        mapper = TFOpMapper(model)
+        with profiler.stage('op_mapping'):
+            mapper = TFOpMapper(model, map_workers,
+                                make_param_writer(save_dir, stream_params))
         optimizer = TFOptimizer(mapper)
-        # neccesary optimization
-        optimizer.delete_redundance_code()
+        # delete_redundance_code is neccesary optimization,
         # optimizer below is experimental
-        optimizer.optimize_elementwise_op()
-        optimizer.merge_activation()
-        optimizer.merge_bias()
-        optimizer.optimize_sub_graph()
-
-#        optimizer.merge_batch_norm()
-#        optimizer.merge_prelu()
+        optimizer_passes = [
+            'delete_redundance_code', 'optimize_elementwise_op',
+            'merge_activation', 'merge_bias', 'optimize_sub_graph'
+        ]
+#        optimizer_passes += ['merge_batch_norm', 'merge_prelu']
     else:
-        mapper = TFOpMapperNHWC(model)
+        with profiler.stage('op_mapping'):
+            mapper = TFOpMapperNHWC(
+                model, map_workers, make_param_writer(save_dir,
+                                                      stream_params))
         optimizer = TFOptimizer(mapper)
-        optimizer.delete_redundance_code()
-        optimizer.strip_graph()
-        optimizer.merge_activation()
-        optimizer.merge_bias()
-        optimizer.make_nchw_input_output()
-        optimizer.remove_transpose()
-    mapper.save_inference_model(save_dir, params_merge)
+        optimizer_passes = [
+            'delete_redundance_code', 'strip_graph', 'merge_activation',
+            'merge_bias', 'make_nchw_input_output', 'remove_transpose'
+        ]
+    run_optimizer_passes(optimizer, optimizer_passes)
+    save_model(mapper, save_dir, params_merge, reuse_dir, profiles, recipe)
+    return True
 
 
-def caffe2paddle(proto, weight, save_dir, caffe_proto, params_merge=False):
+def caffe2paddle(proto,
+                 weight,
+                 save_dir,
+                 caffe_proto,
+                 params_merge=False,
+                 precompute_priorbox=False,
+                 reuse_dir=None,
+                 profiles=None,
+                 map_workers=1,
+                 stream_params=False,
+                 recipe=None):
     from x2paddle.decoder.caffe_decoder import CaffeDecoder
     from x2paddle.op_mapper.caffe_op_mapper import CaffeOpMapper
     from x2paddle.optimizer.caffe_optimizer import CaffeOptimizer
@@ -150,82 +361,128 @@ def caffe2paddle(proto, weight, save_dir, caffe_proto, params_merge=False):
         or (int(ver_part[0]) > 3):
         version_satisfy = True
     assert version_satisfy, '[ERROR] google.protobuf >= 3.6.0 is required'
-    print("Now translating model from caffe to paddle.")
-    model = CaffeDecoder(proto, weight, caffe_proto)
-    mapper = CaffeOpMapper(model)
+    logger.info("Now translating model from caffe to paddle.")
+    with profiler.stage('decode'):
+        model = CaffeDecoder(proto, weight, caffe_proto)
+    if replay_weights(recipe, model, save_dir, reuse_dir, profiles):
+        return True
+    with profiler.stage('op_mapping'):
+        mapper = CaffeOpMapper(
+            model, precompute_priorbox, map_workers,
+            make_param_writer(save_dir, stream_params,
+                              CaffeOptimizer.folded_ops))
     optimizer = CaffeOptimizer(mapper)
-    optimizer.merge_bn_scale()
-    optimizer.merge_op_activation()
-    mapper.save_inference_model(save_dir, params_merge)
+    run_optimizer_passes(optimizer, ['merge_bn_scale', 'merge_op_activation'])
+    save_model(mapper, save_dir, params_merge, reuse_dir, profiles, recipe)
+    return True
 
 
-def onnx2paddle(model_path, save_dir, params_merge=False):
+def onnx2paddle(model_path,
+                save_dir,
+                params_merge=False,
+                reuse_dir=None,
+                input_spec=None,
+                static_shape=False,
+                profiles=None,
+                map_workers=1,
+                stream_params=False,
+                recipe=None):
     # check onnx installation and version
     try:
         import onnx
         version = onnx.version.version
         if version != '1.6.0':
-            print("[ERROR] onnx==1.6.0 is required")
-            return
+            logger.error("onnx==1.6.0 is required")
+            return False
     except:
-        print("[ERROR] onnx is not installed, use \"pip install onnx==1.6.0\".")
-        return
-    print("Now translating model from onnx to paddle.")
+        logger.error("onnx is not installed, use \"pip install onnx==1.6.0\".")
+        return False
+    logger.info("Now translating model from onnx to paddle.")
 
     from x2paddle.op_mapper.onnx_op_mapper import ONNXOpMapper
     from x2paddle.decoder.onnx_decoder import ONNXDecoder
     from x2paddle.optimizer.onnx_optimizer import ONNXOptimizer
-    model = ONNXDecoder(model_path)
-    mapper = ONNXOpMapper(model)
-    print("Model optimizing ...")
-    optimizer = ONNXOptimizer(mapper)
-    print("Model optimized.")
+    with profiler.stage('decode'):
+        model = ONNXDecoder(model_path, input_spec, static_shape)
+    if replay_weights(recipe, model, save_dir, reuse_dir, profiles):
+        return True
+    with profiler.stage('op_mapping'):
+        mapper = ONNXOpMapper(model, map_workers,
+                              make_param_writer(save_dir, stream_params))
+    logger.info("Model optimizing ...")
+    with profiler.stage('optimize'):
+        optimizer = ONNXOptimizer(mapper)
+    logger.info("Model optimized.")
 
-    print("Paddle model and code generating ...")
-    mapper.save_inference_model(save_dir, params_merge)
-    print("Paddle model and code generated.")
+    logger.info("Paddle model and code generating ...")
+    save_model(mapper, save_dir, params_merge, reuse_dir, profiles, recipe)
+    logger.info("Paddle model and code generated.")
+    return True
 
 
-def paddle2onnx(model_path, save_dir):
+def paddle2onnx(model_path, save_dir, external_data=False):
     from x2paddle.decoder.paddle_decoder import PaddleDecoder
     from x2paddle.op_mapper.paddle_op_mapper import PaddleOpMapper
-    model = PaddleDecoder(model_path, '__model__', '__params__')
+    logger.info("Now translating model from paddle to onnx.")
+    with profiler.stage('decode'):
+        model = PaddleDecoder(model_path, '__model__', '__params__')
     mapper = PaddleOpMapper()
-    mapper.convert(model.program, save_dir)
+    converted = mapper.convert(model.program, save_dir, external_data,
+                               model.params)
+    model.params.close()
+    return converted
 
 
-def main():
-    if len(sys.argv) < 2:
-        print("Use \"x2paddle -h\" to print the help information")
-        print("For more information, please follow our github repo below:)")
-        print("\nGithub: https://github.com/PaddlePaddle/X2Paddle.git\n")
-        return
-
-    parser = arg_parser()
-    args = parser.parse_args()
-
-    if args.version:
-        import x2paddle
-        print("x2paddle-{} with python>=3.5, paddlepaddle>=1.6.0\n".format(
-            x2paddle.__version__))
-        return
+def convert_model(args):
+    """ convert the model of args, return False if the converter failed """
+    if args.cache_dir is None:
+        return run_converter(args)
+    from x2paddle.core.cache import ConversionCache
+    cache_size = None
+    if args.cache_size is not None:
+        cache_size = args.cache_size * 1024 * 1024
+    cache = ConversionCache(args.cache_dir, cache_size, args.cache_verify,
+                            args.cache_link)
+    key = cache.get_key(args)
+    if not os.path.isdir(args.save_dir):
+        os.makedirs(args.save_dir)
+    if cache.restore(key, args.save_dir):
+        logger.info("Restored the cached conversion {} to {}".format(
+            key, args.save_dir))
+        return True
+    # the outputs left in save_dir by an earlier run are only cached if this
+    # conversion succeeded
+    if not run_converter(args):
+        return False
+    cache.store(key, args.save_dir, args.framework)
+    return True
 
-    assert args.framework is not None, "--framework is not defined(support tensorflow/caffe/onnx)"
-    assert args.save_dir is not None, "--save_dir is not defined"
 
-    try:
-        import paddle
-        v0, v1, v2 = paddle.__version__.split('.')
-        print("paddle.__version__ = {}".format(paddle.__version__))
-        if v0 == '0' and v1 == '0' and v2 == '0':
-            print("[WARNING] You are use develop version of paddlepaddle")
-        elif int(v0) != 1 or int(v1) < 6:
-            print("[ERROR] paddlepaddle>=1.6.0 is required")
-            return
-    except:
-        print(
-            "[ERROR] paddlepaddle not installed, use \"pip install paddlepaddle\""
-        )
+def run_converter(args):
+    from x2paddle.core import incremental
+    from x2paddle.core.input_spec import get_input_spec, load_profiles
+    input_spec = get_input_spec(args)
+    profiles = None
+    if args.shape_profiles is not None:
+        if args.framework == "paddle2onnx":
+            logger.warning("--shape_profiles is ignored for paddle2onnx")
+        else:
+            profiles = load_profiles(args.shape_profiles)
+    if (input_spec is not None or args.static_shape) and \
+            args.framework not in ["tensorflow", "onnx"]:
+        logger.warning("Input shapes are only used for tensorflow and onnx "
+                       "model, ignored for {}".format(args.framework))
+    structure_hash = None
+    recipe = None
+    if args.framework != "paddle2onnx":
+        recipe = incremental.WeightRecipe(args.framework)
+    if args.weights_only is not None:
+        with profiler.stage('check_structure'):
+            structure_hash = incremental.get_structure_hash(args)
+            # the weights are only computed by the recorded transforms of a
+            # conversion with the same structure and arguments
+            if incremental.check_structure(args, structure_hash):
+                recipe.load(args.weights_only)
 
     if args.framework == "tensorflow":
         assert args.model is not None, "--model should be defined while translating tensorflow model"
@@ -238,32 +495,131 @@ def main():
             define_input_shape = True
         if args.params_merge:
             params_merge = True
-        tf2paddle(args.model, args.save_dir, without_data_format_optimization,
-                  define_input_shape, params_merge)
+        converted = tf2paddle(
+            args.model, args.save_dir, without_data_format_optimization,
+            define_input_shape, params_merge, args.weights_only, input_spec,
+            args.static_shape, profiles, args.map_workers, args.stream_params,
+            recipe)
 
     elif args.framework == "caffe":
         assert args.prototxt is not None and args.weight is not None, "--prototxt and --weight should be defined while translating caffe model"
         params_merge = False
         if args.params_merge:
             params_merge = True
-        caffe2paddle(args.prototxt, args.weight, args.save_dir,
-                     args.caffe_proto, params_merge)
+        precompute_priorbox = False
+        if args.precompute_priorbox:
+            precompute_priorbox = True
+        converted = caffe2paddle(
+            args.prototxt, args.weight, args.save_dir, args.caffe_proto,
+            params_merge, precompute_priorbox, args.weights_only, profiles,
+            args.map_workers, args.stream_params, recipe)
     elif args.framework == "onnx":
         assert args.model is not None, "--model should be defined while translating onnx model"
         params_merge = False
 
         if args.params_merge:
             params_merge = True
-        onnx2paddle(args.model, args.save_dir, params_merge)
+        converted = onnx2paddle(args.model, args.save_dir, params_merge,
+                                args.weights_only, input_spec,
+                                args.static_shape, profiles,
+                                args.map_workers, args.stream_params, recipe)
 
     elif args.framework == "paddle2onnx":
         assert args.model is not None, "--model should be defined while translating paddle model to onnx"
-        paddle2onnx(args.model, args.save_dir)
+        external_data = False
+        if args.external_data:
+            external_data = True
+        converted = paddle2onnx(args.model, args.save_dir, external_data)
 
     else:
         raise Exception(
             "--framework only support tensorflow/caffe/onnx/paddle2onnx now")
 
+    # record the structure of the model for the later --weights_only, the
+    # inference_model in save_dir may be left by an earlier run if the
+    # converter failed
+    if converted and args.framework != "paddle2onnx":
+        if structure_hash is None:
+            with profiler.stage('structure_hash'):
+                structure_hash = incremental.get_structure_hash(args)
+        incremental.save_info(args, structure_hash)
+        recipe.save(args.save_dir)
+    return converted
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Use \"x2paddle -h\" to print the help information")
+        print("For more information, please follow our github repo below:)")
+        print("\nGithub: https://github.com/PaddlePaddle/X2Paddle.git\n")
+        return
+
+    parser = arg_parser()
+    args = parser.parse_args()
+    logger.configure(quiet=args.quiet, json_file=args.log_json)
+    if args.profile:
+        profiler.enable()
+    if args.trace:
+        profiler.enable_trace()
+
+    if args.version:
+        import x2paddle
+        print("x2paddle-{} with python>=3.5, paddlepaddle>=1.6.0\n".format(
+            x2paddle.__version__))
+        return
+
+    if args.batch is not None:
+        from x2paddle.batch_convert import batch_convert
+        if not batch_convert(args.batch, args.workers, args.job_timeout):
+            sys.exit(1)
+        return
+
+    if args.cache_dir is not None and args.cache_verify and \
+            args.framework is None:
+        from x2paddle.core.cache import ConversionCache
+        if not ConversionCache(args.cache_dir).verify_all():
+            sys.exit(1)
+        return
+
+    assert args.framework is not None, "--framework is not defined(support tensorflow/caffe/onnx)"
+
+    if args.preflight:
+        from x2paddle.preflight import run_preflight
+        if not run_preflight(args):
+            sys.exit(1)
+        return
+
+    assert args.save_dir is not None, "--save_dir is not defined"
+
+    try:
+        import paddle
+        v0, v1, v2 = paddle.__version__.split('.')
+        logger.info("paddle.__version__ = {}".format(paddle.__version__))
+        if v0 == '0' and v1 == '0' and v2 == '0':
+            logger.warning("You are use develop version of paddlepaddle")
+        elif int(v0) != 1 or int(v1) < 6:
+            logger.error("paddlepaddle>=1.6.0 is required")
+            return
+    except:
+        logger.error(
+            "paddlepaddle not installed, use \"pip install paddlepaddle\"")
+
+    convert_model(args)
+
+    if args.profile:
+        profile_path = os.path.abspath(args.save_dir).rstrip(
+            os.sep) + '_profile.json'
+        profiler.save(profile_path, framework=args.framework, argv=sys.argv)
+        profiler.disable()
+        logger.info("Profile report saved in {}".format(profile_path))
+    if args.trace:
+        trace_path = os.path.abspath(args.save_dir).rstrip(
+            os.sep) + '_trace.json'
+        profiler.save_trace(trace_path)
+        profiler.disable_trace()
+        logger.info("Trace saved in {}, open it with chrome://tracing".format(
+            trace_path))
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,268 @@
+#   Copyright (c) 2019  PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from x2paddle.core.logger import logger
+
+# arguments which don't change the converted model
+ignored_args = [
+    'model', 'prototxt', 'weight', 'caffe_proto', 'save_dir', 'version',
+    'quiet', 'log_json', 'profile', 'trace', 'batch', 'workers',
+    'job_timeout', 'cache_dir', 'cache_size', 'cache_verify', 'cache_link',
+    'weights_only', 'preflight', 'input_spec', 'input_sample', 'map_workers',
+    'stream_params'
+]
+
+
+def hash_path(path, sha=None):
+    """ sha256 of a file, or of all the files in a directory """
+    if sha is None:
+        sha = hashlib.sha256()
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                sha.update(os.path.relpath(file_path, path).encode('utf-8'))
+                hash_path(file_path, sha)
+        return sha
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(1 << 20)
+            if not chunk:
+                break
+            sha.update(chunk)
+    return sha
+
+
+def get_outputs(framework):
+    """
+    files and directories in save_dir produced by a conversion, the first
+    one exists only if the conversion succeeded
+    """
+    if framework == 'paddle2onnx':
+        return ['x2paddle_model.onnx', 'x2paddle_model.onnx.data']
+    return [
+        'inference_model', 'model_with_code', 'x2paddle_info.json',
+        'x2paddle_weights.json'
+    ]
+
+
+def list_files(path):
+    if os.path.isfile(path):
+        return [path]
+    files = list()
+    for root, dirs, names in os.walk(path):
+        files += [os.path.join(root, name) for name in names]
+    return files
+
+
+def link_or_copy(src, dst, link):
+    if link:
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+
+
+class ConversionCache(object):
+    """
+    Cache of the conversion results keyed by the hash of the input files,
+    the x2paddle version and the conversion arguments. Each entry is a
+    directory with the outputs and a meta.json of the hash of each file and
+    the last use time, the least recently used entries are evicted when the
+    cache is larger than max_size bytes. With link, the outputs are
+    restored as hard links of the cached files (falling back to copies), so
+    they must not be modified in place.
+    """
+
+    def __init__(self, cache_dir, max_size=None, verify=False, link=False):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.verify = verify
+        self.link = link
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def get_key(self, args):
+        import x2paddle
+        sha = hashlib.sha256()
+        for name in [
+                'model', 'prototxt', 'weight', 'caffe_proto', 'input_spec',
+                'input_sample'
+        ]:
+            path = getattr(args, name, None)
+            sha.update(name.encode('utf-8'))
+            if path is not None:
+                hash_path(path, sha)
+        profiles = getattr(args, 'shape_profiles', None)
+        if profiles is not None and len(profiles) == 1 and \
+                os.path.isfile(profiles[0]):
+            hash_path(profiles[0], sha)
+        flags = {
+            name: value
+            for name, value in vars(args).items() if name not in ignored_args
+        }
+        flags['x2paddle_version'] = x2paddle.__version__
+        sha.update(json.dumps(flags, sort_keys=True).encode('utf-8'))
+        return sha.hexdigest()
+
+    def entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def load_meta(self, key):
+        meta_path = os.path.join(self.entry_dir(key), 'meta.json')
+        if not os.path.exists(meta_path):
+            return None
+        try:
+            with open(meta_path) as f:
+                return json.load(f)
+        except ValueError:
+            return None
+
+    def save_meta(self, path, meta):
+        tmp_path = '{}.{}'.format(path, uuid.uuid4().hex)
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f, indent=2)
+        os.rename(tmp_path, path)
+
+    def check_entry(self, key, meta):
+        """ rehash the stored outputs, return True if none is changed """
+        output_dir = os.path.join(self.entry_dir(key), 'output')
+        for name, digest in meta['files'].items():
+            path = os.path.join(output_dir, name)
+            if not os.path.isfile(path) or \
+                    hash_path(path).hexdigest() != digest:
+                return False
+        return True
+
+    def restore(self, key, save_dir):
+        """
+        Link or copy the outputs of the entry to save_dir, return False if
+        there's no valid entry for key.
+        """
+        meta = self.load_meta(key)
+        if meta is None:
+            return False
+        if self.verify and not self.check_entry(key, meta):
+            logger.warning("Cached conversion {} is corrupted, removed".
+                           format(key))
+            self.remove(key)
+            return False
+        output_dir = os.path.join(self.entry_dir(key), 'output')
+        for name in meta['outputs']:
+            dst = os.path.join(save_dir, name)
+            if os.path.isdir(dst):
+                shutil.rmtree(dst)
+            elif os.path.exists(dst):
+                os.remove(dst)
+        for name in meta['files']:
+            dst = os.path.join(save_dir, name)
+            if not os.path.isdir(os.path.dirname(dst)):
+                os.makedirs(os.path.dirname(dst))
+            link_or_copy(os.path.join(output_dir, name), dst, self.link)
+        meta['last_used'] = time.time()
+        self.save_meta(os.path.join(self.entry_dir(key), 'meta.json'), meta)
+        return True
+
+    def store(self, key, save_dir, framework):
+        if not os.path.exists(
+                os.path.join(save_dir, get_outputs(framework)[0])):
+            return
+        outputs = [
+            name for name in get_outputs(framework)
+            if os.path.exists(os.path.join(save_dir, name))
+        ]
+        # write to a temporary directory first, so that a conversion in
+        # another process never sees an incomplete entry
+        tmp_dir = os.path.join(self.cache_dir,
+                               '.tmp_{}'.format(uuid.uuid4().hex))
+        output_dir = os.path.join(tmp_dir, 'output')
+        meta = {
+            'key': key,
+            'framework': framework,
+            'outputs': outputs,
+            'files': dict(),
+            'size': 0,
+            'created': time.time(),
+            'last_used': time.time()
+        }
+        try:
+            for name in outputs:
+                for path in list_files(os.path.join(save_dir, name)):
+                    rel_path = os.path.relpath(path, save_dir)
+                    dst = os.path.join(output_dir, rel_path)
+                    if not os.path.isdir(os.path.dirname(dst)):
+                        os.makedirs(os.path.dirname(dst))
+                    shutil.copy2(path, dst)
+                    meta['files'][rel_path] = hash_path(dst).hexdigest()
+                    meta['size'] += os.path.getsize(dst)
+            self.save_meta(os.path.join(tmp_dir, 'meta.json'), meta)
+            os.rename(tmp_dir, self.entry_dir(key))
+        except OSError as e:
+            # the same entry may be stored by another process
+            if not os.path.isdir(self.entry_dir(key)):
+                logger.warning("Failed to cache the conversion: {}".format(e))
+        finally:
+            if os.path.isdir(tmp_dir):
+                shutil.rmtree(tmp_dir)
+        self.evict()
+
+    def remove(self, key):
+        shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+
+    def entries(self):
+        entries = list()
+        for key in os.listdir(self.cache_dir):
+            if key.startswith('.'):
+                continue
+            meta = self.load_meta(key)
+            if meta is not None:
+                entries.append(meta)
+        return entries
+
+    def evict(self):
+        if self.max_size is None:
+            return
+        entries = sorted(self.entries(), key=lambda meta: meta['last_used'])
+        total_size = sum([meta['size'] for meta in entries])
+        for meta in entries:
+            if total_size <= self.max_size:
+                break
+            self.remove(meta['key'])
+            total_size -= meta['size']
+            logger.info("Evicted cached conversion {}".format(meta['key']))
+
+    def verify_all(self):
+        """ rehash all the entries, the corrupted ones are removed """
+        entries = self.entries()
+        corrupted = list()
+        for i, meta in enumerate(entries):
+            logger.progress("Verifying cache", i + 1, len(entries))
+            if not self.check_entry(meta['key'], meta):
+                corrupted.append(meta['key'])
+                self.remove(meta['key'])
+        logger.info("{} cached conversions verified, {} corrupted removed".
+                    format(len(entries), len(corrupted)))
+        for key in corrupted:
+            logger.warning("Removed corrupted cached conversion {}".format(
+                key))
+        return len(corrupted) == 0
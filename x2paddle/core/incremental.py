@@ -0,0 +1,304 @@
+#   Copyright (c) 2019  PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import os
+import numpy
+from x2paddle.core.cache import ignored_args
+from x2paddle.core.logger import logger
+from x2paddle.core.weight_trace import Tracer, Untraceable, encode, evaluate, \
+    guard_value, TracedArray
+
+info_filename = 'x2paddle_info.json'
+weights_filename = 'x2paddle_weights.json'
+
+
+def tf_structure(model_path):
+    from tensorflow.core.framework import graph_pb2, types_pb2
+    graph_def = graph_pb2.GraphDef()
+    with open(model_path, 'rb') as f:
+        graph_def.ParseFromString(f.read())
+    float_types = [
+        types_pb2.DT_FLOAT, types_pb2.DT_DOUBLE, types_pb2.DT_HALF,
+        types_pb2.DT_BFLOAT16
+    ]
+    for node in graph_def.node:
+        if node.op != 'Const':
+            continue
+        tensor = node.attr['value'].tensor
+        # the values of the float tensors are weights, the ones read into
+        # the code are checked by the guards of WeightRecipe
+        if tensor.dtype in float_types:
+            for field in [
+                    'tensor_content', 'float_val', 'double_val', 'half_val'
+            ]:
+                tensor.ClearField(field)
+    return graph_def.SerializeToString(deterministic=True)
+
+
+def onnx_structure(model_path):
+    import onnx
+    from onnx import onnx_pb
+    model = onnx.load(model_path)
+    float_types = [
+        onnx_pb.TensorProto.FLOAT, onnx_pb.TensorProto.DOUBLE,
+        onnx_pb.TensorProto.FLOAT16
+    ]
+    for tensor in model.graph.initializer:
+        if tensor.data_type in float_types:
+            for field in [
+                    'raw_data', 'float_data', 'double_data', 'int32_data'
+            ]:
+                tensor.ClearField(field)
+    structure = model.graph.SerializeToString(deterministic=True)
+    for opset in model.opset_import:
+        structure += opset.SerializeToString(deterministic=True)
+    return structure
+
+
+def caffe_structure(proto_path):
+    # shapes of the blobs are checked with the parameters of the program
+    with open(proto_path, 'rb') as f:
+        return f.read()
+
+
+def get_structure_hash(args):
+    """
+    Hash of the model without the values of the weights, two models with
+    the same hash are converted into the same program.
+    """
+    if args.framework == 'tensorflow':
+        structure = tf_structure(args.model)
+    elif args.framework == 'onnx':
+        structure = onnx_structure(args.model)
+    elif args.framework == 'caffe':
+        structure = caffe_structure(args.prototxt)
+    else:
+        raise Exception(
+            "--weights_only is not supported for {}".format(args.framework))
+    return hashlib.sha256(structure).hexdigest()
+
+
+def get_flags(args):
+    return {
+        name: value
+        for name, value in vars(args).items() if name not in ignored_args
+    }
+
+
+def save_info(args, structure_hash):
+    import x2paddle
+    info = {
+        'framework': args.framework,
+        'structure_hash': structure_hash,
+        'flags': get_flags(args),
+        'x2paddle_version': x2paddle.__version__
+    }
+    with open(os.path.join(args.save_dir, info_filename), 'w') as f:
+        json.dump(info, f, indent=2)
+
+
+def check_structure(args, structure_hash):
+    """
+    Check that the model in args can reuse the conversion in
+    args.weights_only, return True if it's checked by the recorded info.
+    """
+    reuse_dir = args.weights_only
+    for name in [
+            os.path.join('model_with_code', 'model.py'),
+            os.path.join('inference_model', '__model__')
+    ]:
+        if not os.path.exists(os.path.join(reuse_dir, name)):
+            raise Exception("{} is not found in {}".format(name, reuse_dir))
+    info_path = os.path.join(reuse_dir, info_filename)
+    if not os.path.exists(info_path):
+        logger.warning("{} is not found in {}, only the generated code will "
+                       "be compared".format(info_filename, reuse_dir))
+        return False
+    with open(info_path) as f:
+        info = json.load(f)
+    if info['framework'] != args.framework:
+        raise Exception("The model in {} is converted from {}".format(
+            reuse_dir, info['framework']))
+    if info['flags'] != json.loads(json.dumps(get_flags(args))):
+        raise Exception(
+            "The model in {} is converted with different arguments {}".format(
+                reuse_dir, info['flags']))
+    if info['structure_hash'] != structure_hash:
+        raise Exception(
+            "The structure of the model is changed, please convert the model "
+            "without --weights_only")
+    return True
+
+
+def get_graph(model, framework):
+    if framework == 'tensorflow':
+        return model.tf_graph
+    if framework == 'caffe':
+        return model.caffe_graph
+    return model.graph
+
+
+def get_shapes_hash(graph):
+    """ hash of the inferred shapes, they may be computed from the weights """
+    shapes = dict()
+    for name, node in graph.node_map.items():
+        out_shapes = getattr(node, 'out_shapes', None)
+        if out_shapes is not None:
+            shapes[name] = [list(shape) for shape in out_shapes]
+    shapes = json.dumps(shapes, sort_keys=True, default=str)
+    return hashlib.sha256(shapes.encode('utf-8')).hexdigest()
+
+
+class WeightRecipe(object):
+    """
+    How the weights of a conversion are computed from the weights of the
+    model, so that --weights_only computes them for a retrained model and
+    reuses the program without mapping the nodes.
+    """
+
+    def __init__(self, framework):
+        self.framework = framework
+        self.tracer = None
+        self.shapes_hash = None
+        self.weights = None
+        self.guards = None
+        self.failure = None
+
+    def record(self, model):
+        """ trace the weights of the decoded model given to the mapper """
+        tracer = Tracer()
+        graph = get_graph(model, self.framework)
+        self.tracer = tracer
+        self.shapes_hash = get_shapes_hash(graph)
+        # the weights are given by their nodes in graph.node_map
+        for name, node in graph.node_map.items():
+            if self.framework == 'tensorflow':
+                # the values of Const are made when they are read, by the
+                # layer_name which is the name in node_map
+                node.trace = tracer
+            elif self.framework == 'caffe':
+                if getattr(node, 'data', None) is not None:
+                    node.data = [
+                        tracer.source([name, i], data)
+                        for i, data in enumerate(node.data)
+                    ]
+            elif getattr(node, 'weight', None) is not None:
+                node.weight = tracer.source([name], node.weight)
+        if self.framework == 'tensorflow':
+            model.trace = tracer
+
+    def finish(self, weights):
+        """ record how the saved weights of the mapper are computed """
+        tracer = self.tracer
+        self.tracer = None
+        failure = tracer.failure
+        recipe = dict()
+        if failure is None:
+            try:
+                for name, value in weights.items():
+                    # the other weights are constants of the structure, which
+                    # are reused from the earlier conversion
+                    if isinstance(value, TracedArray):
+                        recipe[name] = encode(value)
+            except Untraceable as e:
+                failure = str(e)
+        if failure is None:
+            # the recipe has to compute the same weights from the model
+            recipe = json.loads(json.dumps(recipe))
+            for name, expr in recipe.items():
+                try:
+                    value = numpy.asarray(evaluate(expr, tracer.get_source))
+                except Exception as e:
+                    failure = "failed to compute {} again: {}".format(name, e)
+                    break
+                weight = weights[name].view(numpy.ndarray)
+                if value.dtype != weight.dtype or \
+                        value.shape != weight.shape or \
+                        value.tobytes() != weight.tobytes():
+                    failure = "{} is not computed again as it's " \
+                        "converted".format(name)
+                    break
+        if failure is not None:
+            logger.info("The weights can't be computed again by "
+                        "--weights_only without mapping the nodes: {}".format(
+                            failure))
+            self.failure = failure
+            return
+        self.weights = recipe
+        self.guards = tracer.get_guards()
+
+    def save(self, save_dir):
+        info = {
+            'framework': self.framework,
+            'shapes_hash': self.shapes_hash,
+            'weights': self.weights,
+            'guards': self.guards,
+            'failure': self.failure
+        }
+        with open(os.path.join(save_dir, weights_filename), 'w') as f:
+            json.dump(info, f, separators=(',', ':'))
+
+    def load(self, reuse_dir):
+        """ load the recipe of reuse_dir, return False if it can't be used """
+        path = os.path.join(reuse_dir, weights_filename)
+        if not os.path.exists(path):
+            logger.info("{} is not found in {}, the nodes are mapped to "
+                        "compute the weights".format(weights_filename,
+                                                     reuse_dir))
+            return False
+        with open(path) as f:
+            info = json.load(f)
+        if info['weights'] is None:
+            logger.info("The nodes are mapped to compute the weights, {}".
+                        format(info['failure']))
+            return False
+        self.shapes_hash = info['shapes_hash']
+        self.weights = info['weights']
+        self.guards = info['guards']
+        return True
+
+    def replay(self, model):
+        """ the weights of the decoded model computed by the loaded recipe """
+        graph = get_graph(model, self.framework)
+        if get_shapes_hash(graph) != self.shapes_hash:
+            raise Exception(
+                "The inferred shapes of the model are changed, please convert "
+                "the model without --weights_only")
+        sources = dict()
+
+        def get_source(key):
+            name = json.dumps(key)
+            if name not in sources:
+                node = graph.node_map[key[0]]
+                if self.framework == 'tensorflow':
+                    sources[name] = node.value
+                elif self.framework == 'caffe':
+                    sources[name] = node.data[key[1]]
+                else:
+                    sources[name] = node.weight
+            return sources[name]
+
+        for expr, value in self.guards:
+            if json.dumps(guard_value(evaluate(expr, get_source))) != \
+                    json.dumps(value):
+                raise Exception(
+                    "A value of the weights written into the code is "
+                    "changed, please convert the model without "
+                    "--weights_only")
+        return {
+            name: numpy.asarray(evaluate(expr, get_source))
+            for name, expr in self.weights.items()
+        }
@@ -0,0 +1,229 @@
+#   Copyright (c) 2019  PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Shapes and dtypes of the model inputs given without typing them in a terminal,
+from (in the order of priority)
+
+    --input_shape x:-1,224,224,3 y:-1,10
+    --input_spec spec.json    {"x": [-1, 224, 224, 3], "y": {"shape": [-1, 10],
+                               "dtype": "int64"}}, or the same in .yaml/.yml
+    --input_sample data.npz   an array of representative inputs for each
+                              input, the first dimension is the batch size
+
+The spec is a dict of the input name to {'shape': [...], 'dtype': ...}, with
+-1 for the unknown dimension.
+"""
+
+import json
+import numpy
+import os
+import sys
+from collections import OrderedDict
+from x2paddle.core.logger import logger
+
+
+def parse_dims(dims):
+    """ '-1,224,224,3' or 'None,224,224,3' to [-1, 224, 224, 3] """
+    if isinstance(dims, str):
+        dims = [dim.strip() for dim in dims.strip().strip('[]()').split(',')]
+        dims = [dim for dim in dims if dim != '']
+    shape = list()
+    for dim in dims:
+        if dim is None or dim in ['None', '?', '-1', -1]:
+            shape.append(-1)
+        else:
+            shape.append(int(dim))
+    return shape
+
+
+def parse_input_shapes(input_shapes):
+    """ ['x:-1,224,224,3'] from --input_shape to the spec """
+    spec = OrderedDict()
+    for item in input_shapes:
+        if ':' not in item:
+            raise Exception(
+                "--input_shape should be name:dims, e.g. image:-1,3,224,224, "
+                "but {} is given".format(item))
+        name, dims = item.rsplit(':', 1)
+        spec[name] = {'shape': parse_dims(dims), 'dtype': None}
+    return spec
+
+
+def is_spec_file(path):
+    return os.path.splitext(path)[1].lower() in ['.json', '.yaml', '.yml']
+
+
+def load_file(path):
+    with open(path) as f:
+        if os.path.splitext(path)[1].lower() in ['.yaml', '.yml']:
+            try:
+                import yaml
+            except ImportError:
+                raise Exception(
+                    "pyyaml is not installed, use \"pip install pyyaml\", or "
+                    "write the spec as json")
+            return yaml.safe_load(f)
+        return json.load(f, object_pairs_hook=OrderedDict)
+
+
+def load_spec_file(spec_path):
+    content = load_file(spec_path)
+    if not isinstance(content, dict):
+        raise Exception("{} should be a dict of the input names".format(
+            spec_path))
+    spec = OrderedDict()
+    for name, info in content.items():
+        if not isinstance(info, dict):
+            info = {'shape': info}
+        shape = info.get('shape', None)
+        spec[name] = {
+            'shape': None if shape is None else parse_dims(shape),
+            'dtype': info.get('dtype', None)
+        }
+    return spec
+
+
+def load_sample(sample_path):
+    """ shapes (with an unknown batch size) and dtypes of the samples """
+    spec = OrderedDict()
+    with numpy.load(sample_path) as data:
+        for name in data.files:
+            value = data[name]
+            shape = list(value.shape)
+            if len(shape) > 0:
+                shape[0] = -1
+            spec[name] = {'shape': shape, 'dtype': value.dtype.name}
+    return spec
+
+
+def get_input_spec(args):
+    """
+    The spec merged from the arguments, None if no input shape is given.
+    """
+    input_shape = getattr(args, 'input_shape', None)
+    input_spec = getattr(args, 'input_spec', None)
+    input_sample = getattr(args, 'input_sample', None)
+    if input_shape is None and input_spec is None and input_sample is None:
+        return None
+    spec = OrderedDict()
+    if input_sample is not None:
+        spec.update(load_sample(input_sample))
+    if input_spec is not None:
+        for name, info in load_spec_file(input_spec).items():
+            if name in spec:
+                info = {key: value if value is not None else spec[name][key]
+                        for key, value in info.items()}
+            spec[name] = info
+    if input_shape is not None:
+        for name, info in parse_input_shapes(input_shape).items():
+            if name in spec:
+                info['dtype'] = spec[name]['dtype']
+            spec[name] = info
+    return spec
+
+
+def lookup(spec, name):
+    """ info of the input in the spec, the tensor name (x:0) is also matched """
+    if spec is None:
+        return None
+    for key in [name, name + ':0']:
+        if key in spec:
+            return spec[key]
+    return None
+
+
+def check_unused(spec, input_names):
+    if spec is None:
+        return
+    for name in spec:
+        if name not in input_names and not (name.endswith(':0') and
+                                            name[:-2] in input_names):
+            logger.warning(
+                "Input {} in the input shape spec is not found in the model, "
+                "the inputs are {}".format(name, input_names))
+
+
+def check_interactive(name):
+    """ raise instead of waiting for the shape if there's no terminal """
+    if not sys.stdin.isatty():
+        raise Exception(
+            "Shape of input {} is unknown, please define it with "
+            "--input_shape, --input_spec or --input_sample".format(name))
+
+
+def load_profiles(values):
+    """
+    Profiles from --shape_profiles, batch sizes (e.g. 1 32 64), or a
+    json/yaml file of {"profile name": {"input name": [dims]}}. The profile
+    of a batch size is named batch<N>.
+    """
+    profiles = OrderedDict()
+    if len(values) == 1 and is_spec_file(values[0]):
+        content = load_file(values[0])
+        if not isinstance(content, dict):
+            raise Exception("{} should be a dict of the profile names".format(
+                values[0]))
+        for name, shapes in content.items():
+            profiles[str(name)] = OrderedDict(
+                [(input_name, parse_dims(dims))
+                 for input_name, dims in shapes.items()])
+        return profiles
+    for value in values:
+        try:
+            batch_size = int(value)
+        except ValueError:
+            raise Exception(
+                "--shape_profiles should be batch sizes or a json/yaml file, "
+                "but {} is given".format(value))
+        profiles['batch{}'.format(batch_size)] = batch_size
+    return profiles
+
+
+def normalize_name(name):
+    for s in ' .*?\\/-:^':
+        name = name.replace(s, '_')
+    return name
+
+
+def resolve_profile(profile_name, profile, input_shapes):
+    """
+    Static shapes of the inputs (keyed by the names in the paddle model) in
+    the profile. Only the unknown dimensions of the model can be set.
+    """
+    given = dict()
+    if not isinstance(profile, int):
+        for name, dims in profile.items():
+            given[name] = dims
+            given[normalize_name(name)] = dims
+            given['x2paddle_' + normalize_name(name)] = dims
+    shapes = OrderedDict()
+    for name, shape in input_shapes.items():
+        shape = list(shape)
+        if isinstance(profile, int):
+            dims = list(shape)
+            if len(dims) > 0:
+                dims[0] = profile
+        else:
+            dims = given.get(name, shape)
+        if len(dims) != len(shape) or any(
+            [dim > 0 and dim != new_dim for dim, new_dim in zip(shape, dims)]):
+            raise Exception(
+                "Shape of input {} is {} in the model, it can't be {} in "
+                "profile {}".format(name, shape, dims, profile_name))
+        if any([dim <= 0 for dim in dims]):
+            raise Exception(
+                "Shape of input {} is {} in profile {}, all the dimensions "
+                "should be defined".format(name, dims, profile_name))
+        shapes[name] = dims
+    return shapes
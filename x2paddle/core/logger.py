@@ -0,0 +1,90 @@
+#   Copyright (c) 2019  PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import sys
+import time
+
+
+class Logger(object):
+    """
+    Progress and message reporting shared by all the frontends.
+    Progress updates are throttled by time, messages are hidden in quiet mode
+    (except warnings and errors), and every message/progress can also be
+    written as a JSON line to an event stream.
+    """
+
+    def __init__(self):
+        self.quiet = False
+        self.interval = 0.5
+        self.event_stream = None
+        self.last_progress = dict()
+
+    def configure(self, quiet=False, json_file=None, interval=0.5):
+        self.quiet = quiet
+        self.interval = interval
+        if self.event_stream is not None and self.event_stream not in [
+                sys.stdout, sys.stderr
+        ]:
+            self.event_stream.close()
+        self.event_stream = None
+        if json_file == '-':
+            self.event_stream = sys.stderr
+        elif json_file is not None:
+            self.event_stream = open(json_file, 'a')
+        self.last_progress = dict()
+
+    def event(self, event_type, **fields):
+        if self.event_stream is None:
+            return
+        fields['event'] = event_type
+        fields['time'] = time.time()
+        self.event_stream.write(json.dumps(fields, default=str) + '\n')
+        self.event_stream.flush()
+
+    def info(self, message, **fields):
+        if not self.quiet:
+            print(message)
+        self.event('info', message=message, **fields)
+
+    def warning(self, message, **fields):
+        print("[WARNING] {}".format(message))
+        self.event('warning', message=message, **fields)
+
+    def error(self, message, **fields):
+        sys.stderr.write("[ERROR] {}\n".format(message))
+        self.event('error', message=message, **fields)
+
+    def progress(self, stage, current, total, **fields):
+        """
+        Report that current of total items of stage are done, the terminal
+        and the event stream are updated at most once per interval, and
+        always for the last item.
+        """
+        now = time.time()
+        finished = current >= total
+        if not finished and \
+                now - self.last_progress.get(stage, 0) < self.interval:
+            return
+        self.last_progress[stage] = now
+        if not self.quiet:
+            sys.stderr.write("\r{}: {}/{}    ".format(stage, current, total))
+            if finished:
+                sys.stderr.write("\n")
+            sys.stderr.flush()
+        self.event(
+            'progress', stage=stage, current=current, total=total, **fields)
+
+
+logger = Logger()
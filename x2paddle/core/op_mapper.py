@@ -14,8 +14,21 @@
 import paddle.fluid as fluid
 from paddle.fluid.proto import framework_pb2
 from x2paddle.core.util import *
+from x2paddle.core.logger import logger
+from x2paddle.core.param_writer import StreamedWeights
+from x2paddle.core.profiler import profiler
+from collections import OrderedDict
+import importlib.util
 import inspect
+import json
 import os
+import shutil
+import threading
+import uuid
+
+# fluid.program_guard/scope_guard switch process wide defaults, building the
+# programs of two conversions at the same time has to be serialized
+_build_lock = threading.Lock()
 
 
 def export_paddle_param(param, param_name, dir):
@@ -51,6 +64,71 @@ def export_paddle_param(param, param_name, dir):
     fp.close()
 
 
+def load_model_module(py_code_dir):
+    """
+    Import model.py in py_code_dir under a unique module name, so that a
+    later conversion in the same process never gets the cached module of
+    an earlier one. The module is not registered in sys.modules.
+    """
+    name = 'x2paddle_model_{}'.format(uuid.uuid4().hex)
+    spec = importlib.util.spec_from_file_location(
+        name, os.path.join(py_code_dir, 'model.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def infer_program_shapes(block):
+    for op in block.ops:
+        if op.type in ['feed', 'fetch']:
+            continue
+        try:
+            op.desc.infer_var_type(block.desc)
+            op.desc.infer_shape(block.desc)
+        except Exception as e:
+            raise Exception("Failed to infer the shapes of {} ({}): {}".format(
+                op.type, op.output_arg_names, e))
+
+
+def specialize_program(program, input_shapes):
+    """
+    Set the static shapes of the inputs and infer the shapes of the program
+    again, the shape ops of static variables are folded into constants and
+    the shapes of reshape are written with the static output shapes.
+    """
+    block = program.global_block()
+    for name, shape in input_shapes.items():
+        block.var(name).desc.set_shape(shape)
+    infer_program_shapes(block)
+    for i, op in enumerate(list(block.ops)):
+        if op.type == 'shape':
+            in_shape = block.var(op.input('Input')[0]).shape
+            if any([dim <= 0 for dim in in_shape]):
+                continue
+            out_name = op.output('Out')[0]
+            block._remove_op(i)
+            block._insert_op(
+                i,
+                type='assign_value',
+                outputs={'Out': [out_name]},
+                attrs={
+                    'shape': [len(in_shape)],
+                    'dtype': fluid.core.VarDesc.VarType.INT32,
+                    'int32_values': [int(dim) for dim in in_shape]
+                })
+        elif op.type in ['reshape', 'reshape2']:
+            # the shape is given by the tensors
+            if any([
+                    len(op.input(name)) > 0 for name in op.input_names
+                    if name in ['Shape', 'ShapeTensor']
+            ]):
+                continue
+            out_shape = block.var(op.output('Out')[0]).shape
+            if all([dim > 0 for dim in out_shape]):
+                op._set_attr('shape', [int(dim) for dim in out_shape])
+    infer_program_shapes(block)
+
+
 # This func will copy to generate code file
 def run_net(param_dir="./"):
     import os
@@ -90,10 +168,12 @@ class OpMapper(object):
         if len(unsupported_ops) == 0:
             return True
         else:
-            print("There are {} ops not supported yet, list as below".format(
-                len(unsupported_ops)))
+            logger.error(
+                "There are {} ops not supported yet, list as below".format(
+                    len(unsupported_ops)),
+                unsupported_ops=list(unsupported_ops))
             for op in unsupported_ops:
-                print(op)
+                logger.error(op)
             return False
 
     def add_codes(self, codes, indent=0):
@@ -112,54 +192,206 @@ class OpMapper(object):
         self.add_codes("import paddle.fluid as fluid")
         self.add_codes("")
 
-    def save_inference_model(self, save_dir, params_merge):
+    def save_inference_model(self, save_dir, params_merge, profiles=None):
         self.save_python_model(save_dir)
+        with profiler.stage('save_inference_model'):
+            self.save_paddle_model(save_dir, params_merge)
+        if profiles is not None:
+            with profiler.stage('save_profiles'):
+                self.save_profiles(save_dir, params_merge, profiles)
 
-        import sys
-        import paddle.fluid as fluid
+    def save_paddle_model(self, save_dir, params_merge):
         py_code_dir = os.path.join(save_dir, "model_with_code")
-        sys.path.append(py_code_dir)
-        import model
         try:
-            inputs, outputs = model.x2paddle_net()
-            for i, out in enumerate(outputs):
-                if isinstance(out, list):
-                    for out_part in out:
-                        outputs.append(out_part)
-                    del outputs[i]
-            input_names = [input.name for input in inputs]
-            exe = fluid.Executor(fluid.CPUPlace())
-            exe.run(fluid.default_startup_program())
-
-            def if_exist(var):
-                b = os.path.exists(
-                    os.path.join(os.path.join(py_code_dir, var.name)))
-                return b
-
-            fluid.io.load_vars(
-                exe,
-                py_code_dir,
-                fluid.default_main_program(),
-                predicate=if_exist)
-            if params_merge:
-                fluid.io.save_inference_model(
-                    dirname=os.path.join(save_dir, "inference_model"),
-                    feeded_var_names=input_names,
-                    target_vars=outputs,
-                    executor=exe,
-                    params_filename="__params__")
-            else:
+            model = load_model_module(py_code_dir)
+            # build in a fresh program and scope, nothing is left in the
+            # default ones for the next conversion
+            main_program = fluid.Program()
+            startup_program = fluid.Program()
+            scope = fluid.Scope()
+            with _build_lock, fluid.program_guard(main_program,
+                                                  startup_program), \
+                    fluid.unique_name.guard(), fluid.scope_guard(scope):
+                inputs, outputs = model.x2paddle_net()
+                for i, out in enumerate(outputs):
+                    if isinstance(out, list):
+                        for out_part in out:
+                            outputs.append(out_part)
+                        del outputs[i]
+                input_names = [input.name for input in inputs]
+                exe = fluid.Executor(fluid.CPUPlace())
+                exe.run(startup_program)
+
+                def if_exist(var):
+                    b = os.path.exists(os.path.join(py_code_dir, var.name))
+                    return b
+
+                fluid.io.load_vars(
+                    exe, py_code_dir, main_program, predicate=if_exist)
+                if params_merge:
+                    params_filename = "__params__"
+                else:
+                    params_filename = None
                 fluid.io.save_inference_model(
                     dirname=os.path.join(save_dir, "inference_model"),
                     feeded_var_names=input_names,
                     target_vars=outputs,
                     executor=exe,
-                    params_filename=None)
+                    main_program=main_program,
+                    params_filename=params_filename)
         except:
             raise Exception(
                 "Paddle code was saved in {}/model.py, but seems there's wrong exist, please check model.py manually."
                 .format(py_code_dir))
 
+    def save_profiles(self, save_dir, params_merge, profiles):
+        """
+        Save the program specialized to the static input shapes of each
+        profile in inference_model as __model__.<profile name>, all of them
+        share the parameters saved in inference_model, e.g.
+        fluid.io.load_inference_model(dirname, exe, '__model__.batch32',
+        '__params__'). The profiles are listed in profiles.json.
+        """
+        from x2paddle.core.input_spec import resolve_profile
+        py_code_dir = os.path.join(save_dir, "model_with_code")
+        model_dir = os.path.join(save_dir, "inference_model")
+        model = load_model_module(py_code_dir)
+        main_program = fluid.Program()
+        startup_program = fluid.Program()
+        params_filename = "__params__" if params_merge else None
+        info = OrderedDict()
+        with _build_lock, fluid.program_guard(main_program, startup_program), \
+                fluid.unique_name.guard(), fluid.scope_guard(fluid.Scope()):
+            inputs, outputs = model.x2paddle_net()
+            for i, out in enumerate(outputs):
+                if isinstance(out, list):
+                    for out_part in out:
+                        outputs.append(out_part)
+                    del outputs[i]
+            input_shapes = OrderedDict(
+                [(input.name, list(input.shape)) for input in inputs])
+            exe = fluid.Executor(fluid.CPUPlace())
+            for name, profile in profiles.items():
+                shapes = resolve_profile(name, profile, input_shapes)
+                program = main_program.clone()
+                specialize_program(program, shapes)
+                block = program.global_block()
+                model_filename = "__model__.{}".format(name)
+                fluid.io.save_inference_model(
+                    dirname=model_dir,
+                    feeded_var_names=list(input_shapes.keys()),
+                    target_vars=[block.var(out.name) for out in outputs],
+                    executor=exe,
+                    main_program=program,
+                    model_filename=model_filename,
+                    params_filename=params_filename,
+                    program_only=True)
+                info[name] = {
+                    'model_filename': model_filename,
+                    'params_filename': params_filename,
+                    'input_shapes': shapes
+                }
+                logger.info("Profile {} saved as {}".format(name,
+                                                             model_filename))
+        with open(os.path.join(model_dir, "profiles.json"), 'w') as f:
+            json.dump(info, f, indent=2)
+
+    def save_weights(self, save_dir, reuse_dir):
+        """
+        Save the weights into save_dir with the program of the conversion in
+        reuse_dir, the code generated for this model has to be the same as
+        the code in reuse_dir.
+        """
+        with open(os.path.join(reuse_dir, "model_with_code", "model.py")) as f:
+            reuse_code = f.read()
+        with profiler.stage('generate_code'):
+            if self.build_code() != reuse_code:
+                # e.g. a value of the weights is written into the code
+                raise Exception(
+                    "The code generated for the model is not the same as the "
+                    "code in {}, please convert the model without "
+                    "--weights_only".format(reuse_dir))
+        self.save_reused_model(save_dir, reuse_dir)
+
+    def save_reused_model(self, save_dir, reuse_dir):
+        """
+        Save the weights into save_dir with the program and the code of the
+        conversion in reuse_dir, the other parameters are reused.
+        """
+        from x2paddle.decoder.paddle_decoder import PaddleParamsReader
+        py_code_dir = os.path.join(save_dir, "model_with_code")
+        with open(os.path.join(reuse_dir, "model_with_code", "model.py")) as f:
+            reuse_code = f.read()
+        if not os.path.exists(py_code_dir):
+            os.makedirs(py_code_dir)
+        with open(os.path.join(py_code_dir, "model.py"), 'w') as f:
+            f.write(reuse_code)
+
+        self.export_params(py_code_dir)
+
+        reuse_model_dir = os.path.join(reuse_dir, "inference_model")
+        model_dir = os.path.join(save_dir, "inference_model")
+        if not os.path.exists(model_dir):
+            os.makedirs(model_dir)
+        with open(os.path.join(reuse_model_dir, "__model__"), 'rb') as f:
+            model_str = f.read()
+        program_desc = framework_pb2.ProgramDesc.FromString(model_str)
+        var_names = list()
+        for var in program_desc.blocks[0].vars:
+            if var.persistable and \
+                    var.type.type == framework_pb2.VarType.LOD_TENSOR:
+                var_names.append(var.name)
+                if var.name not in self.weights:
+                    continue
+                dims = list(var.type.lod_tensor.tensor.dims)
+                if all([dim > 0 for dim in dims]) and \
+                        int(numpy.prod(dims)) != self.weights[var.name].size:
+                    raise Exception(
+                        "Shape of parameter {} is changed from {} to {}".
+                        format(var.name, dims,
+                               list(self.weights[var.name].shape)))
+        # the weights which are not computed again are constants of the
+        # structure, the ones saved with the code are copied
+        reuse_code_dir = os.path.join(reuse_dir, "model_with_code")
+        if os.path.abspath(reuse_code_dir) != os.path.abspath(py_code_dir):
+            for name in var_names:
+                path = os.path.join(reuse_code_dir, name)
+                if name not in self.weights and os.path.exists(path):
+                    shutil.copyfile(path, os.path.join(py_code_dir, name))
+        # the parameters which are not in weights are created by the
+        # initializers of the program, the saved ones are reused
+        params_merge = os.path.exists(
+            os.path.join(reuse_model_dir, "__params__"))
+        reuse_params = PaddleParamsReader(
+            reuse_model_dir, [
+                name for name in var_names if name not in self.weights
+            ] if not params_merge else var_names,
+            "__params__" if params_merge else None)
+
+        def get_bytes(name):
+            if name in self.weights:
+                with open(os.path.join(py_code_dir, name), 'rb') as f:
+                    return f.read()
+            return reuse_params.get_bytes(name)
+
+        if params_merge:
+            params_files = {"__params__": sorted(var_names)}
+        else:
+            params_files = {name: [name] for name in var_names}
+        # write to temporary files first, save_dir can be reuse_dir
+        with profiler.stage('save_params'):
+            for filename, names in params_files.items():
+                with open(os.path.join(model_dir, filename + ".tmp"),
+                          'wb') as f:
+                    for name in names:
+                        f.write(get_bytes(name))
+            with open(os.path.join(model_dir, "__model__.tmp"), 'wb') as f:
+                f.write(model_str)
+            reuse_params.close()
+            for filename in list(params_files.keys()) + ["__model__"]:
+                path = os.path.join(model_dir, filename)
+                os.rename(path + ".tmp", path)
+
     def save_python_model(self, save_dir):
         if not os.path.exists(save_dir):
             os.makedirs(save_dir)
@@ -168,8 +400,40 @@ class OpMapper(object):
         if not os.path.exists(py_code_dir):
             os.makedirs(py_code_dir)
 
-        for name, param in self.weights.items():
-            export_paddle_param(param, name, py_code_dir)
+        streamed = self.is_streamed(py_code_dir)
+        if streamed:
+            # the writer exports the staged weights while the code is
+            # generated
+            self.weights.release_all()
+        else:
+            self.export_params(py_code_dir)
+        with profiler.stage('generate_code'):
+            self.generate_code(save_dir)
+        if streamed:
+            self.export_params(py_code_dir)
+
+    def is_streamed(self, py_code_dir):
+        """ whether the weights are exported to py_code_dir by a writer """
+        return isinstance(self.weights, StreamedWeights) and \
+            os.path.abspath(self.weights.writer.param_dir) == \
+            os.path.abspath(py_code_dir)
+
+    def export_params(self, py_code_dir):
+        with profiler.stage('export_params'):
+            if self.is_streamed(py_code_dir):
+                self.weights.flush()
+                return
+            for name, param in self.weights.items():
+                export_paddle_param(param, name, py_code_dir)
+
+    def generate_code(self, save_dir):
+        py_code_dir = os.path.join(save_dir, "model_with_code")
+        self.build_code()
+        fp = open(os.path.join(py_code_dir, "model.py"), 'w')
+        fp.write(self.paddle_codes)
+        fp.close()
+
+    def build_code(self):
         self.add_heads()
 
         if hasattr(self, "used_custom_layers"):
@@ -204,6 +468,4 @@ class OpMapper(object):
         self.add_codes("", 0)
 
         self.add_codes(inspect.getsourcelines(run_net)[0])
-        fp = open(os.path.join(py_code_dir, "model.py"), 'w')
-        fp.write(self.paddle_codes)
-        fp.close()
+        return self.paddle_codes
@@ -0,0 +1,190 @@
+#   Copyright (c) 2020  PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Export the parameters to model_with_code in a background thread while the
+nodes are still mapped, e.g.
+x2paddle --framework caffe --prototxt a.prototxt --weight a.caffemodel
+         --save_dir pd --stream_params
+
+A weight set by the handler of a node is staged until all the nodes using
+that node are mapped, as they may still transpose or drop it, and then it is
+handed to the writer. Weights set by the nodes before a node in hold_ops
+(e.g. the BatchNorm folded into the preceding Convolution by the optimizer)
+stay staged until the optimizer passes are done. A weight can be rewritten
+or deleted at any time: the pending request of the writer is replaced, or
+the exported file is written again or removed.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from six.moves import queue
+from x2paddle.core.logger import logger
+
+_held = object()
+
+
+class ParamWriter(object):
+    """
+    Writer thread of the parameters, at most max_pending requests are queued
+    and put blocks until the writer catches up.
+    """
+
+    def __init__(self, param_dir, hold_ops=None, max_pending=64):
+        self.param_dir = param_dir
+        self.hold_ops = set(hold_ops or [])
+        if not os.path.isdir(param_dir):
+            os.makedirs(param_dir)
+        self.queue = queue.Queue(max_pending)
+        self.latest = dict()
+        self.seq = 0
+        self.error = None
+        self.written = 0
+        self.skipped = 0
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        try:
+            from x2paddle.core.op_mapper import export_paddle_param
+        except Exception as e:
+            self.error = str(e)
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            seq, name, value = item
+            # replaced by a later request of the same parameter, or the
+            # rest is drained after an error so that put never blocks
+            if self.latest.get(name) != seq or self.error is not None:
+                self.skipped += 1
+                continue
+            try:
+                if value is not None:
+                    export_paddle_param(value, name, self.param_dir)
+                    self.written += 1
+                elif os.path.exists(os.path.join(self.param_dir, name)):
+                    os.remove(os.path.join(self.param_dir, name))
+            except Exception as e:
+                self.error = "{}: {}".format(name, e)
+
+    def put(self, name, value):
+        """ write the parameter, or remove it if value is None """
+        if self.error is not None:
+            raise Exception("Failed to export parameter {}".format(
+                self.error))
+        self.seq += 1
+        self.latest[name] = self.seq
+        self.queue.put((self.seq, name, value))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise Exception("Failed to export parameter {}".format(
+                self.error))
+        logger.info("{} parameters exported, {} replaced before writing".
+                    format(self.written, self.skipped))
+
+
+class StreamedWeights(dict):
+    """
+    weights of a mapper whose values are handed to a ParamWriter, the
+    handlers and the optimizer passes use it as a dict.
+    """
+
+    def __init__(self, writer):
+        super(StreamedWeights, self).__init__()
+        self.writer = writer
+        self.staged = OrderedDict()
+        self.owned = dict()
+        self.waiting = dict()
+        self.owner = None
+
+    def __setitem__(self, name, value):
+        super(StreamedWeights, self).__setitem__(name, value)
+        self.staged.pop(name, None)
+        if self.owner is None:
+            self.writer.put(name, value)
+        else:
+            self.staged[name] = self.owner
+            if self.owner is not _held:
+                self.owned.setdefault(self.owner, list()).append(name)
+
+    def __delitem__(self, name):
+        super(StreamedWeights, self).__delitem__(name)
+        self.retract(name)
+
+    def pop(self, name, *default):
+        if name in self:
+            self.retract(name)
+        return super(StreamedWeights, self).pop(name, *default)
+
+    def update(self, *args, **kwargs):
+        for name, value in dict(*args, **kwargs).items():
+            self[name] = value
+
+    def retract(self, name):
+        if name in self.staged:
+            del self.staged[name]
+        else:
+            self.writer.put(name, None)
+
+    @contextmanager
+    def mapping(self, graph, node_name, node):
+        """ the weights set in the block are staged for the node """
+        hold_ops = self.writer.hold_ops
+        held = node.layer_type in hold_ops or any([
+            graph.get_node(name).layer_type in hold_ops
+            for name in node.outputs
+        ])
+        self.owner = _held if held else node_name
+        try:
+            yield
+        finally:
+            self.owner = None
+        if len(node.outputs) == 0:
+            self.release(node_name)
+        for name in node.inputs:
+            if name not in self.waiting:
+                self.waiting[name] = len(graph.get_node(name).outputs)
+            self.waiting[name] -= 1
+            if self.waiting[name] == 0:
+                self.release(name)
+
+    def release(self, node_name):
+        for name in self.owned.pop(node_name, list()):
+            if self.staged.get(name) == node_name:
+                del self.staged[name]
+                self.writer.put(name, self[name])
+
+    def release_all(self):
+        for name in list(self.staged.keys()):
+            self.writer.put(name, self[name])
+        self.staged.clear()
+        self.owned.clear()
+
+    def flush(self):
+        """ export the staged weights and wait for the writer """
+        self.release_all()
+        self.writer.close()
+
+
+def make_weights(param_writer=None):
+    """ weights of a mapper, streamed to param_writer if it's given """
+    if param_writer is None:
+        return dict()
+    return StreamedWeights(param_writer)
@@ -0,0 +1,184 @@
+#   Copyright (c) 2019  PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from contextlib import contextmanager
+import json
+import time
+import os
+import sys
+import threading
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def get_peak_rss():
+    """ peak resident set size of the process in bytes """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on linux
+    if sys.platform == 'darwin':
+        return peak
+    return peak * 1024
+
+
+class TraceScope(object):
+    """ a complete ("X") event of chrome trace_event format """
+
+    def __init__(self, events, name, category, args):
+        self.events = events
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        event = {
+            'name': self.name,
+            'cat': self.category,
+            'ph': 'X',
+            'ts': self.start * 1e6,
+            'dur': (time.time() - self.start) * 1e6,
+            'pid': os.getpid(),
+            'tid': threading.current_thread().ident
+        }
+        if self.args:
+            event['args'] = self.args
+        self.events.append(event)
+        return False
+
+
+class NullScope(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+null_scope = NullScope()
+
+
+class Profiler(object):
+    """
+    Record the wall time, cpu time and memory of the conversion stages, the
+    stages are nested by name, e.g. "optimize/merge_bn_scale".
+    With tracing enabled, the stages and the mapping of each node are also
+    recorded as chrome trace events.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.records = list()
+        self.stack = list()
+        self.tracing = False
+        self.trace_events = list()
+
+    def enable_trace(self):
+        self.tracing = True
+        self.trace_events = list()
+
+    def disable_trace(self):
+        self.tracing = False
+
+    def trace(self, name, category='op', **args):
+        """
+        Return a context manager timing the block as a trace event, which
+        costs nothing but an attribute check when tracing is disabled.
+        """
+        if not self.tracing:
+            return null_scope
+        return TraceScope(self.trace_events, name, category, args)
+
+    def save_trace(self, path):
+        dirname = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.trace_events}, f)
+
+    def enable(self, trace_memory=True):
+        self.enabled = True
+        self.records = list()
+        self.stack = list()
+        if trace_memory and tracemalloc is not None \
+                and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def disable(self):
+        self.enabled = False
+        if tracemalloc is not None and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def get_traced_peak(self):
+        if tracemalloc is None or not tracemalloc.is_tracing():
+            return None
+        return tracemalloc.get_traced_memory()[1]
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            with self.trace(name, 'stage'):
+                yield
+            return
+        traced = tracemalloc is not None and tracemalloc.is_tracing()
+        if traced and hasattr(tracemalloc, 'reset_peak'):
+            # the peak is reset for each stage, keep the peak of the
+            # enclosing stage until now
+            if len(self.stack) > 0:
+                self.stack[-1][1] = max(self.stack[-1][1],
+                                        self.get_traced_peak())
+            tracemalloc.reset_peak()
+        self.stack.append([name, 0])
+        full_name = '/'.join([stage[0] for stage in self.stack])
+        start_wall = time.time()
+        start_cpu = time.process_time()
+        try:
+            with self.trace(full_name, 'stage'):
+                yield
+        finally:
+            record = {
+                'stage': full_name,
+                'wall_time': time.time() - start_wall,
+                'cpu_time': time.process_time() - start_cpu,
+                'peak_rss': get_peak_rss()
+            }
+            _, peak = self.stack.pop()
+            if traced:
+                peak = max(peak, self.get_traced_peak())
+                record['peak_traced_memory'] = peak
+                if len(self.stack) > 0:
+                    self.stack[-1][1] = max(self.stack[-1][1], peak)
+            self.records.append(record)
+
+    def save(self, path, **info):
+        report = dict(info)
+        report['stages'] = self.records
+        dirname = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+profiler = Profiler()
@@ -0,0 +1,196 @@
+#   Copyright (c) 2020  PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Map the nodes of a graph with a pool of threads, e.g.
+x2paddle --framework onnx --model model.onnx --save_dir pd --map_workers 4
+
+The nodes are grouped into levels by the longest path from the inputs, so the
+nodes of a level never depend on each other and are mapped at the same time.
+Each handler runs on a shallow copy of the mapper whose weights,
+used_custom_layers, omit_nodes and remove_edge (the edges of the graph
+removed by the handlers) only record its own changes, which are merged into
+the mapper in the order of topo_sort after the level is done, so the result
+is the same as mapping the nodes one at a time. The handlers
+writing other state of the mapper or of the other nodes are given by
+is_serial, and are mapped one at a time in the merge.
+"""
+
+import copy
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+from x2paddle.core.logger import logger
+from x2paddle.core.param_writer import StreamedWeights
+from x2paddle.core.profiler import profiler, null_scope
+
+_deleted = object()
+
+
+class OverlayDict(MutableMapping):
+    """ changes of a dict kept aside until they are applied to the dict """
+
+    def __init__(self, base):
+        self.base = base
+        self.changes = OrderedDict()
+
+    def __getitem__(self, key):
+        if key in self.changes:
+            value = self.changes[key]
+            if value is _deleted:
+                raise KeyError(key)
+            return value
+        return self.base[key]
+
+    def __setitem__(self, key, value):
+        self.changes[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.changes[key] = _deleted
+
+    def __iter__(self):
+        for key in self.base:
+            if key not in self.changes:
+                yield key
+        for key, value in self.changes.items():
+            if value is not _deleted:
+                yield key
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def apply(self, overwrite=True):
+        for key, value in self.changes.items():
+            if value is _deleted:
+                self.base.pop(key, None)
+            elif overwrite or key not in self.base:
+                self.base[key] = value
+
+
+def get_levels(graph):
+    """ names of the nodes of graph.topo_sort grouped by dependency level """
+    node_level = dict()
+    levels = list()
+    for node_name in graph.topo_sort:
+        node = graph.get_node(node_name)
+        level = 0
+        for input_name in node.inputs:
+            if input_name in node_level:
+                level = max(level, node_level[input_name] + 1)
+        node_level[node_name] = level
+        if level == len(levels):
+            levels.append(list())
+        levels[level].append(node_name)
+    return levels
+
+
+def make_view(mapper):
+    view = copy.copy(mapper)
+    view.weights = OverlayDict(mapper.weights)
+    if hasattr(mapper, 'used_custom_layers'):
+        view.used_custom_layers = OverlayDict(mapper.used_custom_layers)
+    if hasattr(mapper, 'omit_nodes'):
+        view.omit_nodes = list()
+    if hasattr(mapper, 'remove_edge'):
+        view.removed_edges = list()
+
+        def remove_edge(in_node_name, out_node_name):
+            # the edges of the shared graph are removed in merge_view, only
+            # checked here to fail in the handler as the mapper does
+            edge = (in_node_name, out_node_name)
+            in_node = mapper.graph.get_node(in_node_name)
+            out_node = mapper.graph.get_node(out_node_name)
+            removed = view.removed_edges.count(edge)
+            if in_node.outputs.count(out_node_name) <= removed or \
+                    out_node.inputs.count(in_node_name) <= removed:
+                raise ValueError("{} is not an input of {}".format(
+                    in_node_name, out_node_name))
+            view.removed_edges.append(edge)
+
+        view.remove_edge = remove_edge
+    return view
+
+
+def merge_view(mapper, view):
+    view.weights.apply()
+    if hasattr(mapper, 'used_custom_layers'):
+        # the code of a custom layer is added by its first node
+        view.used_custom_layers.apply(overwrite=False)
+    if hasattr(mapper, 'omit_nodes'):
+        mapper.omit_nodes.extend(view.omit_nodes)
+    if hasattr(mapper, 'remove_edge'):
+        for in_node_name, out_node_name in view.removed_edges:
+            mapper.remove_edge(in_node_name, out_node_name)
+
+
+def map_nodes(graph, mapper, map_node, workers=1, is_serial=None):
+    """
+    Map the nodes of graph.topo_sort with map_node(mapper, node), with a pool
+    of workers threads if workers > 1.
+    """
+    total = len(graph.topo_sort)
+    weights = getattr(mapper, 'weights', None)
+
+    def mapping(node_name, node):
+        # the weights of the node are handed to the writer with
+        # --stream_params once the nodes using it are mapped
+        if isinstance(weights, StreamedWeights):
+            return weights.mapping(graph, node_name, node)
+        return null_scope
+
+    if workers is None or workers <= 1:
+        for i, node_name in enumerate(graph.topo_sort):
+            logger.progress("Converting nodes", i + 1, total)
+            node = graph.get_node(node_name)
+            with profiler.trace(node_name, node.layer_type), \
+                    mapping(node_name, node):
+                map_node(mapper, node)
+        return
+
+    def run(view, node_name, node):
+        with profiler.trace(node_name, node.layer_type):
+            map_node(view, node)
+
+    levels = get_levels(graph)
+    logger.info("Mapping {} levels of nodes with {} threads".format(
+        len(levels), workers))
+    mapped = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for level in levels:
+            nodes = [(name, graph.get_node(name)) for name in level]
+            tasks = dict()
+            if len(nodes) > 1:
+                for node_name, node in nodes:
+                    if is_serial is not None and is_serial(node):
+                        continue
+                    view = make_view(mapper)
+                    tasks[node_name] = (view, pool.submit(run, view,
+                                                          node_name, node))
+            # the shared state is only changed after all the handlers of the
+            # level are done, the exception of the first node is raised
+            wait([future for view, future in tasks.values()])
+            for node_name, node in nodes:
+                with mapping(node_name, node):
+                    if node_name in tasks:
+                        view, future = tasks[node_name]
+                        future.result()
+                        merge_view(mapper, view)
+                    else:
+                        run(mapper, node_name, node)
+                mapped += 1
+                logger.progress("Converting nodes", mapped, total)
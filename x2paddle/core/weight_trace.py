@@ -0,0 +1,435 @@
+#   Copyright (c) 2020  PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Record how the weights of a conversion are computed from the weights of the
+model, so that they can be computed again for a retrained model without
+mapping the nodes (x2paddle --weights_only).
+
+The weights of the model are handed to the handlers as TracedArray, and the
+numpy operations on them (transposes, reshapes, casts, the arithmetic of BN
+folding ...) record an expression of the result, which is a list of plain
+values and can be saved as json:
+    ['source', key]                      a weight of the model
+    ['ufunc', name, method, args, kwargs, out_dtype]
+    ['func', module, name, args, kwargs] a function of numpy
+    ['method', name, array, args, kwargs]
+    ['getitem', array, index], ['setitem', array, index, value]
+    ['part', expr, i]                    i-th array returned by expr
+and the constants ['const', value], ['array', list, dtype, shape] ...
+
+A value read into python (bool, float, tolist, str ...) may be written into
+the code or decide which code is generated, so it's recorded as a guard with
+its expression. Arrays made without a TracedArray (e.g. numpy.zeros, or a
+copy by numpy.array) are taken as constants of the structure of the model,
+and the values computed by an operation which is not traced (e.g. by running
+the tensorflow graph) can't be computed again.
+"""
+
+import importlib
+import json
+import threading
+import numpy
+from six.moves import builtins
+
+# plain arrays in the expressions are saved as lists
+_max_constant_size = 4096
+
+_inplace_funcs = ['copyto', 'place', 'put', 'putmask', 'fill_diagonal']
+
+
+class Untraceable(Exception):
+    pass
+
+
+def _plain(value):
+    if isinstance(value, TracedArray):
+        return value.view(numpy.ndarray)
+    if type(value) in (list, tuple):
+        return type(value)([_plain(v) for v in value])
+    return value
+
+
+def _arrays(value):
+    if isinstance(value, numpy.ndarray):
+        return [value]
+    if type(value) in (list, tuple):
+        return [array for v in value for array in _arrays(v)]
+    return []
+
+
+def encode(value):
+    """ expression of value, raise Untraceable if it can't be evaluated """
+    if isinstance(value, TracedArray):
+        if value.expr is None:
+            raise Untraceable("a weight is computed by an operation which is "
+                              "not traced")
+        return value.expr
+    if isinstance(value, numpy.ndarray):
+        if value.size > _max_constant_size:
+            raise Untraceable("a weight is computed with a large array which "
+                              "is not a weight of the model")
+        return ['array', value.tolist(), str(value.dtype), list(value.shape)]
+    if isinstance(value, numpy.generic):
+        return ['scalar', value.item(), str(value.dtype)]
+    if isinstance(value, numpy.dtype):
+        return ['dtype', str(value)]
+    if isinstance(value, type):
+        if issubclass(value, numpy.generic):
+            return ['dtype', numpy.dtype(value).name]
+        if value in (bool, int, float, complex):
+            return ['type', value.__name__]
+    if type(value) in (list, tuple):
+        return [type(value).__name__, [encode(v) for v in value]]
+    if isinstance(value, slice):
+        return [
+            'slice', encode(value.start), encode(value.stop),
+            encode(value.step)
+        ]
+    if value is Ellipsis:
+        return ['ellipsis']
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return ['const', value]
+    raise Untraceable("a weight is computed with an argument of {}".format(
+        type(value).__name__))
+
+
+def _encode_call(args, kwargs):
+    return [encode(list(args)), {k: encode(v) for k, v in kwargs.items()}]
+
+
+def evaluate(expr, get_source):
+    """ value of expr, the weights of the model are given by get_source """
+
+    def run(expr):
+        return evaluate(expr, get_source)
+
+    tag = expr[0]
+    if tag == 'source':
+        return get_source(expr[1])
+    if tag == 'const':
+        return expr[1]
+    if tag == 'array':
+        return numpy.array(expr[1], dtype=expr[2]).reshape(expr[3])
+    if tag == 'scalar':
+        return numpy.dtype(expr[2]).type(expr[1])
+    if tag == 'dtype':
+        return numpy.dtype(expr[1])
+    if tag == 'type':
+        return getattr(builtins, expr[1])
+    if tag == 'list':
+        return [run(e) for e in expr[1]]
+    if tag == 'tuple':
+        return tuple([run(e) for e in expr[1]])
+    if tag == 'slice':
+        return slice(run(expr[1]), run(expr[2]), run(expr[3]))
+    if tag == 'ellipsis':
+        return Ellipsis
+    if tag == 'part':
+        return run(expr[1])[expr[2]]
+    if tag == 'getitem':
+        return run(expr[1])[run(expr[2])]
+    if tag == 'setitem':
+        array = numpy.array(run(expr[1]))
+        array[run(expr[2])] = run(expr[3])
+        return array
+    args = run(expr[-3] if tag == 'ufunc' else expr[-2])
+    kwargs = {
+        k: run(v)
+        for k, v in (expr[-2] if tag == 'ufunc' else expr[-1]).items()
+    }
+    if tag == 'ufunc':
+        result = getattr(getattr(numpy, expr[1]), expr[2])(*args, **kwargs)
+        if expr[5] is not None:
+            # written into an array in place
+            result = numpy.asarray(result).astype(expr[5])
+        return result
+    if tag == 'func':
+        func = getattr(importlib.import_module(expr[1]), expr[2])
+        return func(*args, **kwargs)
+    if tag == 'method':
+        return getattr(run(expr[2]), expr[1])(*args, **kwargs)
+    raise Exception("Unknown expression {}".format(tag))
+
+
+def guard_value(value):
+    if isinstance(value, (numpy.ndarray, numpy.generic)):
+        return value.tolist()
+    if type(value) in (list, tuple):
+        return [guard_value(v) for v in value]
+    return value
+
+
+class Tracer(object):
+    """
+    guards and failures recorded by the TracedArray of a conversion, it's
+    shared by the copies of the graph and safe to use from threads
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.guards = dict()
+        self.sources = dict()
+        self.failure = None
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def source(self, key, value):
+        """ the weight key of the model, traced if it's a float tensor """
+        if not isinstance(value, numpy.ndarray) or value.dtype.kind != 'f':
+            # the other tensors are hashed with the structure of the model
+            return value
+        with self.lock:
+            self.sources.setdefault(json.dumps(key), value)
+        array = self.wrap(value, ['source', key])
+        # the weight is read again by the same expression, so it can't be
+        # changed in place
+        array.shared = True
+        return array
+
+    def opaque(self, value):
+        """ value computed from the weights by an operation not traced """
+        if isinstance(value, (numpy.ndarray, numpy.generic)) and \
+                value.dtype.kind == 'f':
+            return self.wrap(value, None)
+        return value
+
+    def get_source(self, key):
+        """ the weight key of the model handed to the handlers """
+        return self.sources[json.dumps(key)]
+
+    def wrap(self, value, expr, inputs=()):
+        if isinstance(value, numpy.ndarray):
+            array = value.view(TracedArray)
+            array.trace = self
+            array.expr = expr
+            array.shared = False
+            for input in _arrays(inputs):
+                if numpy.may_share_memory(value, _plain(input)):
+                    # changing one of them in place changes the other one
+                    array.shared = True
+                    if isinstance(input, TracedArray):
+                        input.viewed = True
+            return array
+        if type(value) in (list, tuple) and \
+                all([isinstance(v, numpy.ndarray) for v in value]):
+            return type(value)([
+                self.wrap(v, None if expr is None else ['part', expr, i],
+                          inputs) for i, v in enumerate(value)
+            ])
+        self.guard(expr, value)
+        return value
+
+    def guard(self, expr, value):
+        """ value computed by expr is read into python """
+        if expr is None:
+            self.fail("a value computed by an operation which is not "
+                      "traced is read")
+            return
+        if isinstance(value, numpy.ndarray) and \
+                value.size > _max_constant_size:
+            self.fail("a large array computed from a weight is read")
+            return
+        try:
+            value = guard_value(value)
+            key = json.dumps(expr)
+            json.dumps(value)
+        except (TypeError, ValueError):
+            self.fail("a value of a weight is read as {}".format(
+                type(value).__name__))
+            return
+        with self.lock:
+            self.guards[key] = value
+
+    def fail(self, reason):
+        with self.lock:
+            if self.failure is None:
+                self.failure = reason
+
+    def get_guards(self):
+        return [[json.loads(key), value] for key, value in self.guards.items()]
+
+
+def _traced_method(name):
+    def method(self, *args, **kwargs):
+        value = getattr(self.view(numpy.ndarray),
+                        name)(*_plain(args), **_plain(kwargs))
+        if self.trace is None:
+            return value
+        try:
+            expr = ['method', name, encode(self)] + _encode_call(args, kwargs)
+        except Untraceable:
+            expr = None
+        return self.trace.wrap(value, expr, (self, ) + tuple(args))
+
+    method.__name__ = name
+    return method
+
+
+def _inplace_method(name):
+    def method(self, *args, **kwargs):
+        if self.trace is not None:
+            self.trace.fail("a weight is changed in place by {}".format(name))
+        return getattr(self.view(numpy.ndarray), name)(*args, **kwargs)
+
+    method.__name__ = name
+    return method
+
+
+def _guarded_method(name):
+    def method(self, *args, **kwargs):
+        value = getattr(self.view(numpy.ndarray), name)(*args, **kwargs)
+        if self.trace is not None:
+            self.trace.guard(self.expr, self.view(numpy.ndarray))
+        return value
+
+    method.__name__ = name
+    return method
+
+
+class TracedArray(numpy.ndarray):
+    """ an array computed from the weights of the model by expr """
+
+    def __array_finalize__(self, obj):
+        # made by an operation which is not traced, e.g. a view by numpy
+        self.trace = getattr(obj, 'trace', None)
+        self.expr = None
+        self.shared = True
+        self.viewed = False
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        out = kwargs.pop('out', None)
+        plain_kwargs = _plain(kwargs)
+        if out is not None:
+            plain_kwargs['out'] = _plain(tuple(out))
+        value = getattr(ufunc, method)(*_plain(inputs), **plain_kwargs)
+        if self.trace is None:
+            return value
+        if method == 'at':
+            self.trace.fail("a weight is changed in place by numpy.{}.at".
+                            format(ufunc.__name__))
+            return value
+        try:
+            if getattr(numpy, ufunc.__name__, None) is not ufunc:
+                raise Untraceable("numpy.{} is not found".format(
+                    ufunc.__name__))
+            expr = ['ufunc', ufunc.__name__, method] + \
+                _encode_call(inputs, kwargs)
+        except Untraceable:
+            expr = None
+        if out is None:
+            return self.trace.wrap(value, None
+                                   if expr is None else expr + [None], inputs)
+        # written into the arrays in place
+        for array in out:
+            self.write(array, expr)
+        return out[0] if len(out) == 1 else value
+
+    def write(self, array, expr):
+        if not isinstance(array, TracedArray):
+            if isinstance(array, numpy.ndarray):
+                self.trace.fail("a value of a weight is written into an "
+                                "array which is not traced")
+            return
+        if array.expr is None:
+            return
+        if array.shared or array.viewed:
+            self.trace.fail("a weight which shares its data with another "
+                            "array is changed in place")
+        elif expr is None:
+            array.expr = None
+        elif expr[0] == 'ufunc':
+            array.expr = expr + [str(array.dtype)]
+        else:
+            array.expr = expr
+
+    def __array_function__(self, func, types, args, kwargs):
+        value = func(*_plain(args), **_plain(kwargs))
+        if self.trace is None:
+            return value
+        try:
+            if not func.__module__.startswith('numpy'):
+                raise Untraceable("{} is not a function of numpy".format(
+                    func.__name__))
+            module = func.__module__
+            if getattr(numpy, func.__name__, None) is func:
+                module = 'numpy'
+            expr = ['func', module, func.__name__] + \
+                _encode_call(args, kwargs)
+        except Untraceable:
+            expr = None
+        if func.__name__ in _inplace_funcs:
+            self.trace.fail("numpy.{} changes a weight in place".format(
+                func.__name__))
+            return value
+        return self.trace.wrap(value, expr, (args, list(kwargs.values())))
+
+    def __getitem__(self, index):
+        value = self.view(numpy.ndarray)[_plain(index)]
+        if self.trace is None:
+            return value
+        try:
+            expr = ['getitem', encode(self), encode(index)]
+        except Untraceable:
+            expr = None
+        return self.trace.wrap(value, expr, (self, ))
+
+    def __setitem__(self, index, value):
+        self.view(numpy.ndarray)[_plain(index)] = _plain(value)
+        if self.trace is None:
+            return
+        try:
+            expr = ['setitem', encode(self), encode(index), encode(value)]
+        except Untraceable:
+            expr = None
+        self.write(self, expr)
+
+    def __iter__(self):
+        if self.ndim == 0:
+            raise TypeError("iteration over a 0-d array")
+        for i in range(len(self)):
+            yield self[i]
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def __reduce__(self):
+        return self.view(numpy.ndarray).__reduce__()
+
+    @property
+    def T(self):
+        return self.transpose()
+
+
+for _name in [
+        'astype', 'copy', 'reshape', 'transpose', 'squeeze', 'flatten',
+        'ravel', 'swapaxes', 'repeat', 'take'
+]:
+    setattr(TracedArray, _name, _traced_method(_name))
+for _name in [
+        '__bool__', '__int__', '__float__', '__complex__', '__index__',
+        '__str__', '__repr__', '__format__', 'tolist', 'item', 'tobytes',
+        'tostring'
+]:
+    if hasattr(numpy.ndarray, _name):
+        setattr(TracedArray, _name, _guarded_method(_name))
+for _name in ['fill', 'sort', 'put', 'itemset', 'resize', 'partition']:
+    if hasattr(numpy.ndarray, _name):
+        setattr(TracedArray, _name, _inplace_method(_name))
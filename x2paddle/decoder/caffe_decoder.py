@@ -15,12 +15,118 @@
 import os
 import sys
 from google.protobuf import text_format
+from six.moves import intern
 import numpy as np
 from x2paddle.core.graph import GraphNode, Graph
 from x2paddle.core.fluid_code import FluidCode
 from x2paddle.op_mapper import caffe_shape
 
 
+CAFFE_DESC_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'caffe.desc')
+
+
+def check_protobuf_backend():
+    """ warn when protobuf runs with its pure python backend, in which
+        parsing a caffemodel is several times slower than with cpp/upb
+    """
+    try:
+        from google.protobuf.internal import api_implementation
+        backend = api_implementation.Type()
+    except:
+        return
+    if backend == 'python':
+        print(
+            "[WARNING] protobuf is running with the pure python backend, parsing caffemodel will be slow. "
+            "Install a protobuf wheel with the cpp/upb backend to speed it up."
+        )
+
+
+class CaffeProto(object):
+    """ message classes of caffe.proto built from the serialized
+        FileDescriptorSet, each class is created on its first access
+    """
+
+    def __init__(self, desc_path=CAFFE_DESC_PATH):
+        from google.protobuf import descriptor_pb2
+        from google.protobuf import descriptor_pool
+        with open(desc_path, 'rb') as f:
+            desc_set = descriptor_pb2.FileDescriptorSet.FromString(f.read())
+        # use a private pool, so that a caffe_pb2 module compiled by user
+        # can still be imported in the same process
+        self._pool = descriptor_pool.DescriptorPool()
+        for file_proto in desc_set.file:
+            self._pool.AddSerializedFile(file_proto.SerializeToString())
+        self._file = self._pool.FindFileByName('caffe.proto')
+
+    def _get_message_class(self, desc):
+        try:
+            from google.protobuf.message_factory import GetMessageClass
+            return GetMessageClass(desc)
+        except ImportError:
+            from google.protobuf import message_factory
+            factory = message_factory.MessageFactory(self._pool)
+            return factory.GetPrototype(desc)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        message_types = self._file.message_types_by_name
+        if name not in message_types:
+            raise AttributeError(
+                "Message {} is not defined in caffe.proto".format(name))
+        cls = self._get_message_class(message_types[name])
+        setattr(self, name, cls)
+        return cls
+
+
+_caffe_proto = None
+
+
+def load_caffe_proto():
+    global _caffe_proto
+    if _caffe_proto is None:
+        check_protobuf_backend()
+        _caffe_proto = CaffeProto()
+    return _caffe_proto
+
+
+def get_v1_layer_types(caffepb):
+    """ map the numbers of V1LayerParameter.LayerType to layer type names,
+        e.g. RELU -> ReLU, INNER_PRODUCT -> InnerProduct
+    """
+    enum_desc = caffepb.V1LayerParameter.DESCRIPTOR.enum_types_by_name[
+        'LayerType']
+    layer_types = dict()
+    for val in enum_desc.values:
+        part = [s.capitalize() for s in val.name.split('_')]
+        type_str = ''.join(part)
+        if 'relu' in type_str.lower():
+            type_str = type_str.replace('elu', 'eLU')
+        elif type_str.lower() == 'lrn':
+            type_str = 'LRN'
+        layer_types[val.number] = type_str
+    return layer_types
+
+
+class CaffeNameTable(object):
+    """ normalized names of layers, bottoms and tops, each raw name is
+        normalized only once and shared by the graph and the params
+    """
+
+    def __init__(self):
+        self.names = dict()
+
+    def get(self, name):
+        normalized = self.names.get(name)
+        if normalized is None:
+            normalized = name.replace('/', '_').replace('-', '_')
+            if isinstance(normalized, str):
+                normalized = intern(normalized)
+            self.names[name] = normalized
+        return normalized
+
+
 class CaffeResolver(object):
     def __init__(self, caffe_proto):
         self.caffe_proto = caffe_proto
@@ -28,8 +134,7 @@ class CaffeResolver(object):
 
     def import_caffepb(self):
         if self.caffe_proto is None:
-            from x2paddle.decoder import caffe_pb2
-            out = caffe_pb2
+            out = load_caffe_proto()
         else:
             if not os.path.isfile(self.caffe_proto):
                 raise Exception(
@@ -44,16 +149,15 @@ class CaffeResolver(object):
     def import_caffe(self):
         self.caffepb = self.import_caffepb()
         self.NetParameter = self.caffepb.NetParameter
+        self.layer_types = get_v1_layer_types(self.caffepb)
 
 
 class CaffeGraphNode(GraphNode):
     def __init__(self, layer, type_str, layer_name=None):
+        # layer_name should have been normalized by CaffeNameTable
         if layer_name is None:
-            super(CaffeGraphNode, self).__init__(
-                layer, layer.name.replace('/', '_').replace('-', '_'))
-        else:
-            super(CaffeGraphNode, self).__init__(
-                layer, layer_name.replace('/', '_').replace('-', '_'))
+            layer_name = layer.name.replace('/', '_').replace('-', '_')
+        super(CaffeGraphNode, self).__init__(layer, layer_name)
         self.layer_type = type_str
         self.fluid_code = FluidCode()
         self.data = None
@@ -63,9 +167,20 @@ class CaffeGraphNode(GraphNode):
 
 
 class CaffeGraph(Graph):
-    def __init__(self, model, params, caffe_pb):
+    def __init__(self,
+                 model,
+                 params,
+                 caffe_pb,
+                 layer_types=None,
+                 name_table=None):
         self.params = params
         self.caffe_pb = caffe_pb
+        if layer_types is None:
+            layer_types = get_v1_layer_types(caffe_pb)
+        self.layer_types = layer_types
+        if name_table is None:
+            name_table = CaffeNameTable()
+        self.name_table = name_table
         super(CaffeGraph, self).__init__(model)
 
     def filter_layers(self, layers):
@@ -145,17 +260,7 @@ class CaffeGraph(Graph):
 
     def get_layer_type(self, layer):
         if isinstance(layer.type, int):
-            enum_values = self.caffe_pb._V1LAYERPARAMETER_LAYERTYPE.values
-            vals = [val for val in enum_values if val.number == layer.type]
-            part = vals[0].name.split('_')
-            part = [s.capitalize() for s in part]
-            type_str = ''
-            type_str = type_str.join(part)
-            if 'relu' in type_str.lower():
-                type_str = type_str.replace('elu', 'eLU')
-            elif type_str.lower() == 'lrn':
-                type_str = 'LRN'
-            return type_str
+            return self.layer_types[layer.type]
         else:
             return layer.type
 
@@ -169,21 +274,22 @@ class CaffeGraph(Graph):
         self.input2layers(input_layers)
         self.transform_input_layers(layers, input_layers)
         layers = input_layers + layers
+        normalize = self.name_table.get
         for layer in layers:
             if hasattr(layer, 'name'):
-                name = getattr(layer, 'name')
-                setattr(layer, 'name', name.replace('/', '_').replace('-', '_'))
+                setattr(layer, 'name', normalize(getattr(layer, 'name')))
             for i, name in enumerate(layer.bottom):
-                layer.bottom[i] = name.replace('/', '_').replace('-', '_')
+                layer.bottom[i] = normalize(name)
             for i, name in enumerate(layer.top):
-                layer.top[i] = name.replace('/', '_').replace('-', '_')
+                layer.top[i] = normalize(name)
 
         top_layer = {}
         for layer in layers:
             if hasattr(layer, 'input'):
                 continue
             type_str = self.get_layer_type(layer)
-            self.node_map[layer.name] = CaffeGraphNode(layer, type_str)
+            self.node_map[layer.name] = CaffeGraphNode(
+                layer, type_str, layer_name=layer.name)
             for in_name in layer.bottom:
                 if in_name in top_layer:
                     self.connect(top_layer[in_name][-1], layer.name)
@@ -225,6 +331,7 @@ class CaffeDecoder(object):
         self.model_path = model_path
 
         self.resolver = CaffeResolver(caffe_proto=caffe_proto)
+        self.name_table = CaffeNameTable()
         self.net = self.resolver.NetParameter()
         with open(proto_path, 'rb') as proto_file:
             proto_str = proto_file.read()
@@ -232,8 +339,12 @@ class CaffeDecoder(object):
 
         self.load_using_pb()
 
-        self.caffe_graph = CaffeGraph(self.net, self.params,
-                                      self.resolver.caffepb)
+        self.caffe_graph = CaffeGraph(
+            self.net,
+            self.params,
+            self.resolver.caffepb,
+            layer_types=self.resolver.layer_types,
+            name_table=self.name_table)
         self.caffe_graph.build()
 
     def load_using_pb(self):
@@ -241,8 +352,7 @@ class CaffeDecoder(object):
         data.MergeFromString(open(self.model_path, 'rb').read())
         layers = data.layers or data.layer
         for layer in layers:
-            setattr(layer, 'name',
-                    layer.name.replace('/', '_').replace('-', '_'))
+            setattr(layer, 'name', self.name_table.get(layer.name))
         pair = lambda layer: (layer.name, self.normalize_pb_data(layer))
         self.params = [pair(layer) for layer in layers if layer.blobs]
 
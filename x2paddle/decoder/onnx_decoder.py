@@ -15,6 +15,9 @@
 from x2paddle.core.graph import GraphNode, Graph
 from x2paddle.core.fluid_code import FluidCode
 from x2paddle.decoder.onnx_shape_inference import SymbolicShapeInference
+from x2paddle.core.logger import logger
+from x2paddle.core.profiler import profiler
+from x2paddle.core.input_spec import lookup, check_unused, check_interactive
 from onnx.checker import ValidationError
 from onnx.checker import check_model
 from onnx.utils import polish_model
@@ -130,17 +133,25 @@ class ONNXGraphDataNode(GraphNode):
 
 
 class ONNXGraph(Graph):
-    def __init__(self, onnx_model):
+    def __init__(self, onnx_model, input_spec=None, static_shape=False):
         super(ONNXGraph, self).__init__(onnx_model)
         self.fixed_input_shape = {}
+        self.input_spec = input_spec
+        self.static_shape = static_shape
         self.initializer = {}
         self.place_holder_nodes = list()
         self.value_infos = {}
         self.graph = onnx_model.graph
         self.get_place_holder_nodes()
+        if static_shape:
+            self.check_static_shape()
         print("shape inferencing ...")
-        self.graph = SymbolicShapeInference.infer_shapes(
-            onnx_model, fixed_input_shape=self.fixed_input_shape)
+        with profiler.stage('shape_inference'):
+            # with static input shapes, the shape computation is folded
+            self.graph = SymbolicShapeInference.infer_shapes(
+                onnx_model,
+                fixed_input_shape=self.fixed_input_shape,
+                fold_shape_data=static_shape)
         print("shape inferenced.")
         self.build()
         self.collect_value_infos()
@@ -169,12 +180,23 @@ class ONNXGraph(Graph):
         return shape
 
     def check_input_shape(self, vi):
+        info = lookup(self.input_spec, vi.name)
+        if info is not None and info['shape'] is not None:
+            if vi.type.HasField('tensor_type'):
+                dtype = TENSOR_TYPE_TO_NP_TYPE[
+                    vi.type.tensor_type.elem_type].name
+                if info['dtype'] is not None and info['dtype'] != dtype:
+                    logger.warning("Dtype of input {} is {}, but {} is given".
+                                   format(vi.name, dtype, info['dtype']))
+            self.fixed_input_shape[vi.name] = info['shape']
+            return
         if vi.type.HasField('tensor_type'):
             for dim in vi.type.tensor_type.shape.dim:
                 if dim.HasField(
                         'dim_param') and vi.name not in self.fixed_input_shape:
                     shape = self.get_symbolic_shape(
                         vi.type.tensor_type.shape.dim)
+                    check_interactive(vi.name)
                     print(
                         "Unknown shape for input tensor[tensor name: '{}'] -> shape: {}, Please define shape of input here,\nNote:you can use visualization tools like Netron to check input shape."
                         .format(vi.name, shape))
@@ -199,6 +221,25 @@ class ONNXGraph(Graph):
                     self.fixed_input_shape[vi.name] = shape
                     break
 
+    def check_static_shape(self):
+        for vi in self.graph.input:
+            if vi.name not in self.place_holder_nodes:
+                continue
+            if vi.name in self.fixed_input_shape:
+                shape = self.fixed_input_shape[vi.name]
+            else:
+                shape = [
+                    dim.dim_value if dim.HasField('dim_value') else -1
+                    for dim in vi.type.tensor_type.shape.dim
+                ]
+            if len(shape) == 0 and not vi.type.tensor_type.HasField('shape') \
+                    or any([dim <= 0 for dim in shape]):
+                raise Exception(
+                    "Shape of input {} is {}, all the input shapes should be "
+                    "static with --static_shape, please define it with "
+                    "--input_shape".format(vi.name, shape))
+            self.fixed_input_shape[vi.name] = shape
+
     def get_place_holder_nodes(self):
         """
         generate place_holder node of ONNX model
@@ -208,6 +249,7 @@ class ONNXGraph(Graph):
             if ipt_vi.name not in inner_nodes:
                 self.check_input_shape(ipt_vi)
                 self.place_holder_nodes.append(ipt_vi.name)
+        check_unused(self.input_spec, self.place_holder_nodes)
 
     def get_output_nodes(self):
         """
@@ -353,7 +395,7 @@ class ONNXGraph(Graph):
 
 
 class ONNXDecoder(object):
-    def __init__(self, onnx_model):
+    def __init__(self, onnx_model, input_spec=None, static_shape=False):
         onnx_model = onnx.load(onnx_model)
         print('model ir_version: {}, op version: {}'.format(
             onnx_model.ir_version, onnx_model.opset_import[0].version))
@@ -364,7 +406,11 @@ class ONNXDecoder(object):
         onnx_model = self.optimize_model_skip_op(onnx_model)
         onnx_model = self.optimize_model_strip_initializer(onnx_model)
         onnx_model = self.optimize_node_name(onnx_model)
-        self.graph = ONNXGraph(onnx_model)
+        if input_spec is not None:
+            # the inputs are renamed by optimize_node_name
+            input_spec = Dict([(self.make_variable_name(name), info)
+                               for name, info in input_spec.items()])
+        self.graph = ONNXGraph(onnx_model, input_spec, static_shape)
         #self.onnx_model = onnx_model
 
     def build_value_refs(self, nodes):
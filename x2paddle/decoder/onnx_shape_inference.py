@@ -1572,13 +1572,95 @@ class SymbolicShapeInference:
                 tmp_output = self.known_vi_[output.name]
                 output.CopyFrom(tmp_output)
 
+    def _get_folded_value(self, name):
+        """
+        value of the tensor computed on sympy data, None if any element is
+        not a known integer
+        """
+        data = self.sympy_data_[name]
+        values = np.array(data, dtype=object)
+        for v in values.flatten():
+            if not (isinstance(v, (int, np.integer)) or
+                    (isinstance(v, sympy.Basic) and v.is_Integer)):
+                return None
+        values = np.array(
+            [int(v) for v in values.flatten()]).reshape(values.shape)
+        dtype = np.int64
+        if name in self.known_vi_:
+            tensor_type = self.known_vi_[name].type.tensor_type
+            if tensor_type.elem_type == onnx.TensorProto.INT32:
+                dtype = np.int32
+            shape = get_shape_from_type_proto(self.known_vi_[name].type)
+            if len(shape) > 0 and all([type(d) == int for d in shape]):
+                if int(np.prod(shape)) != values.size:
+                    return None
+                values = values.reshape(shape)
+            elif len(shape) == 0 and tensor_type.HasField('shape') and \
+                    values.size != 1:
+                return None
+        return values.astype(dtype)
+
+    def _fold_sympy_data(self):
+        """
+        Replace the nodes whose outputs are computed while inferring the
+        shapes (e.g. Shape -> Gather -> Concat of static shapes) with
+        initializers, and remove the nodes and initializers left unused.
+        """
+        graph = self.out_mp_.graph
+        output_names = set([output.name for output in graph.output])
+        nodes = list()
+        folded = list()
+        for node in graph.node:
+            if len(node.output) == 1 and node.output[0] in self.sympy_data_ \
+                    and node.output[0] not in output_names:
+                value = self._get_folded_value(node.output[0])
+                if value is not None:
+                    folded.append(numpy_helper.from_array(value,
+                                                          node.output[0]))
+                    continue
+            nodes.append(node)
+        if len(folded) == 0:
+            return
+        graph.initializer.extend(folded)
+
+        # the inputs of the nodes in subgraphs are not tracked
+        has_subgraph = any([
+            attr.type in [onnx.AttributeProto.GRAPH, onnx.AttributeProto.GRAPHS]
+            for node in nodes for attr in node.attribute
+        ])
+        if not has_subgraph:
+            used = set(output_names)
+            live_nodes = list()
+            for node in reversed(nodes):
+                if any([name in used for name in node.output]):
+                    live_nodes.append(node)
+                    used.update(node.input)
+            nodes = list(reversed(live_nodes))
+            initializers = [
+                initializer for initializer in graph.initializer
+                if initializer.name in used
+            ]
+            removed = set([
+                initializer.name for initializer in graph.initializer
+                if initializer.name not in used
+            ])
+            inputs = [ipt for ipt in graph.input if ipt.name not in removed]
+            graph.ClearField('initializer')
+            graph.initializer.extend(initializers)
+            graph.ClearField('input')
+            graph.input.extend(inputs)
+        graph.ClearField('node')
+        graph.node.extend(nodes)
+        self.initializers_ = dict([(i.name, i) for i in graph.initializer])
+
     @staticmethod
     def infer_shapes(in_mp,
                      int_max=2**31 - 1,
                      fixed_input_shape=None,
                      auto_merge=True,
                      guess_output_rank=False,
-                     verbose=0):
+                     verbose=0,
+                     fold_shape_data=False):
         if get_opset(in_mp) < 7:
             print('Only support shape inferencing models of opset 7 and above.')
             return
@@ -1592,6 +1674,8 @@ class SymbolicShapeInference:
                 all_shapes_inferred = symbolic_shape_inference._infer_impl(
                     in_mp)
             symbolic_shape_inference._update_output_from_vi()
+            if fold_shape_data:
+                symbolic_shape_inference._fold_sympy_data()
             if not all_shapes_inferred:
                 print('!' * 10)
                 symbolic_shape_inference.out_mp_ = shape_inference.infer_shapes(
@@ -12,7 +12,93 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from paddle.fluid.proto import framework_pb2
+import paddle.fluid.core as core
 import paddle.fluid as fluid
+import numpy
+import mmap
+import os
+
+
+class PaddleParamsReader(object):
+    """ read the LoDTensors saved by fluid.io.save_inference_model from the
+        combined params file (or a file per variable) without an executor,
+        the files are memory-mapped and a tensor is only read when needed
+    """
+    dtype_map = {
+        framework_pb2.VarType.BOOL: 'bool',
+        framework_pb2.VarType.INT8: 'int8',
+        framework_pb2.VarType.UINT8: 'uint8',
+        framework_pb2.VarType.INT16: 'int16',
+        framework_pb2.VarType.INT32: 'int32',
+        framework_pb2.VarType.INT64: 'int64',
+        framework_pb2.VarType.FP16: 'float16',
+        framework_pb2.VarType.FP32: 'float32',
+        framework_pb2.VarType.FP64: 'float64'
+    }
+
+    def __init__(self, model_dir, var_names, params_filename=None):
+        self.files = list()
+        self.tensors = dict()
+        self.ranges = dict()
+        if params_filename is None:
+            for name in var_names:
+                buf = self.open(os.path.join(model_dir, name))
+                self.tensors[name], end = self.parse_tensor(buf, 0)
+                self.ranges[name] = (buf, 0, end)
+        else:
+            buf = self.open(os.path.join(model_dir, params_filename))
+            offset = 0
+            # save_combine writes the variables sorted by name
+            for name in sorted(var_names):
+                start = offset
+                self.tensors[name], offset = self.parse_tensor(buf, offset)
+                self.ranges[name] = (buf, start, offset)
+            assert offset == len(buf), \
+                "The params file {} does not match the model.".format(
+                    params_filename)
+
+    def open(self, path):
+        with open(path, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.files.append(buf)
+        return buf
+
+    def parse_tensor(self, buf, offset):
+        # LoDTensor: version, lod levels, tensor version, TensorDesc, data
+        offset += 4
+        lod_level = numpy.frombuffer(buf, 'uint64', 1, offset)[0]
+        offset += 8
+        for i in range(lod_level):
+            offset += 8 + int(numpy.frombuffer(buf, 'uint64', 1, offset)[0])
+        offset += 4
+        desc_size = int(numpy.frombuffer(buf, 'int32', 1, offset)[0])
+        offset += 4
+        tensor_desc = framework_pb2.VarType.TensorDesc()
+        tensor_desc.ParseFromString(buf[offset:offset + desc_size])
+        offset += desc_size
+        dtype = numpy.dtype(self.dtype_map[tensor_desc.data_type])
+        dims = list(tensor_desc.dims)
+        size = int(numpy.prod(dims)) * dtype.itemsize
+        return [buf, offset, dtype, dims], offset + size
+
+    def __contains__(self, name):
+        return name in self.tensors
+
+    def __getitem__(self, name):
+        buf, offset, dtype, dims = self.tensors[name]
+        return numpy.frombuffer(buf, dtype, int(numpy.prod(dims)),
+                                offset).reshape(dims)
+
+    def get_bytes(self, name):
+        """ the serialized LoDTensor of the variable """
+        buf, start, end = self.ranges[name]
+        return buf[start:end]
+
+    def close(self):
+        for buf in self.files:
+            buf.close()
+        self.files = list()
 
 
 class PaddleDecoder(object):
@@ -20,9 +106,16 @@ class PaddleDecoder(object):
                  model_dir,
                  model_filename='__model__',
                  params_filename=None):
-        exe = fluid.Executor(fluid.CPUPlace())
-        [self.program, feed, fetchs] = fluid.io.load_inference_model(
-            model_dir,
-            exe,
-            model_filename=model_filename,
-            params_filename=params_filename)
+        with open(os.path.join(model_dir, model_filename), 'rb') as f:
+            self.program = fluid.Program.parse_from_string(f.read())
+        var_names = list()
+        for name, var in self.program.global_block().vars.items():
+            if var.desc.type() in [
+                    core.VarDesc.VarType.FEED_MINIBATCH,
+                    core.VarDesc.VarType.FETCH_LIST, core.VarDesc.VarType.RAW
+            ]:
+                continue
+            if var.persistable:
+                var_names.append(name)
+        self.params = PaddleParamsReader(model_dir, var_names,
+                                         params_filename)
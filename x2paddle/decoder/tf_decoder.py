@@ -14,6 +14,8 @@
 
 from x2paddle.core.graph import GraphNode, Graph
 from x2paddle.core.fluid_code import FluidCode
+from x2paddle.core.input_spec import lookup, check_unused, check_interactive
+from x2paddle.core.logger import logger
 from tensorflow.python.framework import tensor_util
 from tensorflow.core.framework import attr_value_pb2
 import tensorflow as tf
@@ -37,6 +39,8 @@ class TFGraphNode(GraphNode):
         self.tf_data_format = data_format
         self.pd_data_format = "NCHW"
         self.fluid_code = FluidCode()
+        # the Tracer of the weights for x2paddle --weights_only
+        self.trace = None
 
         self.dtype_map = {
             1: "float32",
@@ -86,7 +90,10 @@ class TFGraphNode(GraphNode):
 
         attr = self.layer.attr['value']
         field = getattr(attr, attr.WhichOneof('value'))
-        return tensor_util.MakeNdarray(field)
+        value = tensor_util.MakeNdarray(field)
+        if self.trace is not None:
+            return self.trace.source([self.layer_name], value)
+        return value
 
     def get_attr(self, name):
         if name not in self.layer.attr:
@@ -111,6 +118,12 @@ class TFGraphNode(GraphNode):
 
 
 class TFGraph(Graph):
+    # ops removed from the graph before the op mapping
+    identity_ops = [
+        'Identity', 'StopGradient', 'Switch', 'Merge', 'PlaceholderWithDefault',
+        'IteratorGetNext'
+    ]
+
     def __init__(self, model, data_format="NHWC"):
         super(TFGraph, self).__init__(model)
         self.identity_map = dict()
@@ -229,13 +242,9 @@ class TFGraph(Graph):
             del self.topo_sort[idx]
 
     def _remove_identity_node(self):
-        identity_ops = [
-            'Identity', 'StopGradient', 'Switch', 'Merge',
-            'PlaceholderWithDefault', 'IteratorGetNext'
-        ]
         identity_node = list()
         for node_name, node in self.node_map.items():
-            if node.layer_type in identity_ops:
+            if node.layer_type in self.identity_ops:
                 identity_node.append(node_name)
 
         for node_name in identity_node:
@@ -283,13 +292,21 @@ class TFGraph(Graph):
 
 
 class TFDecoder(object):
-    def __init__(self, pb_model, data_format="NHWC", define_input_shape=False):
+    def __init__(self,
+                 pb_model,
+                 data_format="NHWC",
+                 define_input_shape=False,
+                 input_spec=None,
+                 static_shape=False):
         try:
             self.sess = tf.compat.v1.Session()
         except:
             self.sess = tf.Session()
         self.input_info = dict()
         self.define_input_shape = define_input_shape
+        self.input_spec = input_spec
+        self.trace = None
+        self.static_shape = static_shape
         with open(pb_model, 'rb') as f:
             try:
                 graph_def = tf.compat.v1.GraphDef()
@@ -307,10 +324,112 @@ class TFDecoder(object):
             initializer = tf.global_variables_initializer()
         self.sess.run(initializer)
 
+        if static_shape:
+            graph_def = self._fold_shape_nodes()
+            self.sess.close()
+            graph = tf.Graph()
+            with graph.as_default():
+                tf.import_graph_def(graph_def, name='')
+                try:
+                    self.sess = tf.compat.v1.Session(graph=graph)
+                    initializer = tf.compat.v1.global_variables_initializer()
+                except:
+                    self.sess = tf.Session(graph=graph)
+                    initializer = tf.global_variables_initializer()
+            self.sess.run(initializer)
+
         self.tf_graph = TFGraph(
             self.sess.graph._as_graph_def(add_shapes=True)[0], data_format)
         self.tf_graph.build()
 
+    def _fold_shape_nodes(self):
+        """
+        With static input shapes, evaluate the ops computed only from the
+        shapes and the constants (e.g. Shape -> StridedSlice -> Pack), and
+        replace them with Const, so that their values are written into the
+        code instead of being computed by the program.
+        """
+        control_flow_ops = [
+            'Enter', 'Exit', 'Merge', 'Switch', 'NextIteration', 'LoopCond'
+        ]
+        foldable = set()
+        for op in self.sess.graph.get_operations():
+            if len(op.outputs) != 1 or op.outputs[0].dtype.base_dtype in [
+                    tf.resource, tf.variant
+            ]:
+                continue
+            if op.type == 'Const':
+                foldable.add(op.name)
+            elif op.type in ['Shape', 'Size', 'Rank']:
+                if op.inputs[0].shape.is_fully_defined():
+                    foldable.add(op.name)
+            elif len(op.inputs) > 0 and len(op.control_inputs) == 0 and \
+                    op.type not in control_flow_ops and \
+                    op.op_def is not None and not op.op_def.is_stateful and \
+                    all([ipt.op.name in foldable for ipt in op.inputs]):
+                # the operations are listed in topological order
+                foldable.add(op.name)
+
+        folded = list()
+        used = set()
+        const_names = set()
+        for op in self.sess.graph.get_operations():
+            if op.type == 'Const':
+                const_names.add(op.name)
+            if op.name in foldable:
+                consumers = op.outputs[0].consumers()
+                if op.type != 'Const' and (len(consumers) == 0 or any(
+                    [c.name not in foldable for c in consumers])):
+                    folded.append(op)
+                continue
+            for ipt in op.inputs:
+                used.add(ipt.op.name)
+        if len(folded) == 0:
+            return self.sess.graph.as_graph_def()
+
+        # the folded values don't depend on the values of the inputs
+        feed = dict()
+        for op in self.sess.graph.get_operations():
+            if op.type == 'Placeholder' and len(op.outputs[0].consumers()) > 0:
+                tensor = op.outputs[0]
+                feed[tensor] = numpy.zeros(
+                    tensor.shape.as_list(), dtype=tensor.dtype.as_numpy_dtype)
+        values = self.sess.run([op.outputs[0] for op in folded], feed)
+        values = {op.name: value for op, value in zip(folded, values)}
+
+        graph_def = self.sess.graph.as_graph_def()
+        try:
+            folded_graph_def = tf.compat.v1.GraphDef()
+        except:
+            folded_graph_def = tf.GraphDef()
+        folded_graph_def.versions.CopyFrom(graph_def.versions)
+        folded_graph_def.library.CopyFrom(graph_def.library)
+        for node in graph_def.node:
+            if node.name in values:
+                const = folded_graph_def.node.add()
+                const.name = node.name
+                const.op = 'Const'
+                const.device = node.device
+                tensor = tensor_util.make_tensor_proto(values[node.name])
+                const.attr['dtype'].type = tensor.dtype
+                const.attr['value'].tensor.CopyFrom(tensor)
+            elif node.name not in foldable or (node.op == 'Const' and
+                                                node.name in used):
+                new_node = folded_graph_def.node.add()
+                new_node.CopyFrom(node)
+                del new_node.input[:]
+                for ipt in node.input:
+                    # drop the control dependencies on the removed ops
+                    if ipt.startswith('^') and ipt[1:] in foldable and \
+                            ipt[1:] not in values and ipt[1:] not in used:
+                        continue
+                    new_node.input.append(ipt)
+        logger.info("{} ops computed from the static shapes are folded into "
+                    "{} constants".format(
+                        len([op for op in foldable if op not in const_names]),
+                        len(folded)))
+        return folded_graph_def
+
     def _fix_output_shape(self, graph):
         for i in range(len(graph.node)):
             node = graph.node[i]
@@ -321,9 +440,11 @@ class TFDecoder(object):
         numpy.random.seed(13)
         graph_def = cp.deepcopy(graph_def)
         input_map = dict()
+        input_names = list()
         for layer in graph_def.node:
             if layer.op != "Placeholder" and layer.op != "OneShotIterator":
                 continue
+            input_names.append(layer.name)
             graph_node = TFGraphNode(layer)
             dtype = graph_node.layer.attr['dtype'].type
 
@@ -348,7 +469,17 @@ class TFDecoder(object):
                 except:
                     pass
 
-            if need_define_shape > 0:
+            info = lookup(self.input_spec, layer.name)
+            if info is not None and info['shape'] is not None:
+                need_define_shape = 4
+                shape = [None if dim < 0 else dim for dim in info['shape']]
+                dtype_name = tf.as_dtype(dtype).name
+                if info['dtype'] is not None and info['dtype'] != dtype_name:
+                    logger.warning(
+                        "Dtype of input {} is {}, but {} is given".format(
+                            layer.name, dtype_name, info['dtype']))
+            elif need_define_shape > 0:
+                check_interactive(layer.name)
                 shape = None
                 if graph_node.get_attr("shape"):
                     value = value = graph_node.layer.attr["shape"].shape
@@ -383,6 +514,8 @@ class TFDecoder(object):
                     None if dim == "None" else int(dim)
                     for dim in shape.strip().split(',')
                 ]
+
+            if need_define_shape > 0:
                 assert shape.count(None) <= 1, "Only one dimension can be None"
                 try:
                     x2paddle_input = tf.compat.v1.placeholder(
@@ -405,8 +538,22 @@ class TFDecoder(object):
                 shape = [dim.size for dim in value.dim]
                 self.input_info[graph_node.layer_name] = (shape, dtype)
 
+        check_unused(self.input_spec, input_names)
+        if self.static_shape:
+            for name, (shape, dtype) in self.input_info.items():
+                if shape.count(-1) > 0:
+                    raise Exception(
+                        "Shape of input {} is {}, all the input shapes should "
+                        "be static with --static_shape, please define it with "
+                        "--input_shape".format(name, shape))
         return input_map
 
+    def _is_static_input(self):
+        for shape, dtype in self.input_info.values():
+            if shape.count(-1) > 0:
+                return False
+        return True
+
     # trick method
     # should be removed after PaddlePaddle V1.6 been released
     def infer_tensor(self, graph_node):
@@ -422,13 +569,20 @@ class TFDecoder(object):
                 shape[shape.index(-1)] = 2
             feed[input_tensor] = numpy.random.random_sample(shape)
         output_tensor = self.sess.graph.get_tensor_by_name(tensor_name)
-        return self.sess.run([output_tensor], feed)[0]
+        value = self.sess.run([output_tensor], feed)[0]
+        if self.trace is not None:
+            # may be computed from the weights, which is not traced
+            return self.trace.opaque(value)
+        return value
 
     def infer_shape_tensor(self, graph_node, out_shape=None):
         if hasattr(graph_node, "index"):
             tensor_name = graph_node.layer.name + ":{}".format(graph_node.index)
         else:
             tensor_name = graph_node.layer.name + ":0"
+        if self._is_static_input():
+            # no unknown dimension to probe with different batch sizes
+            return self.infer_tensor(graph_node).flatten().tolist()
         feed = dict()
         batch_size = [2, 3, 5]
         results = list()
@@ -472,6 +626,8 @@ class TFDecoder(object):
             tensor_name = graph_node.layer.name + ":{}".format(graph_node.index)
         else:
             tensor_name = graph_node.layer.name + ":0"
+        if self._is_static_input():
+            return list(self.infer_tensor(graph_node).shape)
         feed = dict()
         batch_size = [2, 3, 5]
         shapes = list()
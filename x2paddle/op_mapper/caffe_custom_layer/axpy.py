@@ -2,7 +2,7 @@ from .register import register
 from x2paddle.core.util import *
 
 
-def axpy_shape(input_shape):
+def axpy_shape(input_shapes):
     assert len(input_shapes) == 3, "not valid input shape for axpy layer"
     assert len(input_shapes[0]) == len(input_shapes[1]), 'should have same dims'
     output_shape = input_shapes[1]
@@ -18,7 +18,7 @@ def axpy_layer(inputs, input_shape=None, name=None):
     y = inputs[2]
     out = fluid.layers.elementwise_mul(x, alpha, axis=0)
     out = fluid.layers.elementwise_add(out, y, name=name)
-    print(out)
+    return out
 
 
 def axpy_weights(name, data=None):
@@ -49,6 +49,72 @@ def priorbox_layer(inputs,
     return out
 
 
+def priorbox_value(input_shape, params):
+    """ compute the output of PriorBox with numpy, as caffe does in
+        PriorBoxLayer::Forward_cpu, the result is [1, 2, 4 * num_boxes]
+    """
+    layer_h, layer_w = input_shape[0][2], input_shape[0][3]
+    if params.img_h > 0 and params.img_w > 0:
+        img_h, img_w = params.img_h, params.img_w
+    elif params.img_size > 0:
+        img_h = img_w = params.img_size
+    else:
+        img_h, img_w = input_shape[1][2], input_shape[1][3]
+    if params.step_h > 0 and params.step_w > 0:
+        step_h, step_w = params.step_h, params.step_w
+    elif params.step > 0:
+        step_h = step_w = params.step
+    else:
+        step_h = float(img_h) / layer_h
+        step_w = float(img_w) / layer_w
+    aspect_ratios = [1.0]
+    for ar in params.aspect_ratio:
+        if min([abs(ar - r) for r in aspect_ratios]) < 1e-6:
+            continue
+        aspect_ratios.append(ar)
+        if params.flip:
+            aspect_ratios.append(1.0 / ar)
+
+    # width and height of each prior in the caffe order:
+    # min_size, sqrt(min_size * max_size), other aspect ratios
+    sizes = list()
+    for i, min_size in enumerate(params.min_size):
+        sizes.append([min_size, min_size])
+        if len(params.max_size) > 0:
+            size = math.sqrt(min_size * params.max_size[i])
+            sizes.append([size, size])
+        for ar in aspect_ratios:
+            if abs(ar - 1.0) < 1e-6:
+                continue
+            sizes.append([min_size * math.sqrt(ar), min_size / math.sqrt(ar)])
+    half_sizes = numpy.array(sizes, dtype='float32') / 2.0
+
+    center_x = (numpy.arange(layer_w, dtype='float32') + params.offset) * step_w
+    center_y = (numpy.arange(layer_h, dtype='float32') + params.offset) * step_h
+    center_x, center_y = numpy.meshgrid(center_x, center_y)
+    center_x = center_x[:, :, numpy.newaxis]
+    center_y = center_y[:, :, numpy.newaxis]
+    boxes = numpy.stack(
+        [(center_x - half_sizes[:, 0]) / img_w,
+         (center_y - half_sizes[:, 1]) / img_h,
+         (center_x + half_sizes[:, 0]) / img_w,
+         (center_y + half_sizes[:, 1]) / img_h],
+        axis=-1).reshape([-1])
+    if params.clip:
+        boxes = numpy.clip(boxes, 0.0, 1.0)
+
+    variance = list(params.variance)
+    if len(variance) == 0:
+        variance = [0.1]
+    if len(variance) == 1:
+        variance = variance * 4
+    variances = numpy.tile(
+        numpy.array(
+            variance, dtype='float32'), boxes.shape[0] // 4)
+    return numpy.stack(
+        [boxes, variances]).reshape([1, 2, -1]).astype('float32')
+
+
 def priorbox_weights(name, data=None):
     weights_name = []
     return weights_name
@@ -17,8 +17,13 @@ import numpy as np
 from x2paddle.decoder.caffe_decoder import CaffeGraph
 from x2paddle.core.op_mapper import OpMapper
 from x2paddle.core.util import *
+from x2paddle.core.logger import logger
+from x2paddle.core.profiler import profiler
+from x2paddle.core.param_writer import make_weights
+from x2paddle.core.scheduler import map_nodes
 from x2paddle.op_mapper import caffe_shape
 from x2paddle.op_mapper.caffe_custom_layer import *
+from x2paddle.op_mapper.caffe_custom_layer.priorbox import priorbox_value
 
 
 class CaffeOpMapper(OpMapper):
@@ -29,32 +34,41 @@ class CaffeOpMapper(OpMapper):
         'TanH': 'tanh',
     }
 
-    def __init__(self, decoder):
+    def __init__(self,
+                 decoder,
+                 precompute_priorbox=False,
+                 map_workers=1,
+                 param_writer=None):
         super(CaffeOpMapper, self).__init__()
         self.graph = decoder.caffe_graph
-        self.weights = dict()
+        self.weights = make_weights(param_writer)
+        self.precompute_priorbox = precompute_priorbox
         resolver = decoder.resolver
         self.used_custom_layers = {}
 
-        print("Total nodes: {}".format(len(self.graph.topo_sort)))
+        total = len(self.graph.topo_sort)
+        logger.info("Total nodes: {}".format(total))
         for node_name in self.graph.topo_sort:
             node = self.graph.get_node(node_name)
             if node.layer_type == 'DepthwiseConvolution':
                 node.layer_type = 'ConvolutionDepthwise'
-            op = node.layer_type
-            if hasattr(self, op):
-                self.set_node_shape(node)
-                func = getattr(self, op)
-                func(node)
-            elif op in custom_layers:
-                self.set_node_shape(node, is_fluid_op=False)
-                self.deal_custom_layer(node)
-            elif op in self.directly_map_ops:
-                self.set_node_shape(node)
-                self.directly_map(node)
-            else:
-                raise Exception(
-                    "The op {} in model is not supported yet.".format(op))
+        map_nodes(self.graph, self, CaffeOpMapper.map_node, map_workers)
+
+    def map_node(self, node):
+        op = node.layer_type
+        if hasattr(self, op):
+            self.set_node_shape(node)
+            func = getattr(self, op)
+            func(node)
+        elif op in custom_layers:
+            self.set_node_shape(node, is_fluid_op=False)
+            self.deal_custom_layer(node)
+        elif op in self.directly_map_ops:
+            self.set_node_shape(node)
+            self.directly_map(node)
+        else:
+            raise Exception(
+                "The op {} in model is not supported yet.".format(op))
 
     def op_checker(self):
         unsupported_ops = set()
@@ -66,10 +80,12 @@ class CaffeOpMapper(OpMapper):
         if len(unsupported_ops) == 0:
             return True
         else:
-            print("There are {} ops not supported yet, list as below".format(
-                len(unsupported_ops)))
+            logger.error(
+                "There are {} ops not supported yet, list as below".format(
+                    len(unsupported_ops)),
+                unsupported_ops=list(unsupported_ops))
             for op in unsupported_ops:
-                print(op)
+                logger.error(op)
             return False
 
     def set_node_shape(self, node, is_fluid_op=True):
@@ -84,11 +100,12 @@ class CaffeOpMapper(OpMapper):
         node.input_shape = input_shape
 
         func_name = 'shape_' + node.layer_type.lower()
-        if is_fluid_op:
-            node.output_shape = getattr(caffe_shape, func_name)(node.layer,
-                                                                input_shape)
-        else:
-            node.output_shape = compute_output_shape(node)
+        with profiler.trace('set_node_shape', 'shape', node=node.layer_name):
+            if is_fluid_op:
+                node.output_shape = getattr(caffe_shape, func_name)(
+                    node.layer, input_shape)
+            else:
+                node.output_shape = compute_output_shape(node)
 
     def adjust_parameters(self, node):
         data = node.data
@@ -127,7 +144,9 @@ class CaffeOpMapper(OpMapper):
         return data
 
     def get_kernel_parameters(self, kind, params):
-        assert kind in ['Convolution', 'Pooling', 'Deconvolution']
+        assert kind in [
+            'Convolution', 'Pooling', 'Deconvolution', 'ConvolutionDepthwise'
+        ]
         [k_h, k_w] = [1, 1]
         if isinstance(params.kernel_size, numbers.Number):
             [k_h, k_w] = [params.kernel_size] * 2
@@ -162,7 +181,7 @@ class CaffeOpMapper(OpMapper):
         dila_h = dila_w = 1
         group = 1
         c_o = 1
-        if kind in ['Convolution', 'Deconvolution']:
+        if kind in ['Convolution', 'Deconvolution', 'ConvolutionDepthwise']:
             c_o = params.num_output
             dila_len = len(params.dilation)
             if dila_len == 2:
@@ -173,7 +192,7 @@ class CaffeOpMapper(OpMapper):
             else:
                 assert dila_len == 0, "invalid length[%s] of dilation in convolution" % (
                     dila_len)
-        if kind in ['Convolution', 'Deconvolution']:
+        if kind in ['Convolution', 'Deconvolution', 'ConvolutionDepthwise']:
             group = params.group
         kernel = [k_h, k_w]
         stride = [s_h, s_w]
@@ -431,6 +450,17 @@ class CaffeOpMapper(OpMapper):
             inputs.append(input)
         params = node.layer.concat_param
         axis = params.axis
+        values = [getattr(input, 'const_value', None) for input in inputs]
+        if all([value is not None for value in values]):
+            # all the inputs are constants (e.g. the precomputed PriorBox of
+            # a SSD head), so the concat is evaluated here as well
+            for input in inputs:
+                input_node = self.graph.get_node(input.layer_name)
+                if len(input_node.outputs) == 1:
+                    input_node.fluid_code.clear()
+                    self.weights.pop(input_node.layer_name, None)
+            self.add_constant(node, np.concatenate(values, axis=axis))
+            return
         attr = {'axis': axis, 'name': string(node.layer_name)}
         node.fluid_code.add_layer(
             "concat", inputs=inputs, output=node, param_attr=attr)
@@ -856,6 +886,148 @@ class CaffeOpMapper(OpMapper):
         node.fluid_code.add_layer(
             "scale", inputs=node, output=node, param_attr=attr)
 
+    def ConvolutionDepthwise(self, node):
+        data = node.data
+        params = node.layer.convolution_param
+        channel, kernel, stride, pad, dilation, group = self.get_kernel_parameters(
+            node.layer_type, params)
+        input_c = node.input_shape[0][1]
+        if data is not None:
+            # the filter is [c_out, c_in / group, k_h, k_w]
+            group = input_c // data[0].shape[1]
+        else:
+            group = input_c
+        if group < 1 or input_c % group != 0 or channel % group != 0:
+            self.deal_custom_layer(node)
+            return
+        if data is None:
+            data = []
+            print(
+                'The parameter of {} (type is {}) is not set. So we set the parameters as 0'
+                .format(node.layer_name, node.layer_type))
+            data.append(
+                np.zeros([channel, input_c // group, kernel[0], kernel[1]])
+                .astype('float32'))
+            data.append(np.zeros([channel, ]).astype('float32'))
+        else:
+            data = self.adjust_parameters(node)
+        self.weights[node.layer_name + '_weights'] = data[0]
+        if len(data) == 2:
+            self.weights[node.layer_name + '_bias'] = data[1]
+        assert len(
+            node.inputs
+        ) == 1, 'The count of ConvolutionDepthwise node\'s input is not 1.'
+        input = self.graph.get_bottom_node(node, idx=0, copy=True)
+        attr = {
+            'filter_size': kernel,
+            'num_filters': channel,
+            'stride': stride,
+            'padding': pad,
+            'dilation': dilation,
+            'groups': group,
+            'name': string(node.layer_name),
+            'param_attr': string(node.layer_name + '_weights'),
+            'bias_attr': False
+            if len(data) == 1 else string(node.layer_name + '_bias'),
+        }
+        node.fluid_code.add_layer(
+            "conv2d", inputs=input, output=node, param_attr=attr)
+
+    def Normalize(self, node):
+        assert len(
+            node.inputs) == 1, 'The count of Normalize node\'s input is not 1.'
+        params = node.layer.norm_param
+        if params.across_spatial or node.data is None:
+            self.deal_custom_layer(node)
+            return
+        input = self.graph.get_bottom_node(node, idx=0, copy=True)
+        scale = np.reshape(node.data[0], [-1]).astype('float32')
+        attr = {
+            'axis': 1,
+            'epsilon': params.eps,
+            'name': string(node.layer_name + '_l2')
+        }
+        node.fluid_code.add_layer(
+            "l2_normalize", inputs=input, output=node, param_attr=attr)
+        # the scale is a parameter even if it's shared by the channels, so
+        # that it's not written into the code
+        self.weights[node.layer_name + '_scale'] = scale
+        input_name = self.get_input_name(input)
+        attr = {
+            'dtype': '{}.dtype'.format(input_name),
+            'shape': [scale.shape[0]],
+            'name': string(node.layer_name + '_cparam'),
+            'attr': string(node.layer_name + '_scale'),
+            'default_initializer': 'Constant(value=1.0)'
+        }
+        node.fluid_code.add_layer(
+            "create_parameter",
+            inputs=None,
+            output=node.layer_name + '_scale_param',
+            param_attr=attr)
+        attr = {
+            'axis': -1 if params.channel_shared else 1,
+            'name': string(node.layer_name)
+        }
+        node.fluid_code.add_layer(
+            "elementwise_mul",
+            inputs={'x': node,
+                    'y': node.layer_name + '_scale_param'},
+            output=node,
+            param_attr=attr)
+
+    def ShuffleChannel(self, node):
+        assert len(
+            node.inputs
+        ) == 1, 'The count of ShuffleChannel node\'s input is not 1.'
+        input = self.graph.get_bottom_node(node, idx=0, copy=True)
+        params = node.layer.shuffle_channel_param
+        attr = {'group': params.group, 'name': string(node.layer_name)}
+        node.fluid_code.add_layer(
+            "shuffle_channel", inputs=input, output=node, param_attr=attr)
+
+    def Axpy(self, node):
+        assert len(
+            node.inputs) == 3, 'The count of Axpy node\'s input is not 3.'
+        alpha = self.graph.get_bottom_node(node, idx=0, copy=True)
+        x = self.graph.get_bottom_node(node, idx=1, copy=True)
+        y = self.graph.get_bottom_node(node, idx=2, copy=True)
+        attr = {'axis': 0, 'name': string(node.layer_name + '_mul')}
+        node.fluid_code.add_layer(
+            "elementwise_mul",
+            inputs={'x': x,
+                    'y': alpha},
+            output=node.layer_name + '_mul',
+            param_attr=attr)
+        attr = {'act': None, 'name': string(node.layer_name)}
+        node.fluid_code.add_layer(
+            "elementwise_add",
+            inputs={'x': node.layer_name + '_mul',
+                    'y': y},
+            output=node,
+            param_attr=attr)
+
+    def PriorBox(self, node):
+        if not self.precompute_priorbox:
+            self.deal_custom_layer(node)
+            return
+        assert len(
+            node.inputs) == 2, 'The count of PriorBox node\'s input is not 2.'
+        params = node.layer.prior_box_param
+        self.add_constant(node, priorbox_value(node.input_shape, params))
+
+    def add_constant(self, node, value):
+        node.const_value = value
+        self.weights[node.layer_name] = value
+        attr = {
+            'dtype': string(str(value.dtype)),
+            'shape': list(value.shape),
+            'name': string(node.layer_name),
+            'default_initializer': 'Constant(0.0)'
+        }
+        node.fluid_code.add_layer(
+            "create_parameter", inputs=None, output=node, param_attr=attr)
+
     def deal_custom_layer(self, node):
         op = node.layer_type
         custom_code, func = make_custom_layer(node)
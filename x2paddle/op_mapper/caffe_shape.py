@@ -362,3 +362,42 @@ def shape_reduction(layer, input_shape):
         axis += len(input_shape[0]) + 1
     assert axis <= len(input_shape[0]), 'invalid axis[%d] error' % (axis)
     return [input_shape[0:axis]]
+
+
+def shape_convolutiondepthwise(layer, input_shape):
+    params = layer.convolution_param
+    return get_strided_kernel_output_shape(params, input_shape[0], math.floor)
+
+
+def shape_normalize(layer, input_shape):
+    return input_shape
+
+
+def shape_shufflechannel(layer, input_shape):
+    return input_shape
+
+
+def shape_axpy(layer, input_shape):
+    assert len(input_shape) == 3, "not valid input shape for axpy layer"
+    assert len(input_shape[0]) == len(
+        input_shape[1]), 'should have same dims'
+    output_shape = input_shape[1]
+    assert (input_shape[2] == output_shape),\
+            "shape not consistent for axpy[%s <--> %s]" \
+            % (str(output_shape), str(input_shape[2]))
+    return [output_shape]
+
+
+def shape_priorbox(layer, input_shape):
+    params = layer.prior_box_param
+    aspect_ratios = [1.0]
+    for ar in params.aspect_ratio:
+        if min([abs(ar - r) for r in aspect_ratios]) < 1e-6:
+            continue
+        aspect_ratios.append(ar)
+        if params.flip:
+            aspect_ratios.append(1.0 / ar)
+    num_priors = len(aspect_ratios) * len(params.min_size) + len(
+        params.max_size)
+    fc_shape = input_shape[0]
+    return [[1, 2, 4 * fc_shape[2] * fc_shape[3] * num_priors]]
@@ -14,44 +14,51 @@
 
 from x2paddle.op_mapper.onnx_opsets.opset9 import OpSet9
 from x2paddle.core.op_mapper import OpMapper
+from x2paddle.core.logger import logger
+from x2paddle.core.param_writer import make_weights
+from x2paddle.core.scheduler import map_nodes
 from x2paddle.op_mapper.onnx_opsets.custom_layer import *
 from x2paddle.decoder.onnx_decoder import ONNXGraph, ONNXGraphNode, ONNXGraphDataNode
 
 
 class ONNXOpMapper(OpMapper):
-    def __init__(self, decoder):
+    def __init__(self, decoder, map_workers=1, param_writer=None):
         super(ONNXOpMapper, self).__init__()
         self.support_op_sets = [9, ]
         self.default_op_set = 9
         self.graph = decoder.graph
         self.opset = self.create_opset(decoder)
+        self.opset.weights = make_weights(param_writer)
         if not self.op_checker():
             raise Exception("Model are not supported yet.")
         #mapping op
-        print("Total nodes: {}".format(
+        logger.info("Total nodes: {}".format(
             sum([
                 isinstance(node, ONNXGraphNode)
                 for name, node in self.graph.node_map.items()
             ])))
 
-        print("Nodes converting ...")
-        for node_name in self.graph.topo_sort:
-            node = self.graph.get_node(node_name)
-            op = node.layer_type
-            if hasattr(self.opset, op):
-                func = getattr(self.opset, op)
-                func(node)
-            elif op in self.opset.default_op_mapping:
-                self.opset.directly_map(node)
-            elif op in custom_layers:
-                self.opset.deal_custom_layer(node)
-            elif op in self.opset.elementwise_ops:
-                self.opset.elementwise_map(node)
-        print("Nodes converted.")
+        logger.info("Nodes converting ...")
+        map_nodes(self.graph, self.opset, ONNXOpMapper.map_node, map_workers,
+                  lambda node: node.layer_type in self.opset.serial_ops)
+        logger.info("Nodes converted.")
         self.weights = self.opset.weights
         self.omit_nodes = self.opset.omit_nodes
         self.used_custom_layers = self.opset.used_custom_layers
 
+    @staticmethod
+    def map_node(opset, node):
+        op = node.layer_type
+        if hasattr(opset, op):
+            func = getattr(opset, op)
+            func(node)
+        elif op in opset.default_op_mapping:
+            opset.directly_map(node)
+        elif op in custom_layers:
+            opset.deal_custom_layer(node)
+        elif op in opset.elementwise_ops:
+            opset.elementwise_map(node)
+
     def op_checker(self):
         unsupported_ops = set()
         for node_name in self.graph.topo_sort:
@@ -65,10 +72,12 @@ class ONNXOpMapper(OpMapper):
         if len(unsupported_ops) == 0:
             return True
         else:
-            print("There are {} ops not supported yet, list as below".format(
-                len(unsupported_ops)))
+            logger.error(
+                "There are {} ops not supported yet, list as below".format(
+                    len(unsupported_ops)),
+                unsupported_ops=list(unsupported_ops))
             for op in unsupported_ops:
-                print(op)
+                logger.error(op)
             return False
 
     def create_opset(self, decoder):
@@ -85,7 +94,7 @@ class ONNXOpMapper(OpMapper):
                 else:
                     break
             opset = 'OpSet' + str(run_op_set)
-        print(
+        logger.info(
             'Now, onnx2paddle support convert onnx model opset_verison {},'
             'opset_verison of your onnx model is {}, automatically treated as op_set: {}.'
             .format(self.support_op_sets, decoder.op_set, run_op_set))
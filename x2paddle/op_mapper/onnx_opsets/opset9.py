@@ -17,6 +17,7 @@ from x2paddle.core.graph import GraphNode
 from x2paddle.core.fluid_code import Layer
 from x2paddle.core.fluid_code import FluidCode
 from x2paddle.core.util import string
+from x2paddle.core.logger import logger
 from functools import reduce
 import numpy as np
 import onnx
@@ -53,8 +54,11 @@ def print_mapping_info(func):
         try:
             res = func(*args, **kwargs)
         except:
-            print("convert failed node:{}, op_type is {}".format(
-                node.layer_name[9:], node.layer_type))
+            logger.error(
+                "convert failed node:{}, op_type is {}".format(
+                    node.layer_name[9:], node.layer_type),
+                node=node.layer_name[9:],
+                op=node.layer_type)
             raise
         else:
             #print("convert successfully node:{}, op_type is {}".format(
@@ -136,6 +140,10 @@ class OpSet9():
         [(lambda i, o, a: a.get('axis', 0) == 0, 'only axis = 0 is supported')],
     }
 
+    # handlers writing the state of the opset or of the other nodes, which
+    # are mapped one at a time with --map_workers
+    serial_ops = ['place_holder']
+
     def __init__(self, decoder):
         super(OpSet9, self).__init__()
         self.graph = decoder.graph
@@ -273,6 +281,10 @@ class OpSet9():
                 shape[i] = 1
             if dim_shape == 0 and i != 0:
                 assert 'shape of input is not assigned'
+        if self.graph.static_shape:
+            assert all([dim > 0 for dim in shape]), \
+                "Shape of input {} is not static: {}".format(node.layer_name,
+                                                              shape)
         attr = {
             "dtype": string(node.dtype),
             "shape": shape,
@@ -800,11 +812,17 @@ class OpSet9():
         shape_dims = len(val_shape.out_shapes[0])
 
         if shape_value is not None:
+            shape = shape_value.tolist()
+            out_shape = val_reshaped.out_shapes[0]
+            if self.graph.static_shape and len(out_shape) == len(shape) and \
+                    all([dim > 0 for dim in out_shape]):
+                # -1 and 0 in the shape are resolved with static shapes
+                shape = list(out_shape)
             node.fluid_code.add_layer(
                 'reshape',
                 inputs={'x': val_x},
                 output=node,
-                param_attr={'shape': shape_value.tolist()})
+                param_attr={'shape': shape})
         elif val_shape.dtype == 'int64':
             val_shape_cast = val_shape.layer_name + '_cast'
             node.fluid_code.add_layer(
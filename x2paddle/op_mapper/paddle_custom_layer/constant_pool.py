@@ -0,0 +1,58 @@
+#   Copyright (c) 2019  PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+from onnx import onnx_pb, helper
+
+
+class ConstantPool(object):
+    """
+    Create the Constant nodes used by the custom layers. The tensors are
+    written from the numpy buffer, and a constant with the same dtype, shape
+    and value is only created once, so that it is shared by all the layers
+    (e.g. all the heads of yolov3) converted with the same pool.
+    """
+    numpy_onnx_dtype_map = {
+        'float32': onnx_pb.TensorProto.FLOAT,
+        'float64': onnx_pb.TensorProto.DOUBLE,
+        'int32': onnx_pb.TensorProto.INT32,
+        'int64': onnx_pb.TensorProto.INT64,
+        'bool': onnx_pb.TensorProto.BOOL
+    }
+
+    def __init__(self, name_prefix='p2o.const'):
+        self.name_prefix = name_prefix
+        self.names = dict()
+
+    def get(self, value, dtype, node_list):
+        """
+        Return the name of the constant, the Constant node is appended to
+        node_list if it does not exist yet.
+        """
+        value = np.ascontiguousarray(value, dtype=dtype)
+        key = (value.dtype.str, value.shape, value.tobytes())
+        if key in self.names:
+            return self.names[key]
+        name = '{}.{}'.format(self.name_prefix, len(self.names))
+        tensor = helper.make_tensor(
+            name=name + '@const',
+            data_type=self.numpy_onnx_dtype_map[value.dtype.name],
+            dims=value.shape,
+            vals=value.tobytes(),
+            raw=True)
+        node_list.append(
+            helper.make_node(
+                'Constant', inputs=[], outputs=[name], value=tensor))
+        self.names[key] = name
+        return name
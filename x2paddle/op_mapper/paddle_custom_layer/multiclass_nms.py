@@ -15,19 +15,21 @@
 import math
 import sys
 import os
-import numpy as np
 import paddle.fluid.core as core
 import paddle.fluid as fluid
 import onnx
 import warnings
 from onnx import helper, onnx_pb
+from .constant_pool import ConstantPool
 
 
-def multiclass_nms(op, block):
+def multiclass_nms(op, block, constants=None):
     """
     Convert the paddle multiclass_nms to onnx op.
     This op is get the select boxes from origin boxes.
     """
+    if constants is None:
+        constants = ConstantPool(op.output('Out')[0] + '@const')
     inputs = dict()
     outputs = dict()
     attrs = dict()
@@ -47,50 +49,17 @@ def multiclass_nms(op, block):
                          Please set normalized=True in multiclass_nms of Paddle')
 
     #convert the paddle attribute to onnx tensor
-    name_score_threshold = [outputs['Out'][0] + "@score_threshold"]
-    name_iou_threshold = [outputs['Out'][0] + "@iou_threshold"]
-    name_keep_top_k = [outputs['Out'][0] + '@keep_top_k']
-    name_keep_top_k_2D = [outputs['Out'][0] + '@keep_top_k_1D']
-
-    node_score_threshold = onnx.helper.make_node(
-        'Constant',
-        inputs=[],
-        outputs=name_score_threshold,
-        value=onnx.helper.make_tensor(
-            name=name_score_threshold[0] + "@const",
-            data_type=onnx.TensorProto.FLOAT,
-            dims=(),
-            vals=[float(attrs['score_threshold'])]))
-
-    node_iou_threshold = onnx.helper.make_node(
-        'Constant',
-        inputs=[],
-        outputs=name_iou_threshold,
-        value=onnx.helper.make_tensor(
-            name=name_iou_threshold[0] + "@const",
-            data_type=onnx.TensorProto.FLOAT,
-            dims=(),
-            vals=[float(attrs['nms_threshold'])]))
-
-    node_keep_top_k = onnx.helper.make_node(
-        'Constant',
-        inputs=[],
-        outputs=name_keep_top_k,
-        value=onnx.helper.make_tensor(
-            name=name_keep_top_k[0] + "@const",
-            data_type=onnx.TensorProto.INT64,
-            dims=(),
-            vals=[np.int64(attrs['keep_top_k'])]))
-
-    node_keep_top_k_2D = onnx.helper.make_node(
-        'Constant',
-        inputs=[],
-        outputs=name_keep_top_k_2D,
-        value=onnx.helper.make_tensor(
-            name=name_keep_top_k_2D[0] + "@const",
-            data_type=onnx.TensorProto.INT64,
-            dims=[1, 1],
-            vals=[np.int64(attrs['keep_top_k'])]))
+    node_list = []
+    name_score_threshold = [
+        constants.get(attrs['score_threshold'], 'float32', node_list)
+    ]
+    name_iou_threshold = [
+        constants.get(attrs['nms_threshold'], 'float32', node_list)
+    ]
+    name_keep_top_k = [constants.get(attrs['keep_top_k'], 'int64', node_list)]
+    name_keep_top_k_2D = [
+        constants.get([[attrs['keep_top_k']]], 'int64', node_list)
+    ]
 
     # the paddle data format is x1,y1,x2,y2
     kwargs = {'center_point_box': 0}
@@ -102,35 +71,19 @@ def multiclass_nms(op, block):
             name_iou_threshold + name_score_threshold,
         outputs=name_select_nms)
     # step 1 nodes select the nms class
-    node_list = [
-        node_score_threshold, node_iou_threshold, node_keep_top_k,
-        node_keep_top_k_2D, node_select_nms
-    ]
+    node_list.append(node_select_nms)
 
     # create some const value to use
-    name_const_value = [result_name+"@const_0",
-        result_name+"@const_1",\
-        result_name+"@const_2",\
-        result_name+"@const_-1"]
-    value_const_value = [0, 1, 2, -1]
-    for name, value in zip(name_const_value, value_const_value):
-        node = onnx.helper.make_node(
-            'Constant',
-            inputs=[],
-            outputs=[name],
-            value=onnx.helper.make_tensor(
-                name=name + "@const",
-                data_type=onnx.TensorProto.INT64,
-                dims=[1],
-                vals=[value]))
-        node_list.append(node)
+    name_const_0, name_const_1, name_const_2, name_const_minus_1 = [
+        constants.get([value], 'int64', node_list) for value in [0, 1, 2, -1]
+    ]
 
     # Ine this code block, we will deocde the raw score data, reshape N * C * M to 1 * N*C*M
     # and the same time, decode the select indices to 1 * D, gather the select_indices
     outputs_gather_1 = [result_name + "@gather_1"]
     node_gather_1 = onnx.helper.make_node(
         'Gather',
-        inputs=name_select_nms + [result_name + "@const_1"],
+        inputs=name_select_nms + [name_const_1],
         outputs=outputs_gather_1,
         axis=1)
     node_list.append(node_gather_1)
@@ -146,7 +99,7 @@ def multiclass_nms(op, block):
     outputs_gather_2 = [result_name + "@gather_2"]
     node_gather_2 = onnx.helper.make_node(
         'Gather',
-        inputs=name_select_nms + [result_name + "@const_2"],
+        inputs=name_select_nms + [name_const_2],
         outputs=outputs_gather_2,
         axis=1)
     node_list.append(node_gather_2)
@@ -158,17 +111,7 @@ def multiclass_nms(op, block):
             'NonZero', inputs=outputs_squeeze_gather_1, outputs=outputs_nonzero)
         node_list.append(node_nonzero)
     else:
-        name_thresh = [result_name + "@thresh"]
-        node_thresh = onnx.helper.make_node(
-            'Constant',
-            inputs=[],
-            outputs=name_thresh,
-            value=onnx.helper.make_tensor(
-                name=name_thresh[0] + "@const",
-                data_type=onnx.TensorProto.INT32,
-                dims=[1],
-                vals=[-1]))
-        node_list.append(node_thresh)
+        name_thresh = [constants.get([-1], 'int32', node_list)]
 
         outputs_cast = [result_name + "@cast"]
         node_cast = onnx.helper.make_node(
@@ -207,7 +150,7 @@ def multiclass_nms(op, block):
     outputs_reshape_scores_rank1 = [result_name + "@reshape_scores_rank1"]
     node_reshape_scores_rank1 = onnx.helper.make_node(
         "Reshape",
-        inputs=inputs['Scores'] + [result_name + "@const_-1"],
+        inputs=inputs['Scores'] + [name_const_minus_1],
         outputs=outputs_reshape_scores_rank1)
     node_list.append(node_reshape_scores_rank1)
 
@@ -221,7 +164,7 @@ def multiclass_nms(op, block):
     outputs_gather_scores_dim1 = [result_name + "@gather_scores_dim1"]
     node_gather_scores_dim1 = onnx.helper.make_node(
         'Gather',
-        inputs=outputs_shape_scores + [result_name + "@const_2"],
+        inputs=outputs_shape_scores + [name_const_2],
         outputs=outputs_gather_scores_dim1,
         axis=0)
     node_list.append(node_gather_scores_dim1)
@@ -271,7 +214,7 @@ def multiclass_nms(op, block):
     outputs_gather_select_num = [result_name + "@gather_select_num"]
     node_gather_select_num = onnx.helper.make_node(
         'Gather',
-        inputs=outputs_shape_select_num + [result_name + "@const_0"],
+        inputs=outputs_shape_select_num + [name_const_0],
         outputs=outputs_gather_select_num,
         axis=0)
     node_list.append(node_gather_select_num)
@@ -1,6 +1,7 @@
 import onnx
 import numpy as np
 from onnx import onnx_pb, helper
+from .constant_pool import ConstantPool
 
 MAX_FLOAT = np.asarray([255, 255, 127, 127], dtype=np.uint8).view(np.float32)[0]
 
@@ -18,7 +19,9 @@ def get_old_name(arg, name_prefix=''):
     return name_prefix + last_prefix
 
 
-def yolo_box(op, block):
+def yolo_box(op, block, constants=None):
+    if constants is None:
+        constants = ConstantPool(op.output('Boxes')[0] + '@const')
     inputs = dict()
     outputs = dict()
     attrs = dict()
@@ -40,24 +43,12 @@ def yolo_box(op, block):
     downsample_ratio = attrs['downsample_ratio']
     input_size = input_height * downsample_ratio
     conf_thresh = attrs['conf_thresh']
-    conf_thresh_mat = np.ones([num_anchors * input_height *
-                               input_width]) * conf_thresh
 
     node_list = []
     im_outputs = []
 
     x_shape = [1, num_anchors, 5 + class_num, input_height, input_width]
-    name_x_shape = [model_name + "@x_shape"]
-    node_x_shape = onnx.helper.make_node(
-        'Constant',
-        inputs=[],
-        outputs=name_x_shape,
-        value=onnx.helper.make_tensor(
-            name=name_x_shape[0] + "@const",
-            data_type=onnx.TensorProto.INT64,
-            dims=[5],
-            vals=x_shape))
-    node_list.append(node_x_shape)
+    name_x_shape = [constants.get(x_shape, 'int64', node_list)]
 
     outputs_x_reshape = [model_name + "@reshape"]
     node_x_reshape = onnx.helper.make_node(
@@ -72,91 +63,11 @@ def yolo_box(op, block):
         perm=[0, 1, 3, 4, 2])
     node_list.append(node_x_transpose)
 
-    range_x = []
-    range_y = []
-    for i in range(0, input_width):
-        range_x.append(i)
-    for j in range(0, input_height):
-        range_y.append(j)
-
-    name_range_x = [model_name + "@range_x"]
-    node_range_x = onnx.helper.make_node(
-        'Constant',
-        inputs=[],
-        outputs=name_range_x,
-        value=onnx.helper.make_tensor(
-            name=name_range_x[0] + "@const",
-            data_type=onnx.TensorProto.FLOAT,
-            dims=[input_width],
-            vals=range_x))
-    node_list.append(node_range_x)
-
-    name_range_y = [model_name + "@range_y"]
-    node_range_y = onnx.helper.make_node(
-        'Constant',
-        inputs=[],
-        outputs=name_range_y,
-        value=onnx.helper.make_tensor(
-            name=name_range_y[0] + "@const",
-            data_type=onnx.TensorProto.FLOAT,
-            dims=[input_height],
-            vals=range_y))
-    node_list.append(node_range_y)
-
-    range_x_new_shape = [1, input_width]
-    range_y_new_shape = [input_height, 1]
-
-    name_range_x_new_shape = [model_name + "@range_x_new_shape"]
-    node_range_x_new_shape = onnx.helper.make_node(
-        'Constant',
-        inputs=[],
-        outputs=name_range_x_new_shape,
-        value=onnx.helper.make_tensor(
-            name=name_range_x_new_shape[0] + "@const",
-            data_type=onnx.TensorProto.INT64,
-            dims=[len(range_x_new_shape)],
-            vals=range_x_new_shape))
-    node_list.append(node_range_x_new_shape)
-
-    name_range_y_new_shape = [model_name + "@range_y_new_shape"]
-    node_range_y_new_shape = onnx.helper.make_node(
-        'Constant',
-        inputs=[],
-        outputs=name_range_y_new_shape,
-        value=onnx.helper.make_tensor(
-            name=name_range_y_new_shape[0] + "@const",
-            data_type=onnx.TensorProto.INT64,
-            dims=[len(range_y_new_shape)],
-            vals=range_y_new_shape))
-    node_list.append(node_range_y_new_shape)
-
-    outputs_range_x_reshape = [model_name + "@range_x_reshape"]
-    node_range_x_reshape = onnx.helper.make_node(
-        'Reshape',
-        inputs=name_range_x + name_range_x_new_shape,
-        outputs=outputs_range_x_reshape)
-    node_list.append(node_range_x_reshape)
-
-    outputs_range_y_reshape = [model_name + "@range_y_reshape"]
-    node_range_y_reshape = onnx.helper.make_node(
-        'Reshape',
-        inputs=name_range_y + name_range_y_new_shape,
-        outputs=outputs_range_y_reshape)
-    node_list.append(node_range_y_reshape)
-
-    outputs_grid_x = [model_name + "@grid_x"]
-    node_grid_x = onnx.helper.make_node(
-        "Tile",
-        inputs=outputs_range_x_reshape + name_range_y_new_shape,
-        outputs=outputs_grid_x)
-    node_list.append(node_grid_x)
-
-    outputs_grid_y = [model_name + "@grid_y"]
-    node_grid_y = onnx.helper.make_node(
-        "Tile",
-        inputs=outputs_range_y_reshape + name_range_x_new_shape,
-        outputs=outputs_grid_y)
-    node_list.append(node_grid_y)
+    # the grid offsets are [input_height, input_width] constants
+    grid_x, grid_y = np.meshgrid(
+        np.arange(input_width), np.arange(input_height))
+    outputs_grid_x = [constants.get(grid_x, 'float32', node_list)]
+    outputs_grid_y = [constants.get(grid_y, 'float32', node_list)]
 
     outputs_box_x = [model_name + "@box_x"]
     outputs_box_y = [model_name + "@box_y"]
@@ -217,30 +128,8 @@ def yolo_box(op, block):
         outputs=outputs_box_y_add_grid)
     node_list.append(node_box_y_add_grid)
 
-    name_input_h = [model_name + "@input_h"]
-    name_input_w = [model_name + "@input_w"]
-
-    node_input_h = onnx.helper.make_node(
-        'Constant',
-        inputs=[],
-        outputs=name_input_h,
-        value=onnx.helper.make_tensor(
-            name=name_input_w[0] + "@const",
-            data_type=onnx.TensorProto.FLOAT,
-            dims=(),
-            vals=[input_height]))
-    node_list.append(node_input_h)
-
-    node_input_w = onnx.helper.make_node(
-        'Constant',
-        inputs=[],
-        outputs=name_input_w,
-        value=onnx.helper.make_tensor(
-            name=name_input_w[0] + "@const",
-            data_type=onnx.TensorProto.FLOAT,
-            dims=(),
-            vals=[input_width]))
-    node_list.append(node_input_w)
+    name_input_h = [constants.get(input_height, 'float32', node_list)]
+    name_input_w = [constants.get(input_width, 'float32', node_list)]
 
     outputs_box_x_encode = [model_name + "@box_x_encode"]
     outputs_box_y_encode = [model_name + "@box_y_encode"]
@@ -257,95 +146,17 @@ def yolo_box(op, block):
         outputs=outputs_box_y_encode)
     node_list.append(node_box_y_encode)
 
-    name_anchor_tensor = [model_name + "@anchor_tensor"]
-    node_anchor_tensor = onnx.helper.make_node(
-        "Constant",
-        inputs=[],
-        outputs=name_anchor_tensor,
-        value=onnx.helper.make_tensor(
-            name=name_anchor_tensor[0] + "@const",
-            data_type=onnx.TensorProto.FLOAT,
-            dims=[len(anchors)],
-            vals=anchors))
-    node_list.append(node_anchor_tensor)
-
-    anchor_shape = [int(num_anchors), 2]
-    name_anchor_shape = [model_name + "@anchor_shape"]
-    node_anchor_shape = onnx.helper.make_node(
-        "Constant",
-        inputs=[],
-        outputs=name_anchor_shape,
-        value=onnx.helper.make_tensor(
-            name=name_anchor_shape[0] + "@const",
-            data_type=onnx.TensorProto.INT64,
-            dims=[2],
-            vals=anchor_shape))
-    node_list.append(node_anchor_shape)
-
-    outputs_anchor_tensor_reshape = [model_name + "@anchor_tensor_reshape"]
-    node_anchor_tensor_reshape = onnx.helper.make_node(
-        "Reshape",
-        inputs=name_anchor_tensor + name_anchor_shape,
-        outputs=outputs_anchor_tensor_reshape)
-    node_list.append(node_anchor_tensor_reshape)
-
-    name_input_size = [model_name + "@input_size"]
-    node_input_size = onnx.helper.make_node(
-        "Constant",
-        inputs=[],
-        outputs=name_input_size,
-        value=onnx.helper.make_tensor(
-            name=name_input_size[0] + "@const",
-            data_type=onnx.TensorProto.FLOAT,
-            dims=(),
-            vals=[input_size]))
-    node_list.append(node_input_size)
-
-    outputs_anchors_div_input_size = [model_name + "@anchors_div_input_size"]
-    node_anchors_div_input_size = onnx.helper.make_node(
-        "Div",
-        inputs=outputs_anchor_tensor_reshape + name_input_size,
-        outputs=outputs_anchors_div_input_size)
-    node_list.append(node_anchors_div_input_size)
-
-    outputs_anchor_w = [model_name + "@anchor_w"]
-    outputs_anchor_h = [model_name + "@anchor_h"]
-
-    node_anchor_split = onnx.helper.make_node(
-        'Split',
-        inputs=outputs_anchors_div_input_size,
-        outputs=outputs_anchor_w + outputs_anchor_h,
-        axis=1,
-        split=[1, 1])
-    node_list.append(node_anchor_split)
-
-    new_anchor_shape = [1, int(num_anchors), 1, 1]
-    name_new_anchor_shape = [model_name + "@new_anchor_shape"]
-    node_new_anchor_shape = onnx.helper.make_node(
-        'Constant',
-        inputs=[],
-        outputs=name_new_anchor_shape,
-        value=onnx.helper.make_tensor(
-            name=name_new_anchor_shape[0] + "@const",
-            data_type=onnx.TensorProto.INT64,
-            dims=[len(new_anchor_shape)],
-            vals=new_anchor_shape))
-    node_list.append(node_new_anchor_shape)
-
-    outputs_anchor_w_reshape = [model_name + "@anchor_w_reshape"]
-    outputs_anchor_h_reshape = [model_name + "@anchor_h_reshape"]
-
-    node_anchor_w_reshape = onnx.helper.make_node(
-        'Reshape',
-        inputs=outputs_anchor_w + name_new_anchor_shape,
-        outputs=outputs_anchor_w_reshape)
-    node_list.append(node_anchor_w_reshape)
-
-    node_anchor_h_reshape = onnx.helper.make_node(
-        'Reshape',
-        inputs=outputs_anchor_h + name_new_anchor_shape,
-        outputs=outputs_anchor_h_reshape)
-    node_list.append(node_anchor_h_reshape)
+    # anchors divided by input_size, reshaped to [1, num_anchors, 1, 1]
+    anchors = np.array(anchors, dtype='float32').reshape([-1, 2])
+    anchors = anchors / np.float32(input_size)
+    outputs_anchor_w_reshape = [
+        constants.get(anchors[:, 0].reshape([1, -1, 1, 1]), 'float32',
+                      node_list)
+    ]
+    outputs_anchor_h_reshape = [
+        constants.get(anchors[:, 1].reshape([1, -1, 1, 1]), 'float32',
+                      node_list)
+    ]
 
     outputs_box_w_squeeze = [model_name + "@box_w_squeeze"]
     node_box_w_squeeze = onnx.helper.make_node(
@@ -393,37 +204,9 @@ def yolo_box(op, block):
         'Sigmoid', inputs=outputs_conf, outputs=outputs_conf_sigmoid)
     node_list.append(node_conf_sigmoid)
 
-    name_conf_thresh = [model_name + "@conf_thresh"]
-    node_conf_thresh = onnx.helper.make_node(
-        'Constant',
-        inputs=[],
-        outputs=name_conf_thresh,
-        value=onnx.helper.make_tensor(
-            name=name_conf_thresh[0] + "@const",
-            data_type=onnx.TensorProto.FLOAT,
-            dims=[num_anchors * input_height * input_width],
-            vals=conf_thresh_mat))
-    node_list.append(node_conf_thresh)
-
-    conf_shape = [1, int(num_anchors), input_height, input_width, 1]
-    name_conf_shape = [model_name + "@conf_shape"]
-    node_conf_shape = onnx.helper.make_node(
-        'Constant',
-        inputs=[],
-        outputs=name_conf_shape,
-        value=onnx.helper.make_tensor(
-            name=name_conf_shape[0] + "@const",
-            data_type=onnx.TensorProto.INT64,
-            dims=[len(conf_shape)],
-            vals=conf_shape))
-    node_list.append(node_conf_shape)
-
-    outputs_conf_thresh_reshape = [model_name + "@conf_thresh_reshape"]
-    node_conf_thresh_reshape = onnx.helper.make_node(
-        'Reshape',
-        inputs=name_conf_thresh + name_conf_shape,
-        outputs=outputs_conf_thresh_reshape)
-    node_list.append(node_conf_thresh_reshape)
+    outputs_conf_thresh_reshape = [
+        constants.get(conf_thresh, 'float32', node_list)
+    ]
 
     outputs_conf_sub = [model_name + "@conf_sub"]
     node_conf_sub = onnx.helper.make_node(
@@ -437,18 +220,7 @@ def yolo_box(op, block):
         'Clip', inputs=outputs_conf_sub, outputs=outputs_conf_clip)
     node_list.append(node_conf_clip)
 
-    zeros = [0]
-    name_zeros = [model_name + "@zeros"]
-    node_zeros = onnx.helper.make_node(
-        'Constant',
-        inputs=[],
-        outputs=name_zeros,
-        value=onnx.helper.make_tensor(
-            name=name_zeros[0] + "@const",
-            data_type=onnx.TensorProto.FLOAT,
-            dims=(),
-            vals=zeros))
-    node_list.append(node_zeros)
+    name_zeros = [constants.get(0, 'float32', node_list)]
 
     outputs_conf_clip_bool = [model_name + "@conf_clip_bool"]
     node_conf_clip_bool = onnx.helper.make_node(
@@ -478,17 +250,7 @@ def yolo_box(op, block):
     node_list.append(node_prob_sigmoid)
 
     new_shape = [1, int(num_anchors), input_height, input_width, 1]
-    name_new_shape = [model_name + "@new_shape"]
-    node_new_shape = onnx.helper.make_node(
-        'Constant',
-        inputs=[],
-        outputs=name_new_shape,
-        value=onnx.helper.make_tensor(
-            name=name_new_shape[0] + "@const",
-            data_type=onnx.TensorProto.INT64,
-            dims=[len(new_shape)],
-            vals=new_shape))
-    node_list.append(node_new_shape)
+    name_new_shape = [constants.get(new_shape, 'int64', node_list)]
 
     outputs_conf_new_shape = [model_name + "@_conf_new_shape"]
     node_conf_new_shape = onnx.helper.make_node(
@@ -561,17 +323,7 @@ def yolo_box(op, block):
     node_list.append(node_pred_box_mul_conf)
 
     box_shape = [1, int(num_anchors) * input_height * input_width, 4]
-    name_box_shape = [model_name + "@box_shape"]
-    node_box_shape = onnx.helper.make_node(
-        'Constant',
-        inputs=[],
-        outputs=name_box_shape,
-        value=onnx.helper.make_tensor(
-            name=name_box_shape[0] + "@const",
-            data_type=onnx.TensorProto.INT64,
-            dims=[len(box_shape)],
-            vals=box_shape))
-    node_list.append(node_box_shape)
+    name_box_shape = [constants.get(box_shape, 'int64', node_list)]
 
     outputs_pred_box_new_shape = [model_name + "@pred_box_new_shape"]
     node_pred_box_new_shape = onnx.helper.make_node(
@@ -593,17 +345,7 @@ def yolo_box(op, block):
         axis=2)
     node_list.append(node_pred_box_split)
 
-    name_number_two = [model_name + "@number_two"]
-    node_number_two = onnx.helper.make_node(
-        "Constant",
-        inputs=[],
-        outputs=name_number_two,
-        value=onnx.helper.make_tensor(
-            name=name_number_two[0] + "@const",
-            data_type=onnx.TensorProto.FLOAT,
-            dims=(),
-            vals=[2]))
-    node_list.append(node_number_two)
+    name_number_two = [constants.get(2, 'float32', node_list)]
 
     outputs_half_w = [model_name + "@half_w"]
     node_half_w = onnx.helper.make_node(
@@ -704,17 +446,7 @@ def yolo_box(op, block):
         outputs=outputs_pred_box_y2_decode)
     node_list.append(node_pred_box_y2_decode)
 
-    name_number_one = [model_name + "@one"]
-    node_number_one = onnx.helper.make_node(
-        'Constant',
-        inputs=[],
-        outputs=name_number_one,
-        value=onnx.helper.make_tensor(
-            name=name_number_one[0] + "@const",
-            data_type=onnx.TensorProto.FLOAT,
-            dims=(),
-            vals=[1]))
-    node_list.append(node_number_one)
+    name_number_one = [constants.get(1, 'float32', node_list)]
 
     output_new_img_height = [model_name + "@new_img_height"]
     node_new_img_height = onnx.helper.make_node(
@@ -749,30 +481,8 @@ def yolo_box(op, block):
     outputs_pred_box_x2_clip = [model_name + "@pred_box_x2_clip"]
     outputs_pred_box_y2_clip = [model_name + "@pred_box_y2_clip"]
 
-    min_const_name = model_name + "@pred_box_min_const"
-    max_const_name = model_name + "@pred_box_max_const"
-
-    min_const = onnx.helper.make_node(
-        'Constant',
-        inputs=[],
-        outputs=[min_const_name],
-        value=onnx.helper.make_tensor(
-            name=min_const_name,
-            data_type=onnx.TensorProto.FLOAT,
-            dims=(),
-            vals=[0.0]))
-    node_list.append(min_const)
-
-    max_const = onnx.helper.make_node(
-        'Constant',
-        inputs=[],
-        outputs=[max_const_name],
-        value=onnx.helper.make_tensor(
-            name=max_const_name,
-            data_type=onnx.TensorProto.FLOAT,
-            dims=(),
-            vals=[MAX_FLOAT]))
-    node_list.append(max_const)
+    min_const_name = constants.get(0.0, 'float32', node_list)
+    max_const_name = constants.get(MAX_FLOAT, 'float32', node_list)
 
     node_pred_box_x1_clip = onnx.helper.make_node(
         'Clip',
@@ -821,17 +531,7 @@ def yolo_box(op, block):
     node_list.append(node_pred_box_result)
 
     score_shape = [1, input_height * input_width * int(num_anchors), class_num]
-    name_score_shape = [model_name + "@score_shape"]
-    node_score_shape = onnx.helper.make_node(
-        "Constant",
-        inputs=[],
-        outputs=name_score_shape,
-        value=onnx.helper.make_tensor(
-            name=name_score_shape[0] + "@const",
-            data_type=onnx.TensorProto.INT64,
-            dims=[len(score_shape)],
-            vals=score_shape))
-    node_list.append(node_score_shape)
+    name_score_shape = [constants.get(score_shape, 'int64', node_list)]
 
     node_score_new_shape = onnx.helper.make_node(
         'Reshape',
@@ -13,17 +13,22 @@
 # limitations under the License.
 
 import math
-import sys
 import x2paddle
 import os
 import numpy as np
 import paddle.fluid.core as core
 import paddle.fluid as fluid
 import onnx
-from onnx import helper, onnx_pb
+from onnx import helper, onnx_pb, external_data_helper
+from x2paddle.op_mapper.paddle_custom_layer.constant_pool import ConstantPool
+from x2paddle.optimizer.paddle2onnx_optimizer import Paddle2ONNXOptimizer
+from x2paddle.core.logger import logger
+from x2paddle.core.profiler import profiler
 
 
 class PaddleOpMapper(object):
+    max_protobuf_size = 2 * 1024 * 1024 * 1024 - 1
+
     def __init__(self):
         self.paddle_onnx_dtype_map = {
             core.VarDesc.VarType.FP32: onnx_pb.TensorProto.FLOAT,
@@ -34,61 +39,113 @@ class PaddleOpMapper(object):
             core.VarDesc.VarType.INT64: onnx_pb.TensorProto.INT64,
             core.VarDesc.VarType.BOOL: onnx_pb.TensorProto.BOOL
         }
+        self.onnx_numpy_dtype_map = {
+            onnx_pb.TensorProto.FLOAT: np.float32,
+            onnx_pb.TensorProto.DOUBLE: np.float64,
+            onnx_pb.TensorProto.INT32: np.int32,
+            onnx_pb.TensorProto.INT16: np.int16,
+            onnx_pb.TensorProto.UINT16: np.uint16,
+            onnx_pb.TensorProto.INT64: np.int64,
+            onnx_pb.TensorProto.BOOL: np.bool_
+        }
 
         self.name_counter = dict()
+        self.constants = ConstantPool()
 
-    def convert(self, program, save_dir):
-        weight_nodes = self.convert_weights(program)
+    def convert(self, program, save_dir, external_data=False, params=None):
+        with profiler.stage('export_params'):
+            weights = self.convert_weights(program, params)
         op_nodes = list()
         input_nodes = list()
         output_nodes = list()
         unsupported_ops = set()
 
-        print("Translating PaddlePaddle to ONNX...\n")
-        for block in program.blocks:
-            for i, op in enumerate(block.ops):
-                sys.stdout.write(
-                    "\rTotal:{}, Current:{} : {}                   ".format(
-                        len(block.ops), i + 1, op.type))
-                sys.stdout.flush()
-                if not hasattr(self, op.type):
-                    unsupported_ops.add(op.type)
-                    continue
-                if len(unsupported_ops) > 0:
-                    continue
-                node = getattr(self, op.type)(op, block)
-                if op.type == 'feed':
-                    input_nodes.append(node)
-                elif op.type == 'fetch':
-                    output_nodes.append(node)
-                else:
-                    if isinstance(node, list):
-                        op_nodes = op_nodes + node
+        logger.info("Translating PaddlePaddle to ONNX...")
+        with profiler.stage('op_mapping'):
+            for block in program.blocks:
+                for i, op in enumerate(block.ops):
+                    logger.progress(
+                        "Converting ops", i + 1, len(block.ops), op=op.type)
+                    if not hasattr(self, op.type):
+                        unsupported_ops.add(op.type)
+                        continue
+                    if len(unsupported_ops) > 0:
+                        continue
+                    with profiler.trace(
+                            op.type, 'op', block=block.idx, index=i):
+                        node = getattr(self, op.type)(op, block)
+                    if op.type == 'feed':
+                        input_nodes.append(node)
+                    elif op.type == 'fetch':
+                        output_nodes.append(node)
                     else:
-                        op_nodes.append(node)
+                        if isinstance(node, list):
+                            op_nodes = op_nodes + node
+                        else:
+                            op_nodes.append(node)
 
         if len(unsupported_ops) > 0:
-            print("\nThere's {} ops are not supported yet".format(
-                len(unsupported_ops)))
+            logger.error(
+                "There's {} ops are not supported yet".format(
+                    len(unsupported_ops)),
+                unsupported_ops=list(unsupported_ops))
             for op in unsupported_ops:
-                print("=========== {} ===========".format(op))
-            return
+                logger.error("=========== {} ===========".format(op))
+            return False
 
         graph = helper.make_graph(
-            nodes=weight_nodes + op_nodes,
+            nodes=op_nodes,
             name='onnx_model_from_paddle',
-            initializer=[],
+            initializer=weights,
             inputs=input_nodes,
             outputs=output_nodes)
+        with profiler.stage('optimize'):
+            Paddle2ONNXOptimizer(graph).optimize()
         model = helper.make_model(graph, producer_name='X2Paddle')
-        onnx.checker.check_model(model)
 
         if not os.path.isdir(save_dir):
             os.makedirs(save_dir)
-        with open(os.path.join(save_dir, 'x2paddle_model.onnx'), 'wb') as f:
-            f.write(model.SerializeToString())
-        print("\nTranslated model saved in {}".format(
-            os.path.join(save_dir, 'x2paddle_model.onnx')))
+        # make_graph copies the tensors, the ones held by the model are saved
+        weights = model.graph.initializer
+        weights_size = sum([len(tensor.raw_data) for tensor in weights])
+        if not external_data and weights_size >= self.max_protobuf_size:
+            logger.warning(
+                "The size of weights is over 2GB, which is the limit of"
+                " protobuf, so the weights will be saved in an external file.")
+            external_data = True
+        model_path = os.path.join(save_dir, 'x2paddle_model.onnx')
+        with profiler.stage('save_model'):
+            if external_data:
+                self.save_external_data(weights, save_dir)
+            else:
+                with profiler.stage('check_model'):
+                    onnx.checker.check_model(model)
+            with open(model_path, 'wb') as f:
+                f.write(model.SerializeToString())
+            if external_data:
+                # the external data is only found beside the saved model
+                with profiler.stage('check_model'):
+                    onnx.checker.check_model(model_path)
+        logger.info("Translated model saved in {}".format(model_path))
+        return True
+
+    def save_external_data(self, weights, save_dir):
+        """
+        Move the raw_data of the initializers into one external file beside
+        the model, the tensors keep the location/offset/length of their data.
+        """
+        location = 'x2paddle_model.onnx.data'
+        with open(os.path.join(save_dir, location), 'wb') as f:
+            for tensor in weights:
+                offset = f.tell()
+                f.write(tensor.raw_data)
+                external_data_helper.set_external_data(
+                    tensor,
+                    location=location,
+                    offset=offset,
+                    length=len(tensor.raw_data))
+                tensor.data_location = onnx_pb.TensorProto.EXTERNAL
+                tensor.ClearField('raw_data')
 
     def get_name(self, op_name, var_name):
         name = 'p2o.{}.{}'.format(op_name, var_name)
@@ -98,37 +155,50 @@ class PaddleOpMapper(object):
             self.name_counter[name] += 1
         return name + '.{}'.format(self.name_counter[name])
 
-    def convert_weights(self, program):
+    def convert_weights(self, program, params=None):
         var_names = program.global_block().vars
-        nodes = list()
+        weights = list()
         for name in var_names:
             var = program.global_block().var(name)
             if name.endswith('feed') or name.endswith('fetch'):
                 continue
             if not var.persistable:
                 continue
-            weight = np.array(fluid.global_scope().find_var(name).get_tensor())
-            tensor = helper.make_tensor(
-                name=name,
-                dims=var.shape,
-                data_type=self.paddle_onnx_dtype_map[var.dtype],
-                vals=weight.flatten().tolist())
-            node = helper.make_node(
-                'Constant', inputs=[], outputs=[name], value=tensor)
-            nodes.append(node)
-        return nodes
+            if params is not None:
+                weight = params[name]
+            else:
+                weight = np.array(fluid.global_scope().find_var(name)
+                                  .get_tensor())
+            tensor = self.make_tensor(
+                name, self.paddle_onnx_dtype_map[var.dtype], weight, var.shape)
+            weights.append(tensor)
+        return weights
+
+    def make_tensor(self, name, dtype, value, dims=None):
+        """
+        Build a TensorProto from the bytes of the numpy buffer (raw_data),
+        instead of converting the values into a python list.
+        """
+        value = np.ascontiguousarray(
+            value, dtype=self.onnx_numpy_dtype_map[dtype])
+        if dims is None:
+            dims = value.shape
+        return helper.make_tensor(
+            name=name,
+            data_type=dtype,
+            dims=dims,
+            vals=value.tobytes(),
+            raw=True)
 
     def make_constant_node(self, name, dtype, value=None):
         if isinstance(value, list):
             dims = (len(value), )
         elif value is None:
-            dims = ()
+            dims = (0, )
             value = []
         else:
             dims = ()
-            value = [value]
-        tensor = helper.make_tensor(
-            name=name, data_type=dtype, dims=dims, vals=value)
+        tensor = self.make_tensor(name, dtype, value, dims)
         node = helper.make_node(
             'Constant', inputs=[], outputs=[name], value=tensor)
         return node
@@ -489,18 +559,15 @@ class PaddleOpMapper(object):
         value = op.attr('value')
         dtype = op.attr('dtype')
         shape = op.attr('shape')
-        value = np.ones(shape) * value
-        if dtype == 2:
-            value = value.astype('int32')
+        onnx_dtype = self.paddle_onnx_dtype_map[dtype]
+        value = np.full(
+            shape, value, dtype=self.onnx_numpy_dtype_map[onnx_dtype])
         node = helper.make_node(
             'Constant',
             inputs=[],
             outputs=op.output('Out'),
-            value=helper.make_tensor(
-                name=op.output('Out')[0],
-                data_type=self.paddle_onnx_dtype_map[dtype],
-                dims=shape,
-                vals=value.tolist()))
+            value=self.make_tensor(op.output('Out')[0], onnx_dtype, value,
+                                   shape))
         return node
 
     def transpose2(self, op, block):
@@ -852,3 +919,11 @@ class PaddleOpMapper(object):
     def im2sequence(self, op, block):
         from .paddle_custom_layer.im2sequence import im2sequence
         return im2sequence(op, block)
+
+    def yolo_box(self, op, block):
+        from .paddle_custom_layer.yolo_box import yolo_box
+        return yolo_box(op, block, self.constants)
+
+    def multiclass_nms(self, op, block):
+        from .paddle_custom_layer.multiclass_nms import multiclass_nms
+        return multiclass_nms(op, block, self.constants)
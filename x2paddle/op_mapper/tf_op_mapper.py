@@ -15,6 +15,9 @@
 from x2paddle.decoder.tf_decoder import TFGraph
 from x2paddle.core.op_mapper import OpMapper
 from x2paddle.core.util import *
+from x2paddle.core.logger import logger
+from x2paddle.core.param_writer import make_weights
+from x2paddle.core.scheduler import map_nodes
 import inspect
 import numpy
 import sys
@@ -74,12 +77,16 @@ class TFOpMapper(OpMapper):
         'FloorDiv': 'elementwise_floordiv'
     }
 
-    def __init__(self, decoder):
+    # handlers writing the state of the mapper or of the other nodes, which
+    # are mapped one at a time with --map_workers
+    serial_ops = ['Placeholder', 'OneShotIterator', 'Transpose']
+
+    def __init__(self, decoder, map_workers=1, param_writer=None):
         super(TFOpMapper, self).__init__()
         self.decoder = decoder
         self.graph = decoder.tf_graph
         self.batch_node = None
-        self.weights = dict()
+        self.weights = make_weights(param_writer)
         self.omit_nodes = list()
         self.used_custom_layers = dict()
 
@@ -92,34 +99,44 @@ class TFOpMapper(OpMapper):
             idx = self.graph.input_nodes.index(name)
             del self.graph.input_nodes[idx]
 
-        sys.stderr.write("Total nodes: {}\n".format(len(self.graph.topo_sort)))
+        total = len(self.graph.topo_sort)
+        logger.info("Total nodes: {}".format(total))
         unsupported_ops = set()
-        for i, node_name in enumerate(self.graph.topo_sort):
-            sys.stderr.write("\rConverting node {} ...    ".format(i + 1))
-            node = self.graph.get_node(node_name)
-            op = node.layer_type
-            if op in self.directly_map_ops:
-                if len(unsupported_ops) > 0:
-                    continue
-                self.directly_map(node)
-            elif op in self.elementwise_ops:
-                if len(unsupported_ops) > 0:
-                    continue
-                self.elementwise_map(node)
-            elif hasattr(self, op):
-                if len(unsupported_ops) > 0:
-                    continue
-                func = getattr(self, op)
-                func(node)
-            else:
+        for node_name in self.graph.topo_sort:
+            op = self.graph.get_node(node_name).layer_type
+            if op not in self.directly_map_ops and \
+                    op not in self.elementwise_ops and not hasattr(self, op):
                 unsupported_ops.add(op)
+        if len(unsupported_ops) == 0:
+            map_nodes(self.graph, self, TFOpMapper.map_node, map_workers,
+                      self.is_serial)
         if len(unsupported_ops) > 0:
-            sys.stderr.write("=========={} Ops are not supported yet======\n".
-                             format(len(unsupported_ops)))
+            logger.error(
+                "=========={} Ops are not supported yet======".format(
+                    len(unsupported_ops)),
+                unsupported_ops=list(unsupported_ops))
             for op in unsupported_ops:
-                sys.stderr.write("========== {} ==========\n".format(op))
+                logger.error("========== {} ==========".format(op))
             sys.exit(-1)
-        sys.stderr.write('\nDone!\n')
+        logger.info('Done!')
+
+    def map_node(self, node):
+        op = node.layer_type
+        if op in self.directly_map_ops:
+            self.directly_map(node)
+        elif op in self.elementwise_ops:
+            self.elementwise_map(node)
+        else:
+            func = getattr(self, op)
+            func(node)
+
+    def is_serial(self, node):
+        if node.layer_type in self.serial_ops:
+            return True
+        # the data format is propagated to the following nodes
+        if node.layer_type == "Const":
+            return node.tf_data_format == "NCHW"
+        return node.get_attr("data_format") == b"NCHW"
 
     def add_omit_nodes(self, in_node_name, out_node_name):
         in_node = self.graph.get_node(in_node_name)
@@ -566,7 +583,9 @@ class TFOpMapper(OpMapper):
             if attr["shape"].count(-1) > 0:
                 index = attr["shape"].index(-1)
                 attr["shape"][index] = int(total_size)
-                attr["shape"][0] = -1
+                # the shapes are kept static with --static_shape
+                if not self.decoder.static_shape:
+                    attr["shape"][0] = -1
 
         if len(input.out_shapes[0]) == 4 and node.tf_data_format == "NHWC":
             if len(attr["shape"]) < 3:
@@ -15,6 +15,9 @@
 from x2paddle.decoder.tf_decoder import TFGraph
 from x2paddle.core.op_mapper import OpMapper
 from x2paddle.core.util import *
+from x2paddle.core.logger import logger
+from x2paddle.core.param_writer import make_weights
+from x2paddle.core.scheduler import map_nodes
 import inspect
 import numpy
 import sys
@@ -60,11 +63,15 @@ class TFOpMapperNHWC(OpMapper):
         'FloorDiv': 'elementwise_floordiv'
     }
 
-    def __init__(self, decoder):
+    # handlers writing the state of the mapper or of the other nodes, which
+    # are mapped one at a time with --map_workers
+    serial_ops = ['Placeholder', 'Conv2DBackpropInput']
+
+    def __init__(self, decoder, map_workers=1, param_writer=None):
         super(TFOpMapperNHWC, self).__init__()
         self.decoder = decoder
         self.graph = decoder.tf_graph
-        self.weights = dict()
+        self.weights = make_weights(param_writer)
         self.batch_node = None
         self.omit_nodes = list()
         self.used_custom_layers = dict()
@@ -78,46 +85,54 @@ class TFOpMapperNHWC(OpMapper):
             del self.graph.input_nodes[idx]
 
         unsupported_ops = set()
-        sys.stderr.write("Total nodes: {}\n".format(len(self.graph.topo_sort)))
-        for i, node_name in enumerate(self.graph.topo_sort):
-            sys.stderr.write("\rConverting node {} ...     ".format(i + 1))
-            node = self.graph.get_node(node_name)
+        total = len(self.graph.topo_sort)
+        logger.info("Total nodes: {}".format(total))
+        for node_name in self.graph.topo_sort:
+            op = self.graph.get_node(node_name).layer_type
+            if op not in self.directly_map_ops and \
+                    op not in self.elementwise_ops and not hasattr(self, op):
+                unsupported_ops.add(op)
+
+        def map_node(mapper, node):
             op = node.layer_type
-            if op in self.directly_map_ops:
-                if len(unsupported_ops) > 0:
-                    continue
-                self.directly_map(node)
-            elif op in self.elementwise_ops:
-                if len(unsupported_ops) > 0:
-                    continue
-                self.elementwise_map(node)
-            elif hasattr(self, op):
-                if len(unsupported_ops) > 0:
-                    continue
-                func = getattr(self, op)
+            if len(unsupported_ops) > 0:
+                return
+            if op in mapper.directly_map_ops:
+                mapper.directly_map(node)
+            elif op in mapper.elementwise_ops:
+                mapper.elementwise_map(node)
+            else:
+                func = getattr(mapper, op)
                 try:
                     func(node)
                 except Exception as e:
                     unsupported_ops.add(op)
-                    print(e)
-            else:
-                unsupported_ops.add(op)
+                    logger.error(str(e), node=node.layer_name, op=op)
+
+        map_nodes(self.graph, self, map_node, map_workers,
+                  lambda node: node.layer_type in self.serial_ops)
         if len(unsupported_ops) > 0:
-            print("========= {} OPs are not supported yet ===========".format(
-                len(unsupported_ops)))
+            logger.error(
+                "========= {} OPs are not supported yet ===========".format(
+                    len(unsupported_ops)),
+                unsupported_ops=list(unsupported_ops))
             for op in unsupported_ops:
-                print("========== {} ============".format(op))
+                logger.error("========== {} ============".format(op))
             sys.exit(-1)
-        sys.stderr.write("\nDone!\n")
+        logger.info("Done!")
 
     def add_omit_nodes(self, in_node_name, out_node_name):
+        in_node = self.graph.get_node(in_node_name)
+        self.remove_edge(in_node_name, out_node_name)
+        self.omit_nodes.append(in_node.layer_name)
+
+    def remove_edge(self, in_node_name, out_node_name):
         in_node = self.graph.get_node(in_node_name)
         out_node = self.graph.get_node(out_node_name)
         index = in_node.outputs.index(out_node_name)
         del in_node.outputs[index]
         index = out_node.inputs.index(in_node_name)
         del out_node.inputs[index]
-        self.omit_nodes.append(in_node.layer_name)
 
     def directly_map(self, node):
         assert node.layer_type in self.directly_map_ops
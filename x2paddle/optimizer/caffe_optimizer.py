@@ -18,10 +18,16 @@ from x2paddle.core.util import *
 
 class CaffeOptimizer(object):
     layers_with_act = ['Convolution', 'Deconvolution', 'InnerProduct']
+    layers_with_bn = ['Convolution', 'ConvolutionDepthwise', 'InnerProduct']
     activation_ops = ['ReLU', 'Sigmoid']
+    # merge_bn_scale rewrites the weights of these ops and of the ops
+    # before them
+    folded_ops = ['BatchNorm', 'Scale']
 
     def __init__(self, mapper):
         self.graph = mapper.graph
+        self.weights = mapper.weights
+        self.folded_nodes = set()
 
     def merge_bn_scale(self):
         for node_name in self.graph.topo_sort:
@@ -29,6 +35,8 @@ class CaffeOptimizer(object):
             if node.layer_type == 'Scale':
                 parent_node = self.graph.get_bottom_node(node, idx=0)
                 if parent_node.layer_type == 'BatchNorm':
+                    if self.fold_bn_scale(node, parent_node):
+                        continue
                     is_delete_node = True if len(
                         parent_node.outputs) == 1 else False
                     parent_fluid_layer = parent_node.fluid_code.layers[0]
@@ -47,12 +55,71 @@ class CaffeOptimizer(object):
                         output=node,
                         param_attr=parent_param_attr)
 
+    def fold_bn_scale(self, node, bn_node):
+        """ fold BatchNorm + Scale into the weights of the preceding
+            Convolution/InnerProduct, the fused layer is moved to the
+            Scale node and the normalization layers are removed
+        """
+        if len(node.inputs) != 1 or len(bn_node.outputs) != 1:
+            return False
+        parent_node = self.graph.get_bottom_node(bn_node, idx=0)
+        if parent_node.layer_type not in self.layers_with_bn \
+                or len(parent_node.outputs) != 1 \
+                or len(parent_node.fluid_code.layers) != 1:
+            return False
+        scale_name = node.layer_name + '_scale'
+        offset_name = node.layer_name + '_offset'
+        mean_name = bn_node.layer_name + '_mean'
+        variance_name = bn_node.layer_name + '_variance'
+        weights_name = parent_node.layer_name + '_weights'
+        bias_name = parent_node.layer_name + '_bias'
+        if scale_name not in self.weights or weights_name not in self.weights:
+            return False
+
+        # mean and variance are already divided by the moving average
+        # factor (blob 2 of caffe BatchNorm) in CaffeOpMapper.BatchNorm
+        eps = bn_node.fluid_code.layers[0].param_attr['epsilon']
+        mean = self.weights[mean_name]
+        variance = self.weights[variance_name]
+        scale = self.weights[scale_name]
+        offset = self.weights.get(offset_name, numpy.zeros_like(scale))
+        alpha = scale / numpy.sqrt(variance + eps)
+
+        weights = self.weights[weights_name]
+        if parent_node.layer_type == 'InnerProduct':
+            # paddle fc weights are [in, out]
+            weights = weights * alpha.reshape([1, -1])
+        else:
+            weights = weights * alpha.reshape([-1] + [1] *
+                                              (len(weights.shape) - 1))
+        bias = self.weights.get(bias_name, numpy.zeros_like(mean))
+        bias = (bias - mean) * alpha + offset
+        self.weights[weights_name] = weights.astype('float32')
+        self.weights[bias_name] = bias.astype('float32')
+        for name in [mean_name, variance_name, scale_name, offset_name]:
+            self.weights.pop(name, None)
+
+        parent_fluid_layer = parent_node.fluid_code.layers[0]
+        parent_param_attr = parent_fluid_layer.param_attr
+        parent_param_attr['bias_attr'] = string(bias_name)
+        parent_node.fluid_code.clear()
+        bn_node.fluid_code.clear()
+        node.fluid_code.clear()
+        node.fluid_code.add_layer(
+            parent_fluid_layer.op,
+            inputs=parent_fluid_layer.inputs,
+            output=node,
+            param_attr=parent_param_attr)
+        self.folded_nodes.add(node.layer_name)
+        return True
+
     def merge_op_activation(self):
         for node_name in self.graph.topo_sort:
             node = self.graph.get_node(node_name)
             if node.layer_type in self.activation_ops:
                 parent_node = self.graph.get_bottom_node(node, idx=0)
-                if parent_node.layer_type in self.layers_with_act:
+                if parent_node.layer_type in self.layers_with_act \
+                        or parent_node.layer_name in self.folded_nodes:
                     is_delete_node = True if len(
                         parent_node.outputs) == 1 else False
                     parent_fluid_layer = parent_node.fluid_code.layers[0]
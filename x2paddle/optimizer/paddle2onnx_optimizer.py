@@ -0,0 +1,294 @@
+#   Copyright (c) 2019  PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from onnx import helper, numpy_helper, onnx_pb
+import numpy as np
+from x2paddle.core.logger import logger
+from x2paddle.core.profiler import profiler
+
+
+class Paddle2ONNXOptimizer(object):
+    """
+    Simplify the onnx.GraphProto produced by PaddleOpMapper, the structure
+    emitted op by op (Reshape of constants, Identity, Flatten+MatMul, ...)
+    is folded or fused in place.
+    """
+    onnx_numpy_dtype_map = {
+        onnx_pb.TensorProto.FLOAT: np.float32,
+        onnx_pb.TensorProto.DOUBLE: np.float64,
+        onnx_pb.TensorProto.INT32: np.int32,
+        onnx_pb.TensorProto.INT16: np.int16,
+        onnx_pb.TensorProto.UINT16: np.uint16,
+        onnx_pb.TensorProto.INT64: np.int64,
+        onnx_pb.TensorProto.BOOL: np.bool_
+    }
+    foldable_ops = [
+        'Cast', 'Reshape', 'Flatten', 'Unsqueeze', 'Squeeze', 'Transpose',
+        'Concat', 'Identity', 'Add', 'Sub', 'Mul', 'Div'
+    ]
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def optimize(self):
+        node_num = len(self.graph.node)
+        for name in [
+                'fold_constants', 'remove_identity', 'merge_reshape',
+                'fuse_gemm', 'remove_dead_nodes'
+        ]:
+            with profiler.stage(name):
+                getattr(self, name)()
+        logger.info("Simplified onnx graph: {} nodes -> {} nodes".format(
+            node_num, len(self.graph.node)))
+
+    def get_constants(self):
+        constants = dict()
+        for tensor in self.graph.initializer:
+            constants[tensor.name] = tensor
+        for node in self.graph.node:
+            if node.op_type == 'Constant' and \
+                    node.attribute[0].name == 'value':
+                constants[node.output[0]] = node.attribute[0].t
+        return constants
+
+    def get_consumers(self):
+        consumers = dict()
+        for node in self.graph.node:
+            for name in node.input:
+                consumers.setdefault(name, list()).append(node)
+        return consumers
+
+    def get_attrs(self, node):
+        return {
+            attr.name: helper.get_attribute_value(attr)
+            for attr in node.attribute
+        }
+
+    def replace_nodes(self, nodes):
+        self.graph.ClearField('node')
+        self.graph.node.extend(nodes)
+
+    def compute(self, node, values):
+        op = node.op_type
+        attrs = self.get_attrs(node)
+        if op == 'Cast':
+            if attrs['to'] not in self.onnx_numpy_dtype_map:
+                return None
+            return values[0].astype(self.onnx_numpy_dtype_map[attrs['to']])
+        elif op == 'Reshape':
+            shape = [
+                values[0].shape[i] if dim == 0 else dim
+                for i, dim in enumerate(values[1].tolist())
+            ]
+            return values[0].reshape(shape)
+        elif op == 'Flatten':
+            axis = attrs.get('axis', 1)
+            return values[0].reshape(
+                [int(np.prod(values[0].shape[:axis])), -1])
+        elif op in ['Unsqueeze', 'Squeeze']:
+            if 'axes' not in attrs or len(values) != 1:
+                return None
+            if op == 'Squeeze':
+                return np.squeeze(values[0], axis=tuple(attrs['axes']))
+            value = values[0]
+            for axis in sorted(attrs['axes']):
+                value = np.expand_dims(value, axis)
+            return value
+        elif op == 'Transpose':
+            return np.transpose(values[0], attrs.get('perm', None))
+        elif op == 'Concat':
+            return np.concatenate(values, axis=attrs['axis'])
+        elif op == 'Identity':
+            return values[0]
+        elif op == 'Add':
+            return values[0] + values[1]
+        elif op == 'Sub':
+            return values[0] - values[1]
+        elif op == 'Mul':
+            return values[0] * values[1]
+        elif op == 'Div':
+            if values[0].dtype.kind != 'f':
+                return None
+            return values[0] / values[1]
+        return None
+
+    def fold_constants(self):
+        """
+        Evaluate the nodes whose inputs are all constants with numpy, the
+        results are saved as initializers.
+        """
+        constants = self.get_constants()
+        outputs = set([value_info.name for value_info in self.graph.output])
+        nodes = list()
+        for node in self.graph.node:
+            if node.op_type not in self.foldable_ops \
+                    or len(node.output) != 1 \
+                    or node.output[0] in outputs \
+                    or not all([name in constants for name in node.input]):
+                nodes.append(node)
+                continue
+            values = [numpy_helper.to_array(constants[name])
+                      for name in node.input]
+            value = self.compute(node, values)
+            if value is None:
+                nodes.append(node)
+                continue
+            value = np.ascontiguousarray(value, dtype=value.dtype)
+            tensor = numpy_helper.from_array(value, name=node.output[0])
+            constants[node.output[0]] = tensor
+            self.graph.initializer.extend([tensor])
+        self.replace_nodes(nodes)
+
+    def get_dtypes(self):
+        dtypes = dict()
+        for name, tensor in self.get_constants().items():
+            dtypes[name] = tensor.data_type
+        for value_info in self.graph.input:
+            dtypes[value_info.name] = value_info.type.tensor_type.elem_type
+        for node in self.graph.node:
+            if node.op_type == 'Cast':
+                dtypes[node.output[0]] = self.get_attrs(node)['to']
+        return dtypes
+
+    def remove_identity(self):
+        """
+        Remove Identity and the Cast to the dtype its input already has.
+        """
+        outputs = set([value_info.name for value_info in self.graph.output])
+        dtypes = self.get_dtypes()
+        renamed = dict()
+        nodes = list()
+        for node in self.graph.node:
+            for i, name in enumerate(node.input):
+                if name in renamed:
+                    node.input[i] = renamed[name]
+            is_noop = node.op_type == 'Identity' or (
+                node.op_type == 'Cast' and
+                dtypes.get(node.input[0], None) == self.get_attrs(node)['to'])
+            if not is_noop or node.output[0] in outputs:
+                nodes.append(node)
+                continue
+            renamed[node.output[0]] = node.input[0]
+        self.replace_nodes(nodes)
+
+    def merge_reshape(self):
+        """
+        Reshape(Reshape(x, shape0), shape1) -> Reshape(x, shape1)
+        """
+        constants = self.get_constants()
+        consumers = self.get_consumers()
+        outputs = set([value_info.name for value_info in self.graph.output])
+        producers = dict()
+        for node in self.graph.node:
+            for name in node.output:
+                producers[name] = node
+        removed = set()
+        for node in self.graph.node:
+            if node.op_type != 'Reshape' or node.input[1] not in constants:
+                continue
+            shape = numpy_helper.to_array(constants[node.input[1]])
+            if 0 in shape.tolist():
+                continue
+            parent = producers.get(node.input[0], None)
+            if parent is None or parent.op_type != 'Reshape' \
+                    or parent.output[0] in outputs \
+                    or len(consumers[parent.output[0]]) != 1:
+                continue
+            node.input[0] = parent.input[0]
+            removed.add(id(parent))
+        self.replace_nodes(
+            [node for node in self.graph.node if id(node) not in removed])
+
+    def fuse_gemm(self):
+        """
+        Flatten + MatMul (+ Reshape to 2-D) + Add -> Gemm, the weight and the
+        bias need to be constants.
+        """
+        constants = self.get_constants()
+        consumers = self.get_consumers()
+        outputs = set([value_info.name for value_info in self.graph.output])
+        producers = dict()
+        for node in self.graph.node:
+            for name in node.output:
+                producers[name] = node
+
+        def single_consumer(node):
+            name = node.output[0]
+            if name in outputs or len(consumers.get(name, [])) != 1:
+                return None
+            return consumers[name][0]
+
+        removed = set()
+        fused = dict()
+        for node in self.graph.node:
+            if node.op_type != 'MatMul' or node.input[1] not in constants:
+                continue
+            flatten = producers.get(node.input[0], None)
+            if flatten is None or flatten.op_type != 'Flatten':
+                continue
+            weight = constants[node.input[1]]
+            if len(weight.dims) != 2:
+                continue
+            num_output = weight.dims[1]
+            next_node = single_consumer(node)
+            reshape = None
+            if next_node is not None and next_node.op_type == 'Reshape':
+                if next_node.input[1] not in constants:
+                    continue
+                shape = numpy_helper.to_array(constants[next_node.input[1]])
+                if len(shape) != 2 or shape[1] != num_output:
+                    continue
+                reshape = next_node
+                next_node = single_consumer(reshape)
+            if next_node is None or next_node.op_type != 'Add':
+                continue
+            add_output = (reshape or node).output[0]
+            bias_name = next_node.input[1] if next_node.input[
+                0] == add_output else next_node.input[0]
+            if bias_name not in constants:
+                continue
+            bias_shape = list(constants[bias_name].dims)
+            if bias_shape not in [[num_output], [1, num_output]]:
+                continue
+            gemm = helper.make_node(
+                'Gemm',
+                inputs=[node.input[0], node.input[1], bias_name],
+                outputs=list(next_node.output))
+            removed.add(id(node))
+            if reshape is not None:
+                removed.add(id(reshape))
+            fused[id(next_node)] = gemm
+        nodes = list()
+        for node in self.graph.node:
+            if id(node) in removed:
+                continue
+            nodes.append(fused.get(id(node), node))
+        self.replace_nodes(nodes)
+
+    def remove_dead_nodes(self):
+        """
+        Remove the nodes and initializers that no graph output depends on.
+        """
+        used = set([value_info.name for value_info in self.graph.output])
+        nodes = list()
+        for node in reversed(self.graph.node):
+            if any([name in used for name in node.output]):
+                nodes.append(node)
+                used.update(node.input)
+        self.replace_nodes(reversed(nodes))
+        initializers = [
+            tensor for tensor in self.graph.initializer if tensor.name in used
+        ]
+        self.graph.ClearField('initializer')
+        self.graph.initializer.extend(initializers)
@@ -0,0 +1,276 @@
+# Copyright (c) 2020  PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Check whether all the ops of a model are supported before converting it, e.g.
+x2paddle --preflight --framework onnx --model model.onnx
+
+Only the op types of the graph are parsed, the weights are never decoded, and
+neither the source framework nor paddle is imported. The op types are checked
+against the handlers of the op mapper, which are read from its source, and the
+registered custom layers.
+"""
+
+import ast
+import os
+import time
+from collections import OrderedDict
+from google.protobuf import descriptor_pb2, descriptor_pool
+from x2paddle.core.logger import logger
+
+# messages with only the fields naming the ops, the other fields (weights,
+# attributes and shapes) are kept as unknown fields without being decoded
+_graph_protos = {
+    'tensorflow': {
+        'GraphDef': [('node', 1, 'NodeDef', True)],
+        'NodeDef': [('name', 1, 'string', False), ('op', 2, 'string', False)]
+    },
+    'onnx': {
+        'ModelProto': [('graph', 7, 'GraphProto', False)],
+        'GraphProto': [('node', 1, 'NodeProto', True)],
+        'NodeProto': [('name', 3, 'string', False),
+                      ('op_type', 4, 'string', False),
+                      ('domain', 7, 'string', False)]
+    },
+    'paddle2onnx': {
+        'ProgramDesc': [('blocks', 1, 'BlockDesc', True)],
+        'BlockDesc': [('idx', 1, 'int32', False), ('ops', 4, 'OpDesc', True)],
+        'OpDesc': [('type', 3, 'string', False)]
+    }
+}
+
+_message_classes = dict()
+_handler_tables = dict()
+
+
+def _get_message_class(desc):
+    try:
+        from google.protobuf.message_factory import GetMessageClass
+        return GetMessageClass(desc)
+    except ImportError:
+        from google.protobuf import message_factory
+        return message_factory.MessageFactory(desc.file.pool).GetPrototype(
+            desc)
+
+
+def get_message_class(framework, name):
+    if framework not in _message_classes:
+        FieldProto = descriptor_pb2.FieldDescriptorProto
+        package = 'x2paddle_preflight_' + framework
+        file_proto = descriptor_pb2.FileDescriptorProto(
+            name=package + '.proto', package=package, syntax='proto2')
+        for message_name, fields in _graph_protos[framework].items():
+            message = file_proto.message_type.add(name=message_name)
+            for field_name, number, field_type, repeated in fields:
+                field = message.field.add(name=field_name, number=number)
+                field.label = FieldProto.LABEL_REPEATED if repeated \
+                    else FieldProto.LABEL_OPTIONAL
+                if field_type == 'string':
+                    field.type = FieldProto.TYPE_STRING
+                elif field_type == 'int32':
+                    field.type = FieldProto.TYPE_INT32
+                else:
+                    field.type = FieldProto.TYPE_MESSAGE
+                    field.type_name = '.{}.{}'.format(package, field_type)
+        pool = descriptor_pool.DescriptorPool()
+        file_desc = pool.Add(file_proto)
+        if not hasattr(file_desc, 'message_types_by_name'):
+            file_desc = pool.FindFileByName(file_proto.name)
+        _message_classes[framework] = {
+            message_name: _get_message_class(desc)
+            for message_name, desc in file_desc.message_types_by_name.items()
+        }
+    return _message_classes[framework][name]
+
+
+def parse_graph(framework, path, message_name):
+    message = get_message_class(framework, message_name)()
+    with open(path, 'rb') as f:
+        message.ParseFromString(f.read())
+    return message
+
+
+def read_handler_table(module_path, class_name, table_names=[],
+                       with_methods=True):
+    """
+    Names of the methods of the class (if with_methods), and the keys of its
+    class level dicts (or the items of lists) in table_names, read from the
+    source of the module without importing it.
+    """
+    key = (module_path, class_name, tuple(table_names), with_methods)
+    if key in _handler_tables:
+        return _handler_tables[key]
+    with open(module_path) as f:
+        tree = ast.parse(f.read(), module_path)
+    handlers = set()
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef) or node.name != class_name:
+            continue
+        for item in node.body:
+            if isinstance(item, ast.FunctionDef):
+                if with_methods:
+                    handlers.add(item.name)
+            elif isinstance(item, ast.Assign):
+                names = [
+                    target.id for target in item.targets
+                    if isinstance(target, ast.Name)
+                ]
+                if not any([name in table_names for name in names]):
+                    continue
+                if isinstance(item.value, ast.Dict):
+                    elements = item.value.keys
+                elif isinstance(item.value, (ast.List, ast.Tuple, ast.Set)):
+                    elements = item.value.elts
+                else:
+                    continue
+                for element in elements:
+                    value = ast.literal_eval(element)
+                    if isinstance(value, str):
+                        handlers.add(value)
+    if len(handlers) == 0:
+        raise Exception("{} is not found in {}".format(class_name,
+                                                        module_path))
+    _handler_tables[key] = handlers
+    return handlers
+
+
+def _source_path(*names):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), *names)
+
+
+def tf_op_types(model_path, without_data_format_optimization=False):
+    graph_def = parse_graph('tensorflow', model_path, 'GraphDef')
+    ops = [(node.name, node.op) for node in graph_def.node]
+    if without_data_format_optimization:
+        supported = read_handler_table(
+            _source_path('op_mapper', 'tf_op_mapper_nhwc.py'),
+            'TFOpMapperNHWC', ['directly_map_ops', 'elementwise_ops'])
+    else:
+        supported = read_handler_table(
+            _source_path('op_mapper', 'tf_op_mapper.py'), 'TFOpMapper',
+            ['directly_map_ops', 'elementwise_ops'])
+    skipped = read_handler_table(
+        _source_path('decoder', 'tf_decoder.py'),
+        'TFGraph', ['identity_ops'],
+        with_methods=False)
+    return ops, supported | skipped
+
+
+def onnx_op_types(model_path):
+    from x2paddle.op_mapper.onnx_opsets.custom_layer import custom_layers
+    model = parse_graph('onnx', model_path, 'ModelProto')
+    ops = [(node.name, node.op_type) for node in model.graph.node]
+    supported = read_handler_table(
+        _source_path('op_mapper', 'onnx_opsets', 'opset9.py'), 'OpSet9',
+        ['default_op_mapping', 'elementwise_ops'])
+    # Dropout is removed by the decoder
+    return ops, supported | set(custom_layers) | set(['Dropout'])
+
+
+def caffe_op_types(proto_path, caffe_proto=None):
+    from google.protobuf import text_format
+    from x2paddle.decoder.caffe_decoder import CaffeResolver
+    from x2paddle.op_mapper.caffe_custom_layer import custom_layers
+    resolver = CaffeResolver(caffe_proto)
+    net = resolver.NetParameter()
+    with open(proto_path, 'rb') as f:
+        text_format.Merge(f.read(), net)
+    ops = [(name, 'Input') for name in net.input]
+    for layer in net.layers or net.layer:
+        if isinstance(layer.type, int):
+            type_str = resolver.layer_types[layer.type]
+        else:
+            type_str = layer.type
+        # the layers of the train phase and Dropout are filtered by the
+        # decoder
+        if len(layer.include) > 0 and layer.include[0].phase == 0:
+            continue
+        if type_str == 'Dropout':
+            continue
+        if type_str == 'DepthwiseConvolution':
+            type_str = 'ConvolutionDepthwise'
+        ops.append((layer.name, type_str))
+    supported = read_handler_table(
+        _source_path('op_mapper', 'caffe_op_mapper.py'), 'CaffeOpMapper',
+        ['directly_map_ops'])
+    return ops, supported | set(custom_layers)
+
+
+def paddle_op_types(model_dir):
+    program = parse_graph('paddle2onnx', os.path.join(model_dir, '__model__'),
+                          'ProgramDesc')
+    ops = list()
+    for block in program.blocks:
+        for i, op in enumerate(block.ops):
+            ops.append(('block{}/op{}'.format(block.idx, i), op.type))
+    supported = read_handler_table(
+        _source_path('op_mapper', 'paddle_op_mapper.py'), 'PaddleOpMapper')
+    return ops, supported
+
+
+def preflight(args):
+    """
+    Check the op types of the model in args, return a dict of the op counts
+    and the unsupported ops with the names of their first nodes.
+    """
+    start = time.time()
+    if args.framework == 'tensorflow':
+        assert args.model is not None, "--model should be defined"
+        ops, supported = tf_op_types(args.model,
+                                     args.without_data_format_optimization)
+    elif args.framework == 'onnx':
+        assert args.model is not None, "--model should be defined"
+        ops, supported = onnx_op_types(args.model)
+    elif args.framework == 'caffe':
+        assert args.prototxt is not None, "--prototxt should be defined"
+        ops, supported = caffe_op_types(args.prototxt, args.caffe_proto)
+    elif args.framework == 'paddle2onnx':
+        assert args.model is not None, "--model should be defined"
+        ops, supported = paddle_op_types(args.model)
+    else:
+        raise Exception(
+            "--framework only support tensorflow/caffe/onnx/paddle2onnx now")
+
+    op_counts = OrderedDict()
+    unsupported = OrderedDict()
+    for name, op in ops:
+        op_counts[op] = op_counts.get(op, 0) + 1
+        if op not in supported:
+            if op not in unsupported:
+                unsupported[op] = {'count': 0, 'node': name}
+            unsupported[op]['count'] += 1
+    return {
+        'framework': args.framework,
+        'nodes': len(ops),
+        'op_types': op_counts,
+        'unsupported_ops': unsupported,
+        'duration': time.time() - start
+    }
+
+
+def run_preflight(args):
+    """ print the result of the preflight, return True if it passed """
+    result = preflight(args)
+    logger.event('preflight', **result)
+    logger.info("{} nodes of {} op types checked in {:.3f}s".format(
+        result['nodes'], len(result['op_types']), result['duration']))
+    unsupported = result['unsupported_ops']
+    if len(unsupported) == 0:
+        logger.info("All the ops are supported.")
+        return True
+    logger.error("There are {} ops not supported yet, list as below".format(
+        len(unsupported)))
+    for op, info in unsupported.items():
+        logger.error("{:<30} {:>6} node(s), e.g. {}".format(op, info[
+            'count'], info['node']))
+    return False